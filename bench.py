@@ -0,0 +1,101 @@
+import collections
+import gc
+
+from superq import shutdown, superq, superqelem
+from time import perf_counter
+
+# number of elements per run and number of runs to take the best of
+N = 100000
+REPEAT = 5
+
+# returns best time in microseconds per op of running op over a fresh
+# collection built by setup, count times. Like timeit, gc is disabled while
+# timing so collections of earlier runs' garbage don't skew later ones
+def best(setup, op, count):
+    times = []
+    for i in range(0, REPEAT):
+        coll = setup()
+        gc.collect()
+        gc.disable()
+        start = perf_counter()
+        op(coll)
+        times.append(perf_counter() - start)
+        gc.enable()
+
+    return min(times) / count * 1000000
+
+def push(coll):
+    append = coll.append if isinstance(coll, collections.deque) else coll.push
+    for i in range(0, N):
+        append(i)
+
+def pop(coll):
+    for i in range(0, N):
+        coll.pop()
+
+def index(coll):
+    for i in range(0, N):
+        coll[i]
+
+def iterate(coll):
+    for val in coll:
+        pass
+
+# object with numFields str fields, for timing superqelem parsing
+class Wide():
+    def __init__(self, numFields):
+        for i in range(0, numFields):
+            setattr(self, 'f{0}'.format(i), 'value{0}'.format(i))
+
+# returns best time in microseconds per element of rebuilding a superq of
+# size elements from its string form
+def parse_sq(size):
+    sqStr = str(superq([Wide(4) for i in range(0, size)]))
+    return best(lambda: sqStr,
+                lambda s: superq(s, buildFromStr = True),
+                size)
+
+# returns best time in microseconds per field of rebuilding a superqelem of
+# size fields from its string form
+def parse_sqe(size):
+    sqeStr = str(superqelem(value = Wide(size)))
+    return best(lambda: sqeStr,
+                lambda s: superqelem(s, buildFromStr = True),
+                size)
+
+def bench(empty, full):
+    return [best(empty, push, N),
+            best(full, pop, N),
+            best(full, index, N),
+            best(full, iterate, N)]
+
+try:
+    print('{0} elements, best of {1} runs, usec per op\n'.format(N, REPEAT))
+
+    columns = [('deque',
+                bench(lambda: collections.deque(),
+                      lambda: collections.deque(range(N)))),
+               ('superq',
+                bench(lambda: superq([]),
+                      lambda: superq(list(range(N))))),
+               ('superq threadsafe=False',
+                bench(lambda: superq([], threadsafe = False),
+                      lambda: superq(list(range(N)), threadsafe = False)))]
+
+    print('{0:<10}'.format('op') +
+          ''.join('{0:>26}'.format(name) for name, results in columns))
+    for i, op in enumerate(['push', 'pop', 'index', 'iterate']):
+        print('{0:<10}'.format(op) +
+              ''.join('{0:>26.3f}'.format(results[i])
+                      for name, results in columns))
+
+    # parsing should cost the same per element or field at any size. The
+    # superqelems have one field for every 100 superq elements
+    print('\nparse, usec per element or field\n')
+    print('{0:<10}{1:>26}{2:>26}'.format('size', 'superq', 'superqelem'))
+    for size in [N // 8, N // 4, N // 2, N]:
+        print('{0:<10}{1:>26.3f}{2:>26.3f}'.format(size,
+                                                   parse_sq(size),
+                                                   parse_sqe(size // 100)))
+finally:
+    shutdown()
@@ -1,18 +1,29 @@
-from binascii import hexlify, rledecode_hqx, rlecode_hqx, unhexlify
+from array import array
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
 from copy import copy
+from dataclasses import fields as dataclass_fields, is_dataclass
 from enum import Enum
 from getopt import getopt
+from bisect import bisect_left, insort
+from heapq import heapify, heappop, heappush
+from itertools import count, islice
+from mmap import mmap, ACCESS_READ
 from os import kill
+from random import randrange
 from socket import socket, AF_INET, SOCK_STREAM
 from socketserver import TCPServer, ThreadingMixIn, StreamRequestHandler
 from sqlite3 import connect, OperationalError, Row
 from ssl import wrap_socket, CERT_NONE, CERT_REQUIRED, PROTOCOL_TLSv1
-from struct import pack, unpack
+from struct import pack, unpack, Struct
 from sys import argv, exit
-from threading import Condition, Lock, RLock, Thread
-from time import sleep
+from threading import Condition, Event, Lock, RLock, Thread
+from time import sleep, time
 from traceback import format_exc, print_stack
 from uuid import uuid4
+from weakref import WeakKeyDictionary
+
+import zlib
 
 from subprocess import Popen, STDOUT
 try:
@@ -27,6 +38,24 @@ except:
     # running on non-Windows platform
     WIN32_POPEN_FLAGS = None
 
+try:
+    from os import register_at_fork
+except ImportError:
+    # fork hooks are not available before Python 3.7
+    register_at_fork = None
+
+try:
+    import numpy
+except ImportError:
+    # columnar superq aggregates fall back to Python builtins
+    numpy = None
+
+try:
+    import lzma
+except ImportError:
+    # Python may be built without liblzma, leaving only the zlib codec
+    lzma = None
+
 DEFAULT_TCP_PORT = 9990
 DEFAULT_SSL_PORT = 9991
 
@@ -36,6 +65,19 @@ DEFAULT_SSL_KEY_FILE = 'server.key'
 # sets buffer size for network reads
 MAX_BUF_LEN = 4096
 
+# bytearray values shorter than this are stored raw by compressing codecs
+DEFAULT_CODEC_THRESHOLD = 128
+
+# total size of decompressed bytearray values kept for repeated reads
+BLOB_CACHE_SIZE = 64 * 1024 * 1024
+
+# binary snapshots written by superq.save(binary = True) start with the
+# magic bytes and format version. Elements are written in chunks of about
+# SNAPSHOT_CHUNK_SIZE bytes, each compressed on its own
+SNAPSHOT_MAGIC = b'SUPERQ'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024
+
 # superq network node supported commands
 SQNodeCmd = Enum('SQNodeCmd', 'superq_exists '
                               'superq_create '
@@ -46,7 +88,15 @@ SQNodeCmd = Enum('SQNodeCmd', 'superq_exists '
                               'superqelem_create '
                               'superqelem_read '
                               'superqelem_update '
-                              'superqelem_delete')
+                              'superqelem_delete '
+                              'superqelem_create_many '
+                              'superqelem_delete_many '
+                              'superq_task_done '
+                              'superq_join '
+                              'superq_rotate '
+                              'superq_sample '
+                              'superq_wait_any '
+                              'node_protocol')
 
 # local process datastore serving either user program or network node
 _dataStore = None
@@ -60,6 +110,25 @@ def log(msg):
     with open('node.output', 'a') as f:
         f.write('\n' + msg)
 
+# generated keys combine a random per-process prefix with a process-wide
+# counter. This is much cheaper than a uuid4() per key while keeping keys
+# unique across every process pushing to the same hosted superq
+_keyPrefix = uuid4().hex[:12]
+_keyCounter = count()
+
+def _reset_key_generator():
+    global _keyPrefix, _keyCounter
+
+    _keyPrefix = uuid4().hex[:12]
+    _keyCounter = count()
+
+# forked children must not continue the parent's key sequence
+if register_at_fork is not None:
+    register_at_fork(after_in_child = _reset_key_generator)
+
+def new_key(prefix = ''):
+    return prefix + _keyPrefix + '_' + str(next(_keyCounter))
+
 # base superq exception
 class SuperQEx(Exception):
     def __init__(self, value):
@@ -111,10 +180,195 @@ class ObjectNotRecognized(SuperQEx):
 
 # simple linked list element. superqelem inherits from this
 class LinkedListNode():
+    __slots__ = ('prev', 'next', '_llblock')
+
     def __init__(self):
         self.prev = None
         self.next = None
 
+# LinkedList walks nodes directly for lookups this close to either end rather
+# than building its positional index
+LINKEDLIST_WALK_LEN = 32
+
+# number of nodes per block when building a LinkedListIndex
+LINKEDLIST_BLOCK_LEN = 512
+
+# list of nodes that remembers its own position within a LinkedListIndex
+class LinkedListBlock(list):
+    __slots__ = ('pos',)
+
+# positional index over the nodes of a LinkedList. Nodes are arrayed in blocks
+# of up to 2 * blockLen nodes and a fenwick tree over the block lengths finds
+# the block holding a given position, so lookups, inserts and deletes by index
+# cost O(log n) instead of walking the list
+class LinkedListIndex():
+    def __init__(self, nodes = None, blockLen = LINKEDLIST_BLOCK_LEN):
+        self.blockLen = blockLen
+        self.blocks = []
+        self.count = 0
+
+        # fenwick tree of block lengths, 1-based
+        self.__tree = [0]
+
+        if nodes is not None:
+            block = LinkedListBlock()
+            for node in nodes:
+                if len(block) == blockLen:
+                    self.blocks.append(block)
+                    block = LinkedListBlock()
+                node._llblock = block
+                block.append(node)
+                self.count += 1
+
+            if block:
+                self.blocks.append(block)
+
+        self.__reindex()
+
+    def __len__(self):
+        return self.count
+
+    # renumbers blocks and rebuilds the fenwick tree after blocks change
+    def __reindex(self):
+        tree = [0] * (len(self.blocks) + 1)
+        for pos, block in enumerate(self.blocks):
+            block.pos = pos
+            tree[pos + 1] += len(block)
+
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+
+        self.__tree = tree
+
+    def __update(self, pos, delta):
+        tree = self.__tree
+        i = pos + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    # returns block holding idx and the offset of idx within that block
+    def __locate(self, idx):
+        tree = self.__tree
+        numBlocks = len(tree) - 1
+
+        pos = 0
+        step = 1 << (numBlocks.bit_length() - 1)
+        while step:
+            nextPos = pos + step
+            if nextPos <= numBlocks and tree[nextPos] <= idx:
+                pos = nextPos
+                idx -= tree[nextPos]
+            step >>= 1
+
+        return self.blocks[pos], idx
+
+    # returns offset of node within its block, checking the ends first
+    def __offset(self, node):
+        block = node._llblock
+        if block[0] is node:
+            return block, 0
+        elif block[-1] is node:
+            return block, len(block) - 1
+        return block, block.index(node)
+
+    def __split(self, block):
+        half = len(block) // 2
+
+        newBlock = LinkedListBlock(block[half:])
+        del block[half:]
+
+        for node in newBlock:
+            node._llblock = newBlock
+
+        self.blocks.insert(block.pos + 1, newBlock)
+        self.__reindex()
+
+    def __insert_at(self, block, offset, node):
+        block.insert(offset, node)
+        node._llblock = block
+        self.count += 1
+
+        if len(block) > 2 * self.blockLen:
+            self.__split(block)
+        else:
+            self.__update(block.pos, 1)
+
+    def __getitem__(self, idx):
+        block, offset = self.__locate(idx)
+        return block[offset]
+
+    def insert(self, idx, node):
+        if not self.blocks:
+            self.blocks.append(LinkedListBlock())
+            self.__reindex()
+
+        if idx >= self.count:
+            block = self.blocks[-1]
+            offset = len(block)
+        elif idx <= 0:
+            block = self.blocks[0]
+            offset = 0
+        else:
+            block, offset = self.__locate(idx)
+
+        self.__insert_at(block, offset, node)
+
+    def insert_before(self, oldNode, newNode):
+        block, offset = self.__offset(oldNode)
+        self.__insert_at(block, offset, newNode)
+
+    def insert_after(self, oldNode, newNode):
+        block, offset = self.__offset(oldNode)
+        self.__insert_at(block, offset + 1, newNode)
+
+    def remove(self, node):
+        block, offset = self.__offset(node)
+
+        del block[offset]
+        node._llblock = None
+        self.count -= 1
+
+        # drop empty blocks entirely
+        if not block:
+            del self.blocks[block.pos]
+            self.__reindex()
+        else:
+            self.__update(block.pos, -1)
+
+    # moves the last k nodes ahead of the rest, 0 < k < count
+    def rotate(self, k):
+        block, offset = self.__locate(self.count - k)
+
+        # split so the new first node starts a block
+        if offset > 0:
+            newBlock = LinkedListBlock(block[offset:])
+            del block[offset:]
+
+            for node in newBlock:
+                node._llblock = newBlock
+
+            pos = block.pos + 1
+            self.blocks.insert(pos, newBlock)
+        else:
+            pos = block.pos
+
+        self.blocks = self.blocks[pos:] + self.blocks[:pos]
+        self.__reindex()
+
+    # exchanges the positions of two indexed nodes
+    def swap(self, nodeA, nodeB):
+        blockA, offsetA = self.__offset(nodeA)
+        blockB, offsetB = self.__offset(nodeB)
+
+        blockA[offsetA] = nodeB
+        blockB[offsetB] = nodeA
+
+        nodeA._llblock = blockB
+        nodeB._llblock = blockA
+
 # doubly-linked list implementation used by superq and superqelem
 class LinkedList():
     def __init__(self, circular = False):
@@ -122,29 +376,55 @@ class LinkedList():
         self.tail = None
         self.__count = 0
 
+        # positional index, built the first time a lookup needs it
+        self.__index = None
+
+        # tuple of nodes shared by snapshot() callers until the next change
+        self.__snapshot = None
+
         # llist can iterate circularly
         self.circular = circular
 
     def __len__(self):
         return self.__count
 
+    # each iteration keeps its own cursor, so iterations don't disturb each
+    # other. The list must not change during iteration, see snapshot()
     def __iter__(self):
-        self.__next = self.head
-        return self
+        node = self.head
+        while node is not None:
+            yield node
 
-    def __next__(self):
-        returnObj = self.__next
+            node = node.next
+            if node is None and self.circular:
+                node = self.head
 
-        if returnObj is None:
-            if self.circular:
-                self.__next = self.head
-                returnObj = self.__next
-            else:
-                raise StopIteration
+    # returns the nodes as a tuple, which stays valid whatever later happens
+    # to the list. The tuple is built once and reused until the list changes
+    def snapshot(self):
+        if self.__snapshot is None:
+            nodes = []
+            node = self.head
+            while node is not None:
+                nodes.append(node)
+                node = node.next
 
-        self.__next = returnObj.next
+            self.__snapshot = tuple(nodes)
 
-        return returnObj
+        return self.__snapshot
+
+    def __get_index(self):
+        if self.__index is None:
+            # walk the nodes directly so any active iteration is undisturbed
+            nodes = []
+            node = self.head
+            while node is not None:
+                nodes.append(node)
+                node = node.next
+
+            self.__index = LinkedListIndex(nodes)
+
+        return self.__index
 
     def __lookup(self, idx):
         # convert negative index to positive
@@ -155,21 +435,25 @@ class LinkedList():
             raise IndexError('idx ({0}/{1}) out of range'.format(idx,
                                                                  len(self)))
 
-        if self.__count == 0:
-            return None
-
-        # start from whichever end of list is closest to idx
-        midIdx = (self.__count - 1) // 2
-        if idx < midIdx:
-            item = self.head
-            for i in range(0, idx):
-                item = item.next
-        else:
-            item = self.tail
-            for i in range(0, (self.__count - 1) - idx):
-                item = item.prev
-
-        return item
+        if idx == 0:
+            return self.head
+        elif idx == self.__count - 1:
+            return self.tail
+
+        # use index unless idx is close enough to an end to walk cheaply
+        if self.__index is None:
+            if idx < LINKEDLIST_WALK_LEN:
+                item = self.head
+                for i in range(0, idx):
+                    item = item.next
+                return item
+            elif (self.__count - 1) - idx < LINKEDLIST_WALK_LEN:
+                item = self.tail
+                for i in range(0, (self.__count - 1) - idx):
+                    item = item.prev
+                return item
+
+        return self.__get_index()[idx]
 
     def __slice(self, slice_):
         newLst = LinkedList()
@@ -218,6 +502,26 @@ class LinkedList():
 
         return newLst
 
+    # returns nodes selected by slice_ without copying them
+    def slice_nodes(self, slice_):
+        start, stop, step = slice_.indices(len(self))
+
+        nodes = []
+        numNodes = len(range(start, stop, step))
+        if numNodes == 0:
+            return nodes
+
+        node = self.__getitem__(start)
+        while True:
+            nodes.append(node)
+            if len(nodes) == numNodes:
+                break
+
+            for i in range(0, abs(step)):
+                node = node.next if step > 0 else node.prev
+
+        return nodes
+
     def __getitem__(self, val):
         if isinstance(val, slice):
             return self.__slice(val)
@@ -255,18 +559,20 @@ class LinkedList():
         else:
             curNode = self.__lookup(idx)
 
-            # handle empty list case
-            if curNode is None:
-                self.head = node
-                self.tail = node
-                node.prev = None
-                node.next = None
-            else:
-                # splice new node in
-                node.next = curNode
-                node.prev = curNode.prev
-                curNode.prev.next = node
-                curNode.prev = node
+            # convert negative index to positive for the positional index
+            if idx < 0:
+                idx += self.__count
+
+            # splice new node in
+            node.next = curNode
+            node.prev = curNode.prev
+            curNode.prev.next = node
+            curNode.prev = node
+
+        self.__snapshot = None
+
+        if self.__index is not None:
+            self.__index.insert(idx, node)
 
         self.__count += 1
 
@@ -293,15 +599,8 @@ class LinkedList():
             # if list not empty, tell head it has no prev         
             if self.head is not None:
                 self.head.prev = None
-
-            # one less element in the list
-            self.__count -= 1
-
-            # if down to 1 element, set tail to head
-            if self.__count == 1:
-                self.tail = self.head
-                
-            return item
+            else:
+                self.tail = None
         elif idx >= self.__count - 1:
             # get list tail
             item = self.tail
@@ -312,26 +611,24 @@ class LinkedList():
             # if list not empty, tell tail it has no next
             if self.tail is not None:
                 self.tail.next = None
+            else:
+                self.head = None
+        else:
+            item = self.__lookup(idx)
 
-            # one less element in the list
-            self.__count -= 1
-
-            # if down to 1 element, set head to tail
-            if self.__count == 1:
-                self.head = self.tail
+            # because item is not head or tail, these dereferences are safe
+            item.prev.next = item.next
+            item.next.prev = item.prev
 
-            return item
-        else:
-            curNode = self.__lookup(idx)
+        self.__snapshot = None
 
-            # because curNode is not head or tail, these dereferences are safe
-            curNode.prev.next = curNode.next
-            curNode.next.prev = curNode.prev
+        if self.__index is not None:
+            self.__index.remove(item)
 
-            # one less element in the list
-            self.__count -= 1
+        # one less element in the list
+        self.__count -= 1
 
-            return curNode
+        return item
           
     def pop_head(self):
         return self.pop(0)
@@ -356,6 +653,11 @@ class LinkedList():
         else:
             self.tail = node.prev
 
+        self.__snapshot = None
+
+        if self.__index is not None:
+            self.__index.remove(node)
+
         self.__count -= 1
 
         return node
@@ -376,11 +678,16 @@ class LinkedList():
             oldNode.prev.next = newNode
             oldNode.prev = newNode
 
+        self.__snapshot = None
+
+        if self.__index is not None:
+            self.__index.insert_before(oldNode, newNode)
+
         self.__count += 1
 
     def insert_after(self, oldNode, newNode):
         if self.__count < 1:
-            raise SuperQEx('Calling insert_before() on empty list.')
+            raise SuperQEx('Calling insert_after() on empty list.')
 
         # handle case inserting new tail
         if self.tail == oldNode:
@@ -394,6 +701,11 @@ class LinkedList():
             oldNode.next.prev = newNode
             oldNode.next = newNode
 
+        self.__snapshot = None
+
+        if self.__index is not None:
+            self.__index.insert_after(oldNode, newNode)
+
         self.__count += 1
 
     def move_up(self, node):
@@ -414,35 +726,56 @@ class LinkedList():
         current_node.next = above_node
         above_node.prev = current_node
         above_node.next = current_node_next
-        above_node.next.prev = above_node
+        if current_node_next is not None:
+            current_node_next.prev = above_node
+        else:
+            self.tail = above_node
 
         # if node is at top of list, set head to node
         if current_node.prev is None:
             self.head = current_node
 
+        self.__snapshot = None
+
+        if self.__index is not None:
+            self.__index.swap(current_node, above_node)
+
     def move_down(self, node):
-        # can't move list node up if it is already head
-        if node.prev is None:
+        # can't move list node down if it is already tail
+        if node.next is None:
             return
 
-        # these are aliases to the 4 starting elements involved
-        above_node_prev = node.prev.prev
-        above_node = node.prev
-        current_node = node
-        current_node_next = node.next
+        # moving node down is the same as moving the node below it up
+        self.move_up(node.next)
 
-        # do the pointer swaps
-        if above_node_prev is not None:
-            above_node_prev.next = current_node
-        current_node.prev = above_node_prev
-        current_node.next = above_node
-        above_node.prev = current_node
-        above_node.next = current_node_next
-        above_node.next.prev = above_node
+    # rotates nodes n steps to the right, or left if n is negative, by
+    # splicing the list into a ring and breaking it at the new head
+    def rotate(self, n):
+        if self.__count < 2:
+            return
 
-        # if node is at top of list, set head to node
-        if current_node.prev is None:
-            self.head = current_node
+        k = n % self.__count
+        if k == 0:
+            return
+
+        newHead = self.__lookup(self.__count - k)
+        newTail = newHead.prev
+
+        self.tail.next = self.head
+        self.head.prev = self.tail
+        newTail.next = None
+        newHead.prev = None
+
+        self.head = newHead
+        self.tail = newTail
+
+        self.__snapshot = None
+
+        if self.__index is not None:
+            self.__index.rotate(k)
+
+# bound parameters allowed per statement by older sqlite builds
+DB_MAX_VARIABLES = 999
 
 def db_exec(dbConn, sql, values = None):
     errors = 0
@@ -472,6 +805,38 @@ def db_exec(dbConn, sql, values = None):
 
     dbConn.commit()
 
+# executes sql once per row of values and commits them as one transaction
+def db_exec_many(dbConn, sql, valuesLst):
+    errors = 0
+    while True:
+        try:
+            dbConn.executemany(sql, valuesLst)
+            break
+        except OperationalError as e:
+            # roll back any partially applied rows before retrying
+            dbConn.rollback()
+
+            # limit the amount of spinning in case there is a real error
+            errors += 1
+            if errors > 10:
+                raise DBExecError('sql: {0}\n'
+                                  'values: {1} rows\n'
+                                  'exception: {2}'.format(sql,
+                                                          len(valuesLst),
+                                                          str(e)))
+
+            # see db_exec() regarding shared cache mode spinning
+            sleep(.01)
+        except Exception as e:
+            dbConn.rollback()
+            raise DBExecError('sql: {0}\n'
+                              'values: {1} rows\n'
+                              'exception: {2}'.format(sql,
+                                                      len(valuesLst),
+                                                      str(e)))
+
+    dbConn.commit()
+
 def db_select(dbConn, sql, values = None):
     rowLst = []
     dbConn.row_factory = Row
@@ -495,6 +860,12 @@ def db_create_table(dbConn, tableName, colStr, values = None):
             'CREATE TABLE {0} ({1});'.format(tableName, colStr),
             values)
 
+def db_create_index(dbConn, tableName, colName, values = None):
+    db_exec(dbConn,
+            'CREATE INDEX {0}_{1}_idx ON {0} ({1});'.format(tableName,
+                                                          colName),
+            values)
+
 def db_delete_table(dbConn, tableName, values = None):
     db_exec(dbConn,
             'DROP TABLE {0};'.format(tableName),
@@ -507,6 +878,17 @@ def db_create_row(dbConn, tableName, colStr, valStr, values = None):
                                                          valStr),
             values)
 
+def db_create_rows(dbConn, tableName, colStr, valStr, valuesLst):
+    db_exec_many(dbConn,
+                 'INSERT INTO {0} ({1}) VALUES ({2});'.format(tableName,
+                                                              colStr,
+                                                              valStr),
+                 valuesLst)
+
+# renders bytes as an sqlite blob literal for building statements
+def db_blob_str(data):
+    return "X'{0}'".format(hexlify(data).decode('ascii'))
+
 def db_update_row(dbConn, tableName, updateStr, key, keyVal, values = None):
     db_exec(dbConn,
             'UPDATE {0} SET {1} WHERE {2} = {3};'.format(tableName,
@@ -522,6 +904,47 @@ def db_delete_row(dbConn, tableName, key, keyVal, values = None):
                                                       keyVal),
             values)
 
+# deletes every row whose key is in keyVals, binding keys as parameters.
+# Keys are deleted in chunks but committed as one transaction
+def db_delete_rows(dbConn, tableName, key, keyVals):
+    errors = 0
+    while True:
+        try:
+            # stay under sqlite's default limit on bound parameters per
+            # statement
+            for i in range(0, len(keyVals), DB_MAX_VARIABLES):
+                chunk = keyVals[i : i + DB_MAX_VARIABLES]
+                dbConn.execute('DELETE FROM {0} WHERE {1} IN ({2});'.format(
+                                   tableName,
+                                   key,
+                                   ','.join('?' * len(chunk))),
+                               tuple(chunk))
+            break
+        except OperationalError as e:
+            # roll back chunks already deleted before retrying
+            dbConn.rollback()
+
+            # limit the amount of spinning in case there is a real error
+            errors += 1
+            if errors > 10:
+                raise DBExecError('table: {0}\n'
+                                  'keys: {1}\n'
+                                  'exception: {2}'.format(tableName,
+                                                          len(keyVals),
+                                                          str(e)))
+
+            # see db_exec() regarding shared cache mode spinning
+            sleep(.01)
+        except Exception as e:
+            dbConn.rollback()
+            raise DBExecError('table: {0}\n'
+                              'keys: {1}\n'
+                              'exception: {2}'.format(tableName,
+                                                      len(keyVals),
+                                                      str(e)))
+
+    dbConn.commit()
+
 # instantiated for each superq app and for each network node process
 class SuperQDataStore():
     def __init__(self):
@@ -614,9 +1037,11 @@ class SuperQDataStore():
                 sq.attached = True
                 self.superqdict[publicName] = sq
             else:
-                # rebuild existing superq instance using incoming superq
+                # rebuild existing superq instance using incoming superq.
+                # Its bytes values are handed over as buffers, not copied
                 knownSq = self.superqdict[publicName]
-                knownSq.buildFromStr(str(sq))
+                buffers = []
+                knownSq.buildFromBytes(sq.to_bytes(buffers), buffers = buffers)
 
                 sq = knownSq
         else:
@@ -645,13 +1070,35 @@ class SuperQDataStore():
             db_delete_table(dbConn, sq.name)
             self.__return_dbConn(dbConn)
 
-    def superq_query_local(self, queryStr, objSample = None):
+    # only hosted superqs reach the datastore for task tracking
+    def superq_task_done(self, sq, secure = False):
+        self.networkClient.superq_task_done(sq, secure)
+
+    def superq_join(self, sq, secure = False):
+        self.networkClient.superq_join(sq, secure)
+
+    # only hosted superqs keep element order outside of memory
+    def superq_rotate(self, sq, n, secure = False):
+        self.networkClient.superq_rotate(sq, n, secure)
+
+    def superq_sample(self, sq, k, secure = False):
+        return self.networkClient.superq_sample(sq, k, secure)
+
+    def superq_wait_any(self, sqs, timeout = None, secure = False):
+        return self.networkClient.superq_wait_any(sqs, timeout, secure)
+
+    def superq_query_local(self, queryStr, objSample = None, plans = None):
         dbConn = self.__get_dbConn()
         rows = db_select(dbConn, queryStr)
         self.__return_dbConn(dbConn)
 
         newSq = superq([])
 
+        # every row has the same columns, so multi-value rows share field
+        # names and a demarshal plan
+        fieldNames = None
+        plan = None
+
         for row in rows:
             # demarshal single-value objects
             if isinstance(objSample, str):
@@ -664,38 +1111,23 @@ class SuperQDataStore():
                 newSq.create_elem(float(row['_val_']))
                 continue
             elif isinstance(objSample, bytearray):
-                newSq.create_elem(bytearray(row['_val_']))
-
-            if objSample is None:
-                newObj = superqelem(parentSq = newSq)
-            else:
-                newObj = copy(objSample)
-
-            # demarshal multi-value objects
-            for col in row.keys():
-                # extract field name from col name
-                colElems = col.split('.')
-                fieldName = colElems[len(colElems) - 1]
+                newSq.create_elem(bytearray(decompress_bytes(row['_val_'])))
+                continue
 
-                if isinstance(newObj, superqelem):
-                    newObj.add_atom(fieldName, 'str', row[fieldName])
-                    continue
+            if fieldNames is None:
+                # extract field names from col names
+                fieldNames = tuple(col.split('.')[-1] for col in row.keys())
 
-                objVal = getattr(newObj, fieldName)
-                if isinstance(objVal, str):
-                    val = str(row[fieldName])
-                elif isinstance(objVal, int):
-                    val = int(row[fieldName])
-                elif isinstance(objVal, float):
-                    val = float(row[fieldName])
-                elif isinstance(objVal, bytearray):
-                    # bytearrays must be uncompressed
-                    val = rledecode_hqx(bytearray(row[fieldName]))
-                else:
-                    valType = type(objVal)
-                    raise TypeError('unsupported type ({0})'.format(valType))
+                if objSample is not None:
+                    plan = demarshal_plan(objSample, fieldNames, plans)
 
-                setattr(newObj, fieldName, val)
+            # demarshal multi-value objects
+            if plan is None:
+                newObj = superqelem(parentSq = newSq)
+                for fieldName, value in zip(fieldNames, row):
+                    newObj.add_atom(fieldName, 'str', value)
+            else:
+                newObj = plan.build(objSample, row)
 
             newSq.create_elem(newObj)
 
@@ -744,7 +1176,9 @@ class SuperQDataStore():
 
         # execute query locally if superq is not public or the datastore is
         if sq.host is None or self.public:
-            return self.superq_query_local(queryStr, objSample)
+            return self.superq_query_local(queryStr,
+                                           objSample,
+                                           sq.demarshalPlans)
 
         resultSq = self.networkClient.superq_query(sq, queryStr, secure)
 
@@ -753,6 +1187,11 @@ class SuperQDataStore():
 
         newSq = superq([])
 
+        # result sqes share an interned schema, so the plan is only looked up
+        # again if the schema changes
+        schema = None
+        plan = None
+
         # if there is a sample object available, demarshal accordingly
         for sqe in resultSq:
             # demarshal single-value objects
@@ -766,35 +1205,18 @@ class SuperQDataStore():
                 newSq.create_elem(float(sqe['_val_']))
                 continue
             elif isinstance(objSample, bytearray):
-                newSq.create_elem(bytearray(sqe['_val_']))
+                newSq.create_elem(bytearray(decompress_bytes(sqe['_val_'])))
                 continue
 
-            newObj = copy(objSample)
-
-            # demarshal multi-value objects
-            for atom in sqe:
-                col = atom.name
-
-                # extract field name from col name
-                colElems = col.split('.')
-                fieldName = colElems[len(colElems) - 1]
-
-                objVal = getattr(newObj, fieldName)
-                if isinstance(objVal, str):
-                    val = str(atom.value)
-                elif isinstance(objVal, int):
-                    val = int(atom.value)
-                elif isinstance(objVal, float):
-                    val = float(atom.value)
-                elif isinstance(objVal, bytearray):
-                    val = bytearray(atom.value)
-                else:
-                    valType = type(objVal)
-                    raise TypeError('unsupported type ({0})'.format(valType))
+            if sqe.schema is not schema:
+                schema = sqe.schema
 
-                setattr(newObj, fieldName, val)
+                # extract field names from col names
+                fieldNames = tuple(name.split('.')[-1] for name in schema.names)
+                plan = demarshal_plan(objSample, fieldNames, sq.demarshalPlans)
 
-            newSq.create_elem(newObj)
+            # demarshal multi-value objects
+            newSq.create_elem(plan.build(objSample, sqe.values))
 
         return newSq
 
@@ -814,40 +1236,93 @@ class SuperQDataStore():
 
         # the backing db table is only created when the 1st element is added
         if createTable:
-            dbConn = self.__get_dbConn()
-            db_create_table(dbConn, sq.name, sq.nameTypeStr)
-            self.__return_dbConn(dbConn)
+            self.__create_table(sq)
 
-        valStr = ''
-        values = []
-        if sqe.value is not None:
-            valStr += '?,?,?'
-            values.append(sqe.name)
-            values.append(sqe.value)
-            values.append(sqe.links)
-        else:
-            atomDict = sqe.dict()
-            for colName in sq.colNames:
-                # support standard columns
-                if colName == '_name_':
-                    valStr += '?,'
-                    values.append(sqe.name)
-                    continue
-                elif colName == '_links_':
-                    valStr += '?,'
-                    values.append(sqe.links)
-                    continue;
+        values = self.__superqelem_row(sq, sqe)
+        valStr = ','.join('?' * len(values))
+
+        dbConn = self.__get_dbConn()
+        db_create_row(dbConn, sq.name, sq.nameStr, valStr, values)
+        self.__return_dbConn(dbConn)
+
+    def superqelem_create_many(self,
+                               sq,
+                               sqes,
+                               createTable = False,
+                               secure = False):
+        # private datastore call public
+        if sq.host is not None and not self.public:
+            self.networkClient.superqelem_create_many(sq, sqes, secure)
+            return
+
+        if not sqes:
+            return
+
+        # the backing db table is only created when the 1st element is added
+        if createTable:
+            self.__create_table(sq)
+
+        rows = [self.__superqelem_row(sq, sqe) for sqe in sqes]
+        valStr = ','.join('?' * len(rows[0]))
+
+        # all rows are inserted in a single transaction
+        dbConn = self.__get_dbConn()
+        db_create_rows(dbConn, sq.name, sq.nameStr, valStr, rows)
+        self.__return_dbConn(dbConn)
+
+    # replaces the row in a ring superq sqe's slot with a single UPDATE
+    def superqelem_overwrite(self, sq, sqe, secure = False):
+        # private datastore call public. The node overwrites a slot of its
+        # own when the create reaches its full copy of the superq
+        if sq.host is not None and not self.public:
+            self.networkClient.superqelem_create(sq, sqe, None, secure)
+            return
 
-                atom = atomDict[colName]
+        # _slot_ is always the last column
+        values = self.__superqelem_row(sq, sqe)
+        updateStr = ','.join('{0}=?'.format(colName)
+                             for colName in sq.colNames[ : -1])
 
-                values.append(atom.value)
-                valStr += '?,'
-            valStr = valStr.rstrip(',')
+        dbConn = self.__get_dbConn()
+        db_update_row(dbConn, sq.name, updateStr, '_slot_', '?', values)
+        self.__return_dbConn(dbConn)
 
+    def __create_table(self, sq):
         dbConn = self.__get_dbConn()
-        db_create_row(dbConn, sq.name, sq.nameStr, valStr, tuple(values))
+        db_create_table(dbConn, sq.name, sq.nameTypeStr)
+
+        # index priority column so ORDER BY queries on it avoid a table scan
+        if sq.priority is not None:
+            if sq.priority in sq.colNames:
+                db_create_index(dbConn, sq.name, sq.priority)
+            else:
+                # scalar superqs are prioritized by value
+                db_create_index(dbConn, sq.name, '_val_')
+
         self.__return_dbConn(dbConn)
 
+    # returns column values of sqe in the order of sq.nameStr
+    def __superqelem_row(self, sq, sqe):
+        if sqe.value is not None:
+            if sq.ring:
+                return (sqe.name, sqe.value, sqe.links, sq.ringSlots[sqe.name])
+            return (sqe.name, sqe.value, sqe.links)
+
+        values = []
+        fieldIdx = sqe.schema.idx
+        for colName in sq.colNames:
+            # support standard columns
+            if colName == '_name_':
+                values.append(sqe.name)
+            elif colName == '_links_':
+                values.append(sqe.links)
+            elif colName == '_slot_':
+                values.append(sq.ringSlots[sqe.name])
+            else:
+                values.append(sqe.values[fieldIdx[colName]])
+
+        return tuple(values)
+
     def __superqelem_update_db(self, sq, sqe):
         # support autoKey
         keyCol = sq.keyCol
@@ -859,6 +1334,8 @@ class SuperQDataStore():
             val = sqe.value
             if sqe.valueType.startswith('str'):
                 val = "'{0}'".format(val)
+            elif sqe.valueType.startswith('byte'):
+                val = db_blob_str(val)
             
             updateStr = '{0}={1}'.format('_val_', val)
         else:
@@ -873,10 +1350,16 @@ class SuperQDataStore():
                 elif name == '_links_':
                     # deal with links column after all the rest
                     continue
+                elif name == '_slot_':
+                    # slots only change when sqes are overwritten
+                    continue
 
                 val = sqe[sq.colNames[i]]
                 if sq.colTypes[i].startswith('str'):
                     val = "'{0}'".format(val)
+                elif sq.colTypes[i].startswith('byte'):
+                    # rows hold bytearrays compressed, as sqes do
+                    val = db_blob_str(sqe.values[sqe.schema.idx[name]])
 
                 updateStr += '{0}={1},'.format(name, val)
             updateStr = updateStr.rstrip(',')
@@ -936,106 +1419,561 @@ class SuperQDataStore():
         db_delete_row(dbConn, sq.name, keyCol, sqeName)
         self.__return_dbConn(dbConn)
 
-class elematom(LinkedListNode):
-    def __init__(self, name, type_, value):
-        LinkedListNode.__init__(self)
+    def superqelem_delete_many(self, sq, sqeNames, secure = False):
+        # private datastore call public
+        if sq.host is not None and not self.public:
+            self.networkClient.superqelem_delete_many(sq, sqeNames, secure)
+            return
 
-        self.name = name
-        self.type = type_
-        self.value = value
+        if not sqeNames:
+            return
 
-class superqelem(LinkedListNode):
-    def __init__(self,
-                 name = None,
-                 value = None,
-                 parentSq = None,
-                 buildFromStr = False):
-        LinkedListNode.__init__(self)
+        # support autoKey
+        keyCol = sq.keyCol
+        if keyCol is None:
+            keyCol = '_name_'
 
-        # list of elematoms
-        self.__internalList = LinkedList()
+        dbConn = self.__get_dbConn()
+        db_delete_rows(dbConn, sq.name, keyCol, sqeNames)
+        self.__return_dbConn(dbConn)
 
-        # dictionary of elematoms, keyed by 'field' name
-        self.__internalDict = {}
+# codecs for bytearray values by name, as (compress, decompress) pairs of
+# callables taking and returning bytes-like objects
+_byteCodecs = {'none': (bytes, bytes),
+               'zlib': (zlib.compress, zlib.decompress)}
+if lzma is not None:
+    _byteCodecs['lzma'] = (lzma.compress, lzma.decompress)
+
+# makes a codec available to superqs by name. Every process reading the
+# values, including network nodes, must register the same codec
+def register_codec(name, compress, decompress):
+    # names are serialized with superq attributes and prefix values
+    if (not name or len(name.encode('utf-8')) > 255 or
+        any(c in name for c in ',|;=/')):
+        raise ValueError('invalid codec name ({0})'.format(name))
+
+    _byteCodecs[name] = (compress, decompress)
+
+def check_codec(name):
+    if name not in _byteCodecs:
+        raise ValueError('unknown codec ({0})'.format(name))
+
+# decompressed bytearray values, keyed by the identity of their compressed
+# form so reading the same field again does not decompress it again. The
+# compressed object is held alongside so its id cannot be reused while
+# cached. Bounded by the total size of the decompressed values
+class SuperQBlobCache():
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, data):
+        with self.__lock:
+            entry = self.__entries.get(id(data))
+            if entry is None or entry[0] is not data:
+                return None
+
+            self.__entries.move_to_end(id(data))
+            return entry[1]
+
+    def put(self, data, value):
+        if len(value) > self.maxSize:
+            return
 
-        # any sqe can link to any number of other sqes
-        self.links = ''
-        self.linksDict = {}
+        with self.__lock:
+            entry = self.__entries.pop(id(data), None)
+            if entry is not None:
+                self.size -= len(entry[1])
 
-        if name is None:
-            name = str(uuid4().hex)
+            self.__entries[id(data)] = (data, value)
+            self.size += len(value)
 
-        self.name = name
-        self.value = value
+            # evict least recently read values
+            while self.size > self.maxSize:
+                oldData, oldValue = self.__entries.popitem(last = False)[1]
+                self.size -= len(oldValue)
 
-        if self.value is None:
-            self.value = name
+_blobCache = SuperQBlobCache(BLOB_CACHE_SIZE)
 
-        self.parentSq = parentSq
+# compressed values start with the length of their codec name and the name
+# itself, so they can be decompressed wherever they end up. Values stored
+# raw only carry a zero byte
+def compress_bytes(value, codec = 'none', threshold = 0):
+    if codec == 'none' or len(value) < threshold:
+        return b'\x00' + value
 
-        # used to remember user object for local instance
-        self.obj = None
+    name = codec.encode('utf-8')
 
-        # construct publicName property and add it to the class
-        getter = lambda self: self.__get_publicName()
-        setattr(self.__class__,
-                'publicName',
-                property(fget = getter, fset = None))
+    return bytes((len(name),)) + name + _byteCodecs[codec][0](value)
 
-        if buildFromStr:
-            self.__buildFromStr(self.value)
-            return
+def decompress_bytes(data):
+    nameLen = data[0]
+    if nameLen == 0:
+        return bytes(memoryview(data)[1 : ])
 
-        if not isinstance(self.name, (str, int, float)):
-            raise TypeError('invalid name type ({0})'.format(type(self.name)))
+    value = _blobCache.get(data)
+    if value is None:
+        name = bytes(data[1 : nameLen + 1]).decode('utf-8')
+        if name not in _byteCodecs:
+            raise ValueError('unknown codec ({0})'.format(name))
 
-        # handle scalars
-        self.valueType = ''
-        if isinstance(value, (str, int, float)):
-            self.valueType = type(self.value).__name__
-            return
-        elif isinstance(value, bytearray):
-            # compress bytearray
-            self.value = rlecode_hqx(value)
+        value = bytes(_byteCodecs[name][1](data[nameLen + 1 : ]))
+        _blobCache.put(data, value)
 
-            self.valueType = type(self.value).__name__
-            return
+    return value
 
-        # only scalars keep value set
-        self.value = None
+# compresses a bytearray value for field name of sqe with the codec its
+# superq sets for the field. Scalar values are field _val_
+def compress_field(sqe, name, value):
+    sq = sqe.parentSq
+    if sq is None:
+        return compress_bytes(value)
 
-        # non-scalars should 'remember' the user object they're created from
-        self.obj = value
+    codec = sq.codec
+    if isinstance(codec, dict):
+        codec = codec.get(name, 'none')
 
-        # handle non-scalars
-        self.obj = value
-        for attrName in dir(value):
-            attr = getattr(value, attrName)
+    return compress_bytes(value, codec, sq.codecThreshold)
 
-            # skip private attributes and callables
-            if attrName.startswith('_') or callable(attr):
-                continue
+# field names and types of non-scalar superqelems. Schemas are interned: adding
+# a field to a schema always returns the same child schema, so every
+# superqelem with the same fields shares one schema and only stores values
+class superqschema():
+    __slots__ = ('names', 'types', 'idx', '__children', '__elemClass')
+
+    def __init__(self, names = (), types = ()):
+        self.names = names
+        self.types = types
+
+        # maps field name to position in names, types and superqelem values
+        self.idx = {name: i for i, name in enumerate(names)}
+
+        # schemas reached by adding one more field, keyed by (name, type)
+        self.__children = {}
+
+        # superqelem subclass exposing fields as properties, built on demand
+        self.__elemClass = None
+
+    def __len__(self):
+        return len(self.names)
+
+    # returns the interned schema with the given fields, skipping the walk
+    # through add_field() once the fields have been seen
+    @staticmethod
+    def lookup(names, types):
+        key = (names, types)
+
+        schema = _schemasByFields.get(key)
+        if schema is None:
+            schema = _emptySchema
+            for name, type_ in zip(names, types):
+                schema = schema.add_field(name, type_)
+            schema = _schemasByFields.setdefault(key, schema)
+
+        return schema
+
+    def add_field(self, name, type_):
+        key = (name, type_)
+
+        schema = self.__children.get(key)
+        if schema is None:
+            schema = self.__children.setdefault(
+                key,
+                superqschema(self.names + (name,), self.types + (type_,)))
+
+        return schema
+
+    # returns the superqelem subclass for this schema, creating it once
+    def elem_class(self):
+        if self.__elemClass is None:
+            # scalars and field-less objects need no properties
+            if not self.names:
+                return superqelem
+
+            classDict = {'__slots__': ()}
+            for idx, name in enumerate(self.names):
+                # fields shadowing superqelem attributes are only reachable
+                # through sqe[name]
+                if hasattr(superqelem, name):
+                    continue
+
+                if self.types[idx].startswith('byte'):
+                    classDict[name] = _bytes_field_property(idx, name)
+                else:
+                    classDict[name] = _field_property(idx, name)
+
+            self.__elemClass = type('superqelem', (superqelem,), classDict)
+
+        return self.__elemClass
+
+# builds a superqelem property for the field stored at values[idx]
+def _field_property(idx, attr):
+    def getter(self):
+        return self.values[idx]
+
+    def setter(self, value):
+        # remember attribute
+        self.values[idx] = value
+
+        # maintain state if there is an original user object
+        if self.obj is not None:
+            setattr(self.obj, attr, value)
+
+        # trigger update
+        if self.parentSq is not None:
+            self.parentSq.update_elem_datastore_only(self)
+
+    return property(fget = getter, fset = setter)
+
+# builds a superqelem property for the bytearray field stored at values[idx]
+def _bytes_field_property(idx, attr):
+    def getter(self):
+        # uncompress and return data
+        return decompress_bytes(self.values[idx])
+
+    def setter(self, value):
+        # compress and store data
+        self.values[idx] = compress_field(self, attr, value)
+
+        # maintain state if there is an original user object
+        if self.obj is not None:
+            setattr(self.obj, attr, value)
+
+        # trigger update
+        if self.parentSq is not None:
+            self.parentSq.update_elem_datastore_only(self)
+
+    return property(fget = getter, fset = setter)
+
+# the empty schema is shared by scalar superqelems and is the root of all others
+_emptySchema = superqschema()
+
+# schemas by their names and types, see superqschema.lookup()
+_schemasByFields = {}
+
+# names of the fields marshalled from objects of each class. dataclasses and
+# classes made of __slots__ declare theirs. Any other class maps the names
+# in an instance's __dict__ to what dir() finds for such instances, since
+# those decide what dir() lists. Classes are held weakly, so a redefined
+# class starts over
+_classFields = WeakKeyDictionary()
+
+def object_field_names(obj):
+    cls = type(obj)
+
+    # dir() results of classes customizing it can't be reused
+    if cls.__dir__ is not object.__dir__:
+        return dir_field_names(obj)
+
+    fieldNames = _classFields.get(cls)
+    if fieldNames is None:
+        fieldNames = declared_field_names(cls)
+        if fieldNames is None:
+            fieldNames = {}
+        _classFields[cls] = fieldNames
+
+    if isinstance(fieldNames, tuple):
+        return fieldNames
+
+    key = tuple(getattr(obj, '__dict__', ()))
+
+    names = fieldNames.get(key)
+    if names is None:
+        names = fieldNames.setdefault(key, dir_field_names(obj))
+
+    return names
+
+# public attributes of obj other than methods, in dir() order
+def dir_field_names(obj):
+    cls = type(obj)
+    objDict = getattr(obj, '__dict__', {})
+
+    names = []
+    for attrName in dir(obj):
+        if attrName.startswith('_'):
+            continue
+
+        # methods are never fields unless an instance attribute hides them
+        if callable(getattr(cls, attrName, None)) and attrName not in objDict:
+            continue
+
+        names.append(attrName)
+
+    return tuple(names)
+
+# returns the public fields cls declares, or None if its instances may have
+# any attribute
+def declared_field_names(cls):
+    if is_dataclass(cls):
+        return tuple(field.name for field in dataclass_fields(cls)
+                     if not field.name.startswith('_'))
+
+    names = []
+    for klass in reversed(cls.__mro__):
+        if klass is object:
+            continue
+
+        slots = vars(klass).get('__slots__')
+        if slots is None:
+            return None
+        elif isinstance(slots, str):
+            slots = [slots]
+
+        for name in slots:
+            if name == '__dict__':
+                return None
+            elif not name.startswith('_'):
+                names.append(name)
+
+    return tuple(names)
+
+# restores a stored bytearray value for a user object
+def uncompress_bytearray(value):
+    return bytearray(decompress_bytes(value))
+
+# demarshals superqelems with the given field names into copies of
+# objSample. Field types are looked up once when the plan is compiled, so
+# building an object is a conversion per field and an attribute update.
+# Plain objects skip copy() and setattr() for a single __dict__ update,
+# which is all copy() would do for them anyway
+class demarshalplan():
+    __slots__ = ('names', 'converters', 'bulk')
+
+    def __init__(self, objSample, names):
+        self.names = names
+
+        converters = []
+        for name in names:
+            objVal = getattr(objSample, name)
+            if isinstance(objVal, str):
+                converters.append(str)
+            elif isinstance(objVal, int):
+                converters.append(int)
+            elif isinstance(objVal, float):
+                converters.append(float)
+            elif isinstance(objVal, bytearray):
+                converters.append(uncompress_bytearray)
+            else:
+                raise TypeError('unsupported type ({0})'.format(type(objVal)))
+        self.converters = tuple(converters)
+
+        # anything customizing copying or attribute assignment, and fields
+        # shadowed by class attributes such as properties, keep the slow path
+        cls = type(objSample)
+        self.bulk = (hasattr(objSample, '__dict__') and
+                     not hasattr(cls, '__slots__') and
+                     not hasattr(cls, '__copy__') and
+                     not hasattr(cls, '__setstate__') and
+                     cls.__reduce_ex__ is object.__reduce_ex__ and
+                     cls.__reduce__ is object.__reduce__ and
+                     cls.__setattr__ is object.__setattr__ and
+                     not any(hasattr(cls, name) for name in names))
+
+    # builds the object from values. If key is given, it is assigned to the
+    # object so the superq can look the object back up
+    def build(self, objSample, values, key = None):
+        vals = [convert(value)
+                for convert, value in zip(self.converters, values)]
+
+        if self.bulk:
+            cls = type(objSample)
+            newObj = cls.__new__(cls)
+            newDict = objSample.__dict__.copy()
+            newDict.update(zip(self.names, vals))
+            if key is not None:
+                newDict['_superqelemKey'] = key
+            newObj.__dict__ = newDict
+            return newObj
+
+        newObj = copy(objSample)
+        for name, val in zip(self.names, vals):
+            setattr(newObj, name, val)
+
+        if key is not None:
+            try:
+                setattr(newObj, '_superqelemKey', key)
+            except Exception:
+                # __slots__ objects for instance can't take the key
+                pass
+
+        return newObj
+
+# returns the plan demarshalling fields names into objSample's type, using
+# and filling the plans cache if one is given. Plans for superqelems are
+# cached by schema, which stands for its names and hashes faster
+def demarshal_plan(objSample, names, plans = None, schema = None):
+    if plans is None:
+        return demarshalplan(objSample, names)
+
+    key = (type(objSample), names if schema is None else schema)
+
+    plan = plans.get(key)
+    if plan is None:
+        plan = plans.setdefault(key, demarshalplan(objSample, names))
+
+    return plan
+
+# lightweight view of a single superqelem field
+class elematom():
+    __slots__ = ('sqe', 'idx')
+
+    def __init__(self, sqe, idx):
+        self.sqe = sqe
+        self.idx = idx
+
+    def __get_name(self):
+        return self.sqe.schema.names[self.idx]
+
+    def __get_type(self):
+        return self.sqe.schema.types[self.idx]
+
+    def __get_value(self):
+        return self.sqe.values[self.idx]
+
+    def __set_value(self, value):
+        self.sqe.values[self.idx] = value
+
+    name = property(__get_name)
+    type = property(__get_type)
+    value = property(__get_value, __set_value)
+
+class superqelem(LinkedListNode):
+    __slots__ = ('name',
+                 'value',
+                 'valueType',
+                 'parentSq',
+                 'obj',
+                 'links',
+                 'linksDict',
+                 'schema',
+                 'values')
+
+    def __init__(self,
+                 name = None,
+                 value = None,
+                 parentSq = None,
+                 buildFromStr = False):
+        # internal fields are set directly. __setattr__ only needs to see
+        # links and bytearrays, and is too slow to run per field here
+        setField = object.__setattr__
+
+        setField(self, 'prev', None)
+        setField(self, 'next', None)
+
+        # any sqe can link to any number of other sqes. linksDict is only
+        # allocated once a link is added
+        setField(self, 'links', '')
+        setField(self, 'linksDict', None)
+
+        # field values of non-scalars, arrayed according to schema
+        setField(self, 'schema', _emptySchema)
+        setField(self, 'values', [])
+
+        if name is None:
+            name = new_key()
+
+        setField(self, 'name', name)
+
+        if value is None:
+            setField(self, 'value', name)
+        else:
+            setField(self, 'value', value)
+
+        setField(self, 'parentSq', parentSq)
+
+        # used to remember user object for local instance
+        setField(self, 'obj', None)
+
+        if buildFromStr:
+            self.__buildFromStr(self.value)
+            return
+
+        if not isinstance(self.name, (str, int, float)):
+            raise TypeError('invalid name type ({0})'.format(type(self.name)))
+
+        # handle scalars
+        if isinstance(value, (str, int, float)):
+            setField(self, 'valueType', type(value).__name__)
+            return
+
+        self.valueType = ''
+        if isinstance(value, bytearray):
+            # compress bytearray
+            self.value = compress_field(self, '_val_', value)
+
+            self.valueType = type(self.value).__name__
+            return
+
+        # only scalars keep value set
+        setField(self, 'value', None)
+
+        # non-scalars should 'remember' the user object they're created from
+        setField(self, 'obj', value)
+
+        # handle non-scalars. Fields are named by the superq's schema if it
+        # has one, or else by the object's class
+        if parentSq is not None and parentSq.schema is not None:
+            fieldNames = parentSq.schema
+        else:
+            fieldNames = object_field_names(value)
+
+        names = []
+        types = []
+        values = []
+        for attrName in fieldNames:
+            attr = getattr(value, attrName)
 
             # ignore any attributes whose types aren't supported
             if not isinstance(attr, (str, int, float, bytearray)):
                 continue
 
-            # add object field as superqelem property
             if isinstance(attr, bytearray):
-                self.add_property_ba(attrName)
-
                 # compress bytearray
-                attr = rlecode_hqx(attr)
-            else:
-                self.add_property(attrName)
+                attr = compress_field(self, attrName, attr)
+
+            names.append(attrName)
+            types.append(type(attr).__name__)
+            values.append(attr)
 
-            self.add_atom(attrName, type(attr).__name__, attr)
+        # object fields become superqelem properties through the schema class
+        setField(self, 'values', values)
+        self.set_schema(superqschema.lookup(tuple(names), tuple(types)))
+
+    # builds a superqelem from already decoded parts without introspection.
+    # value is None for non-scalars, whose fields are described by schema
+    @staticmethod
+    def build(name, value, links, schema, values, parentSq = None):
+        sqe = object.__new__(schema.elem_class())
+
+        setField = object.__setattr__
+        setField(sqe, 'prev', None)
+        setField(sqe, 'next', None)
+        setField(sqe, 'name', name)
+        setField(sqe, 'value', value)
+        setField(sqe, 'valueType',
+                 '' if value is None else type(value).__name__)
+        setField(sqe, 'parentSq', parentSq)
+        setField(sqe, 'obj', None)
+        setField(sqe, 'links', '')
+        setField(sqe, 'linksDict', None)
+        setField(sqe, 'schema', schema)
+        setField(sqe, 'values', values)
+
+        if links:
+            sqe.addLinksFromStr(links)
+
+        return sqe
 
     # called for all attribute assignments
     def __setattr__(self, attr, value):
         # handle the setting of links to other sqes
         if (isinstance(value, superqelem) and
             attr != 'prev' and attr != 'next'): # clumsy LinkedList avoidance
+            if self.linksDict is None:
+                self.linksDict = {}
+
             # update link if it exists already
             if attr in self.linksDict:
                 oldValue = self.linksDict[attr]
@@ -1054,16 +1992,16 @@ class superqelem(LinkedListNode):
             if self.parentSq is not None:
                 self.parentSq.update_elem_datastore_only(self)
         else:
-            # compress bytearray
-            if isinstance(value, bytearray):
-                value = rlecode_hqx(value)
+            # compress scalar bytearray. Fields compress in their properties
+            if attr == 'value' and isinstance(value, bytearray):
+                value = compress_field(self, '_val_', value)
 
             # call default setattr behavior
             object.__setattr__(self, attr, value)
 
     # called only when a non-existant attribute is accessed
     def __getattr__(self, attr):
-        if attr in self.linksDict:
+        if self.linksDict is not None and attr in self.linksDict:
             # lookup and return linked sqe
             sqName, sqeName = self.linksDict[attr].rsplit('.', 1)
             return superq(sqName)[sqeName]
@@ -1075,6 +2013,8 @@ class superqelem(LinkedListNode):
             return self.name
         return '{0}.{1}'.format(self.parentSq.publicName, self.name)
 
+    publicName = property(__get_publicName)
+
     def set_scalar(self, value):
         # scalar superqelems don't have properties
         if self.value is None:
@@ -1086,9 +2026,9 @@ class superqelem(LinkedListNode):
             value = int(value)
         elif isinstance(self.value, float):
             value = float(value)
-        elif isinstance(self.value, bytearray):
+        elif self.valueType.startswith('byte'):
             # compress bytearray
-            value = rlecode_hqx(bytearray(value))
+            value = compress_field(self, '_val_', value)
 
         self.value = value
 
@@ -1096,65 +2036,15 @@ class superqelem(LinkedListNode):
         if self.parentSq is not None:
             self.parentSq.update_elem(self)
 
-    def add_property(self, attr):
-        # create local setter and getter with a particular attribute name
-        getter = lambda self: self.__get_property(attr)
-        setter = lambda self, value: self.__set_property(attr, value)
-
-        # construct property attribute and add it to the class
-        setattr(self.__class__, attr, property(fget = getter, fset = setter))
-
-    def add_property_ba(self, attr):
-        # create local setter and getter with a particular attribute name
-        getter = lambda self: self.__get_property_ba(attr)
-        setter = lambda self, value: self.__set_property_ba(attr, value)
-
-        # construct property attribute and add it to the class
-        setattr(self.__class__, attr, property(fget = getter, fset = setter))
-
-    # dynamic property getter
-    def __get_property(self, attr):
-        if attr in self.__internalDict:
-            return self.__internalDict[attr].value
-        else:
-            raise SuperQEx('unrecognized attribute: {0}'.format(attr))
-
-    # dynamic property setter
-    def __set_property(self, attr, value):
-        # remember attribute
-        self.__internalDict[attr].value = value
-
-        # maintain state if there is an original user object
-        if self.obj is not None:
-            setattr(self.obj, attr, value)
-
-        # trigger update
-        if self.parentSq is not None:
-            self.parentSq.update_elem_datastore_only(self)
-
-    # dynamic property getter for bytearrays
-    def __get_property_ba(self, attr):
-        if attr in self.__internalDict:
-            # uncompress and return data
-            return rledecode_hqx(self.__internalDict[attr].value)
-        else:
-            raise SuperQEx('unrecognized attribute: {0}'.format(attr))
-
-    # dynamic property setter for bytearrays
-    def __set_property_ba(self, attr, value):
-        # compress and store data
-        self.__internalDict[attr].value = rlecode_hqx(value)
-
-        # maintain state if there is an original user object
-        if self.obj is not None:
-            setattr(self.obj, attr, value)
+    # returns the value of a scalar superqelem, uncompressing bytearrays
+    def scalar(self):
+        if self.valueType.startswith('byte'):
+            return bytearray(decompress_bytes(self.value))
 
-        # trigger update
-        if self.parentSq is not None:
-            self.parentSq.update_elem_datastore_only(self)
+        return self.value
 
     def resetLinks(self):
-        self.linksDict = {}
+        self.linksDict = None
         self.links = ''
 
     def addLinksFromStr(self, linksStr):
@@ -1163,6 +2053,9 @@ class superqelem(LinkedListNode):
             if not link:
                 break
 
+            if self.linksDict is None:
+                self.linksDict = {}
+
             # add link
             key, value = link.split('^')
             self.links += '{0}/'.format(link)
@@ -1171,9 +2064,8 @@ class superqelem(LinkedListNode):
     def __buildFromStr(self, sqeStr):
         headerSeparatorIdx = sqeStr.index(';')
 
-        # separate out sqe header from remainder
+        # separate out sqe header. The body is parsed in place below
         sqeHeader = sqeStr[ : headerSeparatorIdx]
-        sqeBody = sqeStr[headerSeparatorIdx + 1 : ]
 
         # parse out header fields
         headerElems = sqeHeader.split(',', 5)
@@ -1214,27 +2106,24 @@ class superqelem(LinkedListNode):
         # number of fields or atoms
         numFields = int(headerElems[5])
 
-        # parse out each field
+        # parse out each field in place, walking an offset through the body
+        # rather than slicing the remainder off after every field
+        schema = _emptySchema
+        values = []
+        offset = headerSeparatorIdx + 1
         for i in range(0, numFields):
-            # separate field length indicator from remainder
-            separatorIdx = sqeBody.index('|')
-            fieldLen = int(sqeBody[ : separatorIdx])
-            sqeBody = sqeBody[separatorIdx + 1 : ]
-
-            # slice the rest of the field out
-            field = sqeBody[ : fieldLen - 1]
-            sqeBody = sqeBody[fieldLen : ]
-
-            # slice field name from field
-            separatorIdx = field.index('|')
-            fieldName = field[ : separatorIdx]
-            field = field[separatorIdx + 1 : ]
-
-            # now retrieve type and value
-            separatorIdx = field.index('|')
-            fieldType = field[ : separatorIdx]
-
-            fieldValue = field[separatorIdx + 1 : ]
+            # field length indicator, which counts the trailing separator
+            separatorIdx = sqeStr.index('|', offset)
+            fieldEnd = separatorIdx + int(sqeStr[offset : separatorIdx])
+            offset = fieldEnd + 1
+
+            # field name and type, with the value filling the rest
+            nameIdx = sqeStr.index('|', separatorIdx + 1)
+            typeIdx = sqeStr.index('|', nameIdx + 1)
+            fieldName = sqeStr[separatorIdx + 1 : nameIdx]
+            fieldType = sqeStr[nameIdx + 1 : typeIdx]
+
+            fieldValue = sqeStr[typeIdx + 1 : fieldEnd]
             if fieldType.startswith('int'):
                 fieldValue = int(fieldValue)
             elif fieldType.startswith('float'):
@@ -1245,52 +2134,62 @@ class superqelem(LinkedListNode):
 
                 fieldValue = unhexlify(byteStr)
 
-            self.add_atom(fieldName, fieldType, fieldValue)
-
-    def __iter__(self):
-        self.iterNext = self.__internalList.head
-
-        return self
-
-    def __next__(self):
-        returnObj = self.iterNext
+            # overwrite value if field already exists
+            idx = schema.idx.get(fieldName)
+            if idx is not None:
+                values[idx] = fieldValue
+                continue
 
-        if returnObj:
-            self.iterNext = self.iterNext.next
-        else:
-            raise StopIteration
+            schema = schema.add_field(fieldName, fieldType)
+            values.append(fieldValue)
 
-        return returnObj
+        # switch schemas once at the end. Going through add_atom() would build
+        # an element class for every intermediate schema along the way
+        self.values = values
+        self.set_schema(schema)
 
-    def __getitem__(self, key):
-        if key in self.__internalDict:
-            atom = self.__internalDict[key]
-        elif isinstance(key, int) and key < len(self.__internalDict):
+    def __iter__(self):
+        for idx in range(0, len(self.values)):
+            yield elematom(self, idx)
+
+    # returns position of field in values, raising KeyError if not found
+    def __field_idx(self, key):
+        idx = self.schema.idx.get(key)
+        if idx is not None:
+            return idx
+        elif isinstance(key, int) and key < len(self.values):
             # if atom isn't keyed on the int, try the int as an index
-            atom = self.__internalList[key]
+            return key
         else:
             raise KeyError(key)
 
-        if atom.type.startswith('byte'):
+    def __getitem__(self, key):
+        idx = self.__field_idx(key)
+
+        if self.schema.types[idx].startswith('byte'):
             # decompress and return data
-            return rledecode_hqx(atom.value)
+            return decompress_bytes(self.values[idx])
         else:
-            return atom.value
+            return self.values[idx]
 
     def __setitem__(self, key, value):
-        if key in self.__internalDict:
-            atom = self.__internalDict[key]
-        elif isinstance(key, int) and key < len(self.__internalDict):
-            # if atom isn't keyed on the int, try the int as an index
-            atom = self.__internalList[key]
-        else:
-            raise KeyError(key)
+        self.set_field(key, value)
+
+        # trigger update, like setting the field as an attribute
+        if self.parentSq is not None:
+            self.parentSq.update_elem_datastore_only(self)
+
+    # stores a field value without updating the parent superq
+    def set_field(self, key, value):
+        idx = self.__field_idx(key)
 
-        if atom.type.startswith('byte'):
+        if self.schema.types[idx].startswith('byte'):
             # compress and store data
-            atom.value = rlecode_hqx(value)
+            self.values[idx] = compress_field(self,
+                                              self.schema.names[idx],
+                                              value)
         else:
-            atom.value = value
+            self.values[idx] = value
 
     def __str__(self):
         sqeStr = '{0},{1},{2},{3},{4},{5};'.format(type(self.name).__name__,
@@ -1298,7 +2197,7 @@ class superqelem(LinkedListNode):
                                                    self.valueType,
                                                    self.value,
                                                    self.links,
-                                                   len(self.__internalList))
+                                                   len(self.values))
         for atom in self:
             if atom.type.startswith('byte'):
                 # convert bytearray to string
@@ -1312,8 +2211,10 @@ class superqelem(LinkedListNode):
         return sqeStr
 
     def __basecopy(self):
-        # initialize new sqe
-        sqe = superqelem(self.name, self.value, self.parentSq)
+        # initialize new sqe, values are copied over below
+        sqe = superqelem(self.name, parentSq = self.parentSq)
+        sqe.value = self.value
+        sqe.valueType = self.valueType
 
         # remember user obj
         sqe.obj = self.obj
@@ -1321,9 +2222,9 @@ class superqelem(LinkedListNode):
         # add links individually
         sqe.addLinksFromStr(self.links)
 
-        # add atoms
-        for atom in self:
-            sqe.add_atom(atom.name, atom.type, atom.value)
+        # copies share the schema
+        sqe.values = list(self.values)
+        sqe.set_schema(self.schema)
 
         return sqe
 
@@ -1333,22 +2234,31 @@ class superqelem(LinkedListNode):
     def __deepcopy__(self):
         return self.__basecopy()
 
-    # return internal list
+    # return internal list of values
     def _list(self):
-        return self.__internalList
+        return self.values
 
-    # return internal list as python list
+    # return atoms as python list
     def list(self):
         return [val for val in self]
 
     def dict(self):
-        return self.__internalDict
+        return {atom.name: atom for atom in self}
 
     def add_atom(self, name, type_, value):
-        atom = elematom(name, type_, value)
+        # overwrite value if field already exists
+        idx = self.schema.idx.get(name)
+        if idx is not None:
+            self.values[idx] = value
+            return
+
+        self.values.append(value)
+        self.set_schema(self.schema.add_field(name, type_))
 
-        self.__internalDict[name] = atom
-        self.__internalList.push_tail(atom)
+    # switches to the given schema and the superqelem subclass serving it
+    def set_schema(self, schema):
+        self.schema = schema
+        self.__class__ = schema.elem_class()
 
     def __key_user_obj(self, obj):
         # if possible, make user object relatable back to superqelem
@@ -1359,7 +2269,7 @@ class superqelem(LinkedListNode):
             pass
         return obj       
 
-    def demarshal(self, objSample = None):
+    def demarshal(self, objSample = None, plans = None):
         # return original user object if it is known
         if self.obj is not None:
             return self.__key_user_obj(self.obj)
@@ -1369,95 +2279,531 @@ class superqelem(LinkedListNode):
             return self
 
         # demarshal single-value objects
-        if isinstance(objSample, str):
-            return str(self['_val_'])
-        elif isinstance(objSample, int):
-            return int(self['_val_'])
-        elif isinstance(objSample, float):
-            return float(self['_val_'])
-        elif isinstance(objSample, bytearray):
-            # uncompress and return data
-            return rledecode_hqx(bytearray(self['_val_']))
+        if isinstance(objSample, (str, int, float, bytearray)):
+            if isinstance(objSample, str):
+                return str(self['_val_'])
+            elif isinstance(objSample, int):
+                return int(self['_val_'])
+            elif isinstance(objSample, float):
+                return float(self['_val_'])
+            else:
+                # uncompress and return data
+                return bytearray(decompress_bytes(self['_val_']))
 
         # demarshal multi-value objects
-        newObj = copy(objSample)
-        for name, atom in self.__internalDict.items():
-            objVal = getattr(newObj, atom.name)
-            if isinstance(objVal, str):
-                val = str(atom.value)
-            elif isinstance(objVal, int):
-                val = int(atom.value)
-            elif isinstance(objVal, float):
-                val = float(atom.value)
-            elif isinstance(objVal, bytearray):
-                # uncompress data
-                val = rledecode_hqx(bytearray(atom.value))
+        schema = self.schema
+        plan = demarshal_plan(objSample, schema.names, plans, schema)
+
+        return plan.build(objSample, self.values, self.name)
+
+# serializes sqes as a run of length-prefixed sqe strings
+def sqes_to_str(sqes):
+    sqeStrs = []
+    for sqe in sqes:
+        sqeStr = str(sqe)
+        sqeStrs.append('{0},{1}'.format(len(sqeStr), sqeStr))
+
+    return ''.join(sqeStrs)
+
+# deserializes numSqes sqes from a run of length-prefixed sqe strings,
+# starting at offset
+def sqes_from_str(sqesStr, numSqes = None, parentSq = None, offset = 0):
+    sqes = []
+    while offset < len(sqesStr):
+        if numSqes is not None and len(sqes) == numSqes:
+            break
+
+        # separate field length indicator from remainder
+        separatorIdx = sqesStr.index(',', offset)
+        elemLen = int(sqesStr[offset : separatorIdx])
+        offset = separatorIdx + 1 + elemLen
+
+        # deserialize sqe from string fragment
+        sqes.append(superqelem(sqesStr[separatorIdx + 1 : offset],
+                               parentSq = parentSq,
+                               buildFromStr = True))
+
+    return sqes
+
+# serializes sqe keys as a run of length-prefixed strings
+def keys_to_str(keys):
+    return ''.join('{0},{1}'.format(len(str(key)), key) for key in keys)
+
+def keys_from_str(keysStr):
+    keys = []
+    offset = 0
+    while offset < len(keysStr):
+        separatorIdx = keysStr.index(',', offset)
+        offset = separatorIdx + 1 + int(keysStr[offset : separatorIdx])
+        keys.append(keysStr[separatorIdx + 1 : offset])
+
+    return keys
+
+# type tags of values in the binary protocol. NONE marks non-scalar sqes
+BINARY_NONE = 0
+BINARY_STR = 1
+BINARY_INT = 2
+BINARY_FLOAT = 3
+BINARY_BYTES = 4
+BINARY_BUFFER = 5
+
+# bytes values at least this long are sent out of band by the binary protocol
+OUT_OF_BAND_THRESHOLD = 64 * 1024
+
+# most out of band buffers a message may have. Values past this many are
+# sent in band
+MAX_FRAME_BUFFERS = 1000
+
+# most bytes a frame's message and buffers may add up to
+MAX_FRAME_SIZE = 1024 * 1024 * 1024
+
+_binaryFloat = Struct('<d')
+
+# appends non-negative int n to buf as a LEB128 varint
+def varint_pack(buf, n):
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+# returns the varint at offset in buf and the offset following it
+def varint_unpack(buf, offset):
+    byte = buf[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+
+    n = byte & 0x7f
+    shift = 7
+    while True:
+        offset += 1
+        byte = buf[offset]
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, offset + 1
+        shift += 7
+
+def str_pack(buf, value):
+    data = value.encode('utf-8')
+    varint_pack(buf, len(data))
+    buf += data
+
+def str_unpack(buf, offset):
+    length, offset = varint_unpack(buf, offset)
+    return str(buf[offset : offset + length], 'utf-8'), offset + length
+
+# appends a type tag and value. ints are zigzag encoded so small negative
+# ints stay short, bytes are copied raw. If buffers is given, large bytes
+# values are appended to it instead and only their index is packed
+def value_pack(buf, value, buffers = None):
+    if isinstance(value, str):
+        buf.append(BINARY_STR)
+        str_pack(buf, value)
+    elif isinstance(value, int):
+        buf.append(BINARY_INT)
+        varint_pack(buf, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif isinstance(value, float):
+        buf.append(BINARY_FLOAT)
+        buf += _binaryFloat.pack(value)
+    elif isinstance(value, (bytes, bytearray)):
+        if (buffers is not None and
+            len(value) >= OUT_OF_BAND_THRESHOLD and
+            len(buffers) < MAX_FRAME_BUFFERS):
+            buf.append(BINARY_BUFFER)
+            varint_pack(buf, len(buffers))
+            buffers.append(value)
+        else:
+            buf.append(BINARY_BYTES)
+            varint_pack(buf, len(value))
+            buf += value
+    elif value is None:
+        buf.append(BINARY_NONE)
+    else:
+        raise TypeError('Unsupported type {0}'.format(type(value)))
+
+def value_unpack(buf, offset, buffers = None):
+    tag = buf[offset]
+    offset += 1
+
+    if tag == BINARY_STR:
+        return str_unpack(buf, offset)
+    elif tag == BINARY_INT:
+        n, offset = varint_unpack(buf, offset)
+        return (n >> 1 if not n & 1 else -((n + 1) >> 1)), offset
+    elif tag == BINARY_FLOAT:
+        return _binaryFloat.unpack_from(buf, offset)[0], offset + 8
+    elif tag == BINARY_BYTES:
+        length, offset = varint_unpack(buf, offset)
+        return bytes(buf[offset : offset + length]), offset + length
+    elif tag == BINARY_BUFFER:
+        index, offset = varint_unpack(buf, offset)
+        return buffers[index], offset
+    elif tag == BINARY_NONE:
+        return None, offset
+
+    raise MalformedNetworkRequest('unknown type tag {0}'.format(tag))
+
+# binary counterpart of str(sqe): name, scalar value (or none), links and,
+# for non-scalars, the number of fields followed by their names and values
+def sqe_pack(buf, sqe, buffers = None):
+    value_pack(buf, sqe.name)
+    value_pack(buf, sqe.value, buffers)
+    str_pack(buf, sqe.links)
+
+    if sqe.value is None:
+        varint_pack(buf, len(sqe.values))
+        for name, value in zip(sqe.schema.names, sqe.values):
+            str_pack(buf, name)
+            value_pack(buf, value, buffers)
+
+# out of band values arrive as the bytearrays they were received into. They
+# are typed as bytes like values unpacked in band
+def sqe_unpack(buf, offset, parentSq = None, buffers = None):
+    name, offset = value_unpack(buf, offset)
+    value, offset = value_unpack(buf, offset, buffers)
+    links, offset = str_unpack(buf, offset)
+
+    schema = _emptySchema
+    values = []
+    if value is None:
+        numFields, offset = varint_unpack(buf, offset)
+        for i in range(0, numFields):
+            fieldName, offset = str_unpack(buf, offset)
+            fieldValue, offset = value_unpack(buf, offset, buffers)
+
+            if isinstance(fieldValue, bytearray):
+                fieldType = 'bytes'
             else:
-                raise TypeError('unsupported type ({0})'.format(colType))
+                fieldType = type(fieldValue).__name__
 
-            setattr(newObj, atom.name, val)
+            schema = schema.add_field(fieldName, fieldType)
+            values.append(fieldValue)
 
-        return self.__key_user_obj(newObj)
+    sqe = superqelem.build(name, value, links, schema, values, parentSq)
 
-class superq():
-    # overriding __new__ in order to be able to return existing objects
-    def __new__(cls,
-                initObj,
-                name = None,
-                host = None,
-                attach = False,
-                keyCol = None,
-                maxlen = None,
-                buildFromStr = False,
-                buildFromFile = False,
-                secure = False):
-        # str initObj can contain string and file deserialization info
-        if not buildFromStr and not buildFromFile:
-            if isinstance(initObj, str):
-                # return datastore superq if it exists
-                if _dataStore.superq_exists(initObj, host, secure):
-                    return _dataStore.superq_read(initObj, host)
-                else:
-                    raise KeyError('superq {0} does not exist'.format(initObj))
+    return sqe, offset
 
-        return object.__new__(cls)
+def sqes_pack(buf, sqes, buffers = None):
+    varint_pack(buf, len(sqes))
+    for sqe in sqes:
+        sqe_pack(buf, sqe, buffers)
 
-    def __init__(self,
-                 initObj,
-                 name = None,
-                 host = None,
-                 attach = False,
-                 keyCol = None,
-                 maxlen = None,
-                 buildFromStr = False,
-                 buildFromFile = False,
-                 secure = False):
-        # get DataStore handle
-        self.dataStore = _dataStore
+def sqes_unpack(buf, offset, parentSq = None, buffers = None):
+    numSqes, offset = varint_unpack(buf, offset)
 
-        # skip initialization if __init__ is being called on an existing object
-        if hasattr(self, 'initialized'):
-            return
+    sqes = []
+    for i in range(0, numSqes):
+        sqe, offset = sqe_unpack(buf, offset, parentSq, buffers)
+        sqes.append(sqe)
 
-        # mutex must be held whenever the queue is mutating.  All methods
-        # that acquire mutex must release it before returning. mutex is
-        # shared between the conditions, so acquiring and releasing the
-        # conditions also acquires and releases mutex
-        self.mutex = RLock()
+    return sqes, offset
 
-        # notify not_empty whenever an item is added to the queue; a
-        # thread waiting to get is notified then
-        self.not_empty = Condition(self.mutex)
+def keys_pack(buf, keys):
+    varint_pack(buf, len(keys))
+    for key in keys:
+        str_pack(buf, str(key))
 
-        # notify not_full whenever an item is removed from the queue;
-        # a thread waiting to put is notified then
-        self.not_full = Condition(self.mutex)
+def keys_unpack(buf, offset):
+    numKeys, offset = varint_unpack(buf, offset)
+
+    keys = []
+    for i in range(0, numKeys):
+        key, offset = str_unpack(buf, offset)
+        keys.append(key)
+
+    return keys, offset
+
+# binary snapshot layout. After the magic bytes come the version byte and
+# the codec name, superq name and attributes as length-prefixed strings.
+# Chunks follow until the end of the file, each headed by the length of its
+# payload and the number of sqes packed in it
+_snapshotChunk = Struct('<II')
+
+def snapshot_header_pack(buf, codec, name, sqAttrs):
+    buf += SNAPSHOT_MAGIC
+    buf.append(SNAPSHOT_VERSION)
+    str_pack(buf, codec)
+    str_pack(buf, name)
+    str_pack(buf, sqAttrs)
+
+# returns codec, name, attributes and the offset of the first chunk
+def snapshot_header_unpack(buf):
+    offset = len(SNAPSHOT_MAGIC)
+    if bytes(buf[ : offset]) != SNAPSHOT_MAGIC:
+        raise ValueError('not a superq snapshot')
+
+    version = buf[offset]
+    if version > SNAPSHOT_VERSION:
+        raise ValueError('unsupported snapshot version ({0})'.format(version))
+
+    codec, offset = str_unpack(buf, offset + 1)
+    check_codec(codec)
+
+    name, offset = str_unpack(buf, offset)
+    sqAttrs, offset = str_unpack(buf, offset)
+
+    return codec, name, sqAttrs, offset
+
+def snapshot_chunk_write(f, chunk, numSqes, codec):
+    if codec != 'none':
+        chunk = _byteCodecs[codec][0](chunk)
+
+    f.write(_snapshotChunk.pack(len(chunk), numSqes))
+    f.write(chunk)
+
+# yields the sqes of the chunks in buf one at a time, so only the chunk
+# being read is ever decompressed in memory
+def snapshot_sqes(buf, offset, codec, parentSq = None):
+    while offset < len(buf):
+        payloadLen, numSqes = _snapshotChunk.unpack_from(buf, offset)
+        offset += _snapshotChunk.size
+
+        chunk = buf[offset : offset + payloadLen]
+        offset += payloadLen
+
+        try:
+            if codec != 'none':
+                chunk = _byteCodecs[codec][1](chunk)
+
+            chunkOffset = 0
+            for i in range(0, numSqes):
+                sqe, chunkOffset = sqe_unpack(chunk, chunkOffset, parentSq)
+                yield sqe
+        finally:
+            # views into a mapped file must be released before it is closed
+            if isinstance(chunk, memoryview):
+                chunk.release()
+
+# maps values of one sqe field to the sqes holding them
+class SuperQHashIndex():
+    def __init__(self):
+        # value -> {sqe name -> sqe}, in insertion order
+        self.__sqes = {}
+
+        # sqe name -> indexed value, so changed sqes can be found under
+        # their old value
+        self.__keys = {}
+
+    def add(self, sqe, key):
+        self.__keys[sqe.name] = key
+        self.__sqes.setdefault(key, {})[sqe.name] = sqe
+
+    def remove(self, sqe):
+        if sqe.name not in self.__keys:
+            return
+
+        key = self.__keys.pop(sqe.name)
+        bucket = self.__sqes[key]
+        del bucket[sqe.name]
+        if not bucket:
+            del self.__sqes[key]
+
+    def update(self, sqe, key):
+        if sqe.name in self.__keys and self.__keys[sqe.name] == key:
+            return
+
+        self.remove(sqe)
+        self.add(sqe, key)
+
+    def find(self, key):
+        return list(self.__sqes.get(key, {}).values())
+
+# number of entries per block of a SuperQSortedIndex. Blocks split at twice
+# this length
+SORTEDINDEX_BLOCK_LEN = 512
+
+# orders sqes by the value of one field. Entries are (value, seq, sqe) tuples
+# kept in sorted blocks, so an insert or removal only shifts one block and
+# blocks are found by bisecting their last entries
+class SuperQSortedIndex():
+    def __init__(self):
+        self.__blocks = []
+        self.__maxes = []
+
+        # sqe name -> entry, so changed sqes can be found under their old
+        # value. seq orders entries with equal values by insertion
+        self.__entries = {}
+        self.__seq = count()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def add(self, sqe, key):
+        entry = (key, next(self.__seq), sqe)
+        self.__entries[sqe.name] = entry
+
+        if not self.__blocks:
+            self.__blocks.append([entry])
+            self.__maxes.append(entry)
+            return
+
+        i = bisect_left(self.__maxes, entry)
+        if i == len(self.__maxes):
+            # entry sorts after everything, so it extends the last block
+            i -= 1
+            self.__blocks[i].append(entry)
+        else:
+            insort(self.__blocks[i], entry)
+        self.__maxes[i] = self.__blocks[i][-1]
+
+        # split oversized block in half
+        block = self.__blocks[i]
+        if len(block) > 2 * SORTEDINDEX_BLOCK_LEN:
+            self.__blocks[i : i + 1] = [block[ : SORTEDINDEX_BLOCK_LEN],
+                                        block[SORTEDINDEX_BLOCK_LEN : ]]
+            self.__maxes[i : i + 1] = [block[SORTEDINDEX_BLOCK_LEN - 1],
+                                       block[-1]]
+
+    def remove(self, sqe):
+        entry = self.__entries.pop(sqe.name, None)
+        if entry is None:
+            return
+
+        i = bisect_left(self.__maxes, entry)
+        block = self.__blocks[i]
+        del block[bisect_left(block, entry)]
+
+        if block:
+            self.__maxes[i] = block[-1]
+        else:
+            del self.__blocks[i]
+            del self.__maxes[i]
+
+    def update(self, sqe, key):
+        entry = self.__entries.get(sqe.name)
+        if entry is not None and entry[0] == key:
+            return
+
+        self.remove(sqe)
+        self.add(sqe, key)
+
+    # yields sqes with lo <= value <= hi in order. None bounds are open
+    def range(self, lo = None, hi = None):
+        i = 0
+        j = 0
+        if lo is not None:
+            # (lo,) sorts before every entry whose value is lo
+            i = bisect_left(self.__maxes, (lo,))
+            if i == len(self.__maxes):
+                return
+            j = bisect_left(self.__blocks[i], (lo,))
+
+        for block in self.__blocks[i : ]:
+            for entry in block[j : ]:
+                if hi is not None and entry[0] > hi:
+                    return
+                yield entry[2]
+            j = 0
+
+    # yields sqes from highest value to lowest
+    def reversed(self):
+        for block in reversed(self.__blocks):
+            for entry in reversed(block):
+                yield entry[2]
+
+# orders max heap entries in reverse so heapq can serve pop_max()
+class _MaxKey():
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+class superq():
+    # overriding __new__ in order to be able to return existing objects
+    def __new__(cls,
+                initObj,
+                name = None,
+                host = None,
+                attach = False,
+                keyCol = None,
+                maxlen = None,
+                buildFromStr = False,
+                buildFromFile = False,
+                secure = False,
+                threadsafe = True,
+                priority = None,
+                ring = False,
+                columnar = False,
+                codec = 'none',
+                codecThreshold = DEFAULT_CODEC_THRESHOLD,
+                schema = None):
+        # columnar superqs are a separate in-memory class
+        if columnar:
+            if attach or host is not None:
+                raise ValueError('columnar superqs cannot be attached')
+
+            return superqarray(initObj,
+                               name = name,
+                               maxlen = maxlen,
+                               threadsafe = threadsafe)
+
+        # str initObj can contain string and file deserialization info
+        if not buildFromStr and not buildFromFile:
+            if isinstance(initObj, str):
+                # return datastore superq if it exists
+                if _dataStore.superq_exists(initObj, host, secure):
+                    return _dataStore.superq_read(initObj, host)
+                else:
+                    raise KeyError('superq {0} does not exist'.format(initObj))
+
+        return object.__new__(cls)
+
+    def __init__(self,
+                 initObj,
+                 name = None,
+                 host = None,
+                 attach = False,
+                 keyCol = None,
+                 maxlen = None,
+                 buildFromStr = False,
+                 buildFromFile = False,
+                 secure = False,
+                 threadsafe = True,
+                 priority = None,
+                 ring = False,
+                 columnar = False,
+                 codec = 'none',
+                 codecThreshold = DEFAULT_CODEC_THRESHOLD,
+                 schema = None):
+        # get DataStore handle
+        self.dataStore = _dataStore
+
+        # skip initialization if __init__ is being called on an existing object
+        if hasattr(self, 'initialized'):
+            return
+
+        # mutex must be held whenever the queue is mutating.  All methods
+        # that acquire mutex must release it before returning. mutex is
+        # shared between the conditions, so acquiring and releasing the
+        # conditions also acquires and releases mutex
+        self.mutex = RLock()
+
+        # notify not_empty whenever an item is added to the queue; a
+        # thread waiting to get is notified then
+        self.not_empty = Condition(self.mutex)
+
+        # notify not_full whenever an item is removed from the queue;
+        # a thread waiting to put is notified then
+        self.not_full = Condition(self.mutex)
+
+        # notify all_tasks_done whenever the number of unfinished tasks
+        # drops to zero; thread waiting to join() is notified to resume
+        self.all_tasks_done = Condition(self.mutex)
+        self.unfinished_tasks = 0
+
+        # events of wait_any() callers, set whenever an item is added
+        self.__waiters = []
 
         self.name = name
 
         # if no name provided, one will be assigned
         if self.name is None:
-            self.name = 'sq' + str(uuid4().hex)
+            self.name = new_key('sq')
 
         # indicates whether superq is currently backed in the datastore
         self.attached = False
@@ -1477,6 +2823,10 @@ class superq():
         # be directly returned (or they can be requested through self.n())
         self.objSample = None
 
+        # compiled demarshal plans keyed by objSample type and field names,
+        # see demarshalplan
+        self.demarshalPlans = {}
+
         # these describe the superq backing schema and are populated after
         # using introspection on the 1st element added
         self.colNames = []
@@ -1499,15 +2849,61 @@ class superq():
         # set for secure network connections
         self.secure = secure
 
-        # construct publicName property and add it to the class
-        getter = lambda self: self.__get_publicName()
-        setattr(self.__class__,
-                'publicName',
-                property(fget = getter, fset = None))
-
-        # deserializes from string or file
+        # if set, names the field pop_min() and pop_max() order elements by.
+        # Scalar superqs are ordered by value. Both heaps hold (key, seq, sqe)
+        # entries and are cleaned lazily: an entry is stale once its sqe is
+        # removed or its key and seq no longer match __priorityKeys
+        self.priority = priority
+        self.__minHeap = []
+        self.__maxHeap = []
+        self.__priorityKeys = {}
+        self.__prioritySeq = count()
+
+        # in-memory indexes by field name, see create_index(). Every index
+        # is also listed as a (field, index) pair in __fieldIndexes
+        self.__hashIndexes = {}
+        self.__sortedIndexes = {}
+        self.__fieldIndexes = []
+
+        # dense array of sqe names for O(1) random picks, with each name's
+        # position in it. Built the first time the superq is sampled
+        self.__sampleNames = None
+        self.__samplePos = None
+
+        # non-threadsafe superqs skip locking in push() and pop(). Only
+        # detached superqs owned by a single thread may be non-threadsafe
+        self.threadsafe = threadsafe
+        if attach and not threadsafe:
+            raise ValueError('attached superqs must be threadsafe')
+
+        # once full, ring superqs overwrite the element they would otherwise
+        # drop instead of allocating a new one. Each element holds a numbered
+        # slot which doubles as its backing table row id, so a push onto a
+        # full attached ring superq is a single UPDATE
+        self.ring = ring
+        if ring and (maxlen is None or maxlen < 1):
+            raise ValueError('ring superqs need a positive maxlen')
+        self.ringSlots = {}
+        self.__freeSlots = []
+
+        # names the codec compressing bytearray values, or maps field names
+        # to codecs for per-field settings. Values shorter than
+        # codecThreshold bytes are stored raw
+        self.codec = codec
+        self.codecThreshold = codecThreshold
+        for name in (codec.values() if isinstance(codec, dict) else [codec]):
+            check_codec(name)
+
+        # field names of the objects added, if given. Objects are then
+        # marshalled without looking their fields up
+        self.schema = None if schema is None else tuple(schema)
+
+        # deserializes from string, bytes or file
         if buildFromStr:
-            self.buildFromStr(initObj, attach)
+            if isinstance(initObj, str):
+                self.buildFromStr(initObj, attach)
+            else:
+                self.buildFromBytes(initObj, attach)
             self.initialized = True
             return
         elif buildFromFile:
@@ -1520,8 +2916,7 @@ class superq():
             for elem in initObj:
                 self.create_elem(copy(elem), name = elem.name)
         elif isinstance(initObj, list):
-            for item in initObj:
-                self.create_elem(item)
+            self.push_many(initObj)
         elif isinstance(initObj, dict):
             for key, value in initObj.items():
                 self.create_elem(value, name = key)
@@ -1540,52 +2935,48 @@ class superq():
             return self.name
         return '{0}.{1}'.format(self.host, self.name)
 
+    publicName = property(__get_publicName)
+
     def __len__(self):
         return len(self.__internalList)
 
     def __contains__(self, key):
         return key in self.__internalDict
 
+    # every iteration is independent and walks the snapshot of the superq
+    # taken when it started, so readers don't need to hold the mutex and
+    # writers don't disturb them. Snapshots are shared until the next write.
+    # Ring superqs overwrite sqes in place, so iterating one can still show
+    # newer values
     def __iter__(self):
-        self.next = self.__internalList.head
-
-        return self
-
-    def __next__(self):
-        elem = self.next
+        # single-threaded superqs have no concurrent writers to guard against
+        if not self.threadsafe:
+            return (self.__elem_value(sqe) for sqe in self.__internalList)
 
-        if self.next:
-            self.next = self.next.next
-        else:
-            raise StopIteration
-
-        # if superqelem is scalar, just return value
-        if elem.value is not None:
-            return elem.value
+        with self.mutex:
+            sqes = self.__internalList.snapshot()
 
-        return elem.demarshal(self.objSample)
+        return (self.__elem_value(sqe) for sqe in sqes)
 
     def __getitem__(self, val):
         if isinstance(val, slice):
             start, stop, step = val.indices(len(self))
 
-            sq = superq([])
+            # slices are views on this superq's sqes. See superqview
             if start in self.__internalDict:
                 sqe = self.__internalDict[start]
-                sq.create_elem(copy(sqe))
+                sqes = [sqe]
                 while sqe.name != stop:
                     sqe = sqe.next
                     if sqe.name == start:
                         break
-                    sq.create_elem(copy(sqe))
+                    sqes.append(sqe)
             elif isinstance(start, int):
-                sqSlice = self.__internalList[val]
-                for sqe in sqSlice:
-                    sq.create_elem(copy(sqe))
+                sqes = self.__internalList.slice_nodes(val)
             else:
                 raise TypeError('Invalid type ({0})'.format(type(val)))
 
-            return sq
+            return superqview(self, sqes)
         elif val in self.__internalDict:
             elem = self.__internalDict[val]
         elif isinstance(val, int):
@@ -1623,7 +3014,16 @@ class superq():
         raise KeyError(key)
 
     def __basecopy(self):
-        return superq(self, name = self.name, attach = False)
+        return superq(self,
+                      name = self.name,
+                      attach = False,
+                      maxlen = self.maxlen,
+                      threadsafe = self.threadsafe,
+                      priority = self.priority,
+                      ring = self.ring,
+                      codec = self.codec,
+                      codecThreshold = self.codecThreshold,
+                      schema = self.schema)
 
     def __copy__(self):
         return self.__basecopy()
@@ -1632,24 +3032,56 @@ class superq():
         return self.__basecopy()
 
     def __str__(self):
-        sqHdr = '{0},{1};'.format(self.name, len(self.__internalList))
+        # serialize a consistent set of elements while writers carry on
+        with self.mutex:
+            sqes = self.__internalList.snapshot()
+
+        sqHdr = '{0},{1};'.format(self.name, len(sqes))
+
+        sqAttrs = self.__attrs_str() + ';'
+
+        sqElems = sqes_to_str(sqes)
+
+        sqStr = '{0}{1}{2}'.format(sqHdr, sqAttrs, sqElems)
+
+        return sqStr
+
+    # binary counterpart of str(sq), used by the binary network protocol.
+    # Large bytes values are appended to buffers if given, see value_pack()
+    def to_bytes(self, buffers = None):
+        with self.mutex:
+            sqes = self.__internalList.snapshot()
+
+        buf = bytearray()
+        str_pack(buf, self.name)
+        str_pack(buf, self.__attrs_str())
+        sqes_pack(buf, sqes, buffers)
+
+        return buf
 
-        # serialize necessary attributes as name-value pairs
+    # serializes necessary attributes as name-value pairs
+    def __attrs_str(self):
         sqAttrs = ''
         sqAttrs += 'host|{0},'.format(self.host)
         sqAttrs += 'keyCol|{0},'.format(self.keyCol)
         sqAttrs += 'maxlen|{0},'.format(self.maxlen)
+        sqAttrs += 'priority|{0},'.format(self.priority)
+        sqAttrs += 'ring|{0},'.format(self.ring)
+        sqAttrs += 'codec|{0},'.format(self.__codec_str())
+        sqAttrs += 'codecThreshold|{0},'.format(self.codecThreshold)
+        sqAttrs += 'schema|{0},'.format(None if self.schema is None else
+                                       '/'.join(self.schema))
         sqAttrs += 'autoKey|{0}'.format(self.autoKey)
-        sqAttrs += ';'
 
-        sqElems = ''
-        for sqe in self.__internalList:
-            sqeStr = str(sqe)
-            sqElems += '{0},{1}'.format(len(sqeStr), sqeStr)
+        return sqAttrs
 
-        sqStr = '{0}{1}{2}'.format(sqHdr, sqAttrs, sqElems)
+    # per-field codecs serialize as field=codec pairs separated by '/'
+    def __codec_str(self):
+        if isinstance(self.codec, dict):
+            return '/'.join('{0}={1}'.format(name, codec)
+                            for name, codec in self.codec.items())
 
-        return sqStr
+        return self.codec
 
     # returns value wrapped in superqelem if it was not already
     def __wrap_elem(self, value, name = None):
@@ -1658,7 +3090,7 @@ class superq():
         else:
             # if autoKey on, name will be assigned
             if self.autoKey:
-                name = 'sqe' + str(uuid4().hex)
+                name = new_key('sqe')
             elif self.keyCol is not None:
                 try:
                     name = getattr(value, self.keyCol)
@@ -1675,13 +3107,13 @@ class superq():
     def __unwrap_elem(self, sqe):
         # if superqelem is scalar, just return value
         if sqe.value is not None:
-            return sqe.value
+            return sqe.scalar()
 
         # sqe is now detached
         sqe.parentSq = None
 
         # demarshal into user object if possible
-        returnObj = sqe.demarshal(self.objSample)
+        returnObj = sqe.demarshal(self.objSample, self.demarshalPlans)
 
         return returnObj
 
@@ -1702,102 +3134,180 @@ class superq():
 
         return self.__internalDict[name]
 
+    # sets attributes from serialized name-value pairs
+    def __set_attrs(self, sqAttrs):
+        attrElems = sqAttrs.split(',')
+        for attr in attrElems:
+            name, value = attr.split('|')
+
+            if value.startswith('None'):
+                value = None
+
+            setattr(self, name, value)
+
+        # ring buffers need their real maxlen and flag back
+        if self.maxlen is not None:
+            self.maxlen = int(self.maxlen)
+        self.ring = self.ring in (True, 'True')
+
+        self.codecThreshold = int(self.codecThreshold)
+        if self.schema is not None:
+            self.schema = tuple(self.schema.split('/'))
+        if isinstance(self.codec, str) and '=' in self.codec:
+            self.codec = dict(pair.split('=')
+                              for pair in self.codec.split('/'))
+
     def buildFromStr(self, sqStr, attach = False):
         # initialize internal storage
         self.__internalList = LinkedList()
         self.__internalDict = {}
+        self.__clear_indexes()
 
-        # separate out sq header from remainder
+        # separate out sq header without copying the remainder
         headerSeparatorIdx = sqStr.index(';')
         sqHeader = sqStr[ : headerSeparatorIdx]
-        sqStr = sqStr[headerSeparatorIdx + 1 : ]
 
         # get name and number of fields from sq header
         headerElems = sqHeader.split(',')
         self.name = headerElems[0]
         numSqes = int(headerElems[1])
 
-        # separate out attributes from remainder
-        headerSeparatorIdx = sqStr.index(';')
-        sqAttrs = sqStr[ : headerSeparatorIdx]
-        sqStr = sqStr[headerSeparatorIdx + 1 : ]
+        # attributes follow the header
+        attrsSeparatorIdx = sqStr.index(';', headerSeparatorIdx + 1)
+        sqAttrs = sqStr[headerSeparatorIdx + 1 : attrsSeparatorIdx]
 
-        # set attributes
-        attrElems = sqAttrs.split(',')
-        for attr in attrElems:
-            name, value = attr.split('|')
-
-            if value.startswith('None'):
-                value = None
-
-            setattr(self, name, value)
+        self.__set_attrs(sqAttrs)
 
         if attach:
             self.attach()
 
-        # parse out each superqelem
-        for i in range(0, numSqes):
-            # separate field length indicator from remainder
-            separatorIdx = sqStr.index(',')
-            elemLen = int(sqStr[ : separatorIdx])
-            sqStr = sqStr[separatorIdx + 1 : ]
+        self.__add_built_sqes(sqes_from_str(sqStr,
+                                            numSqes,
+                                            parentSq = self,
+                                            offset = attrsSeparatorIdx + 1))
+
+    # binary counterpart of buildFromStr()
+    def buildFromBytes(self, data, attach = False, buffers = None):
+        # initialize internal storage
+        self.__internalList = LinkedList()
+        self.__internalDict = {}
+        self.__clear_indexes()
+
+        self.name, offset = str_unpack(data, 0)
+        sqAttrs, offset = str_unpack(data, offset)
+
+        self.__set_attrs(sqAttrs)
 
-            # slice the rest of the sqe out
-            sqeStr = sqStr[ : elemLen]
-            sqStr = sqStr[elemLen : ]
+        if attach:
+            self.attach()
 
-            # deserialize sqe from string fragment
-            sqe = superqelem(sqeStr, parentSq = self, buildFromStr = True)
+        self.__add_built_sqes(sqes_unpack(data,
+                                          offset,
+                                          parentSq = self,
+                                          buffers = buffers)[0])
 
+    def __add_built_sqes(self, sqes):
+        for sqe in sqes:
             # add element to internal dictionary and tail of internal list
             self.__internalDict[sqe.name] = sqe
             self.__internalList.push_tail(sqe)
+            self.__index_elem(sqe)
 
+        # deserialized elements are outstanding tasks like pushed ones
+        self.unfinished_tasks = len(self.__internalList)
+
+    # loads a file written by save(). Elements are all added before the
+    # superq is attached, so they reach the datastore in a single batch
     def buildFromFile(self, fileName, attach = False):
-        with open(fileName) as infile:
-            sqHdr = infile.readline().rstrip()
+        with open(fileName, 'rb') as infile:
+            isSnapshot = infile.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
 
-            self.name = sqHdr
+        if isSnapshot:
+            self.__load_snapshot(fileName)
+        else:
+            with open(fileName) as infile:
+                sqHdr = infile.readline().rstrip()
 
-            sqAttrs = infile.readline().rstrip()
+                self.name = sqHdr
 
-            # set attributes
-            attrElems = sqAttrs.split(',')
-            for attr in attrElems:
-                name, value = attr.split('|')
+                sqAttrs = infile.readline().rstrip()
 
-                if value.startswith('None'):
-                    value = None
+                self.__set_attrs(sqAttrs)
 
-                setattr(self, name, value)
+                # deserialize sqes from string fragments as they are read
+                self.__add_built_sqes(superqelem(line,
+                                                 parentSq = self,
+                                                 buildFromStr = True)
+                                      for line in infile)
 
-            if attach:
-                self.attach()
+        if attach:
+            self.attach()
 
-            for line in infile:
-                # deserialize sqe from string fragment
-                sqe = superqelem(line, parentSq = self, buildFromStr = True)
+    # the snapshot is mapped rather than read, so elements are parsed
+    # straight out of the page cache
+    def __load_snapshot(self, fileName):
+        # reset internal storage, as buildFromStr() does
+        self.__internalList = LinkedList()
+        self.__internalDict = {}
+        self.__clear_indexes()
 
-                # add sqe to sq
-                self.push(sqe)
+        with open(fileName, 'rb') as infile:
+            with mmap(infile.fileno(), 0, access = ACCESS_READ) as mapped:
+                buf = memoryview(mapped)
+                try:
+                    codec, self.name, sqAttrs, offset = \
+                        snapshot_header_unpack(buf)
+
+                    self.__set_attrs(sqAttrs)
+
+                    self.__add_built_sqes(snapshot_sqes(buf,
+                                                        offset,
+                                                        codec,
+                                                        parentSq = self))
+                finally:
+                    buf.release()
+
+    # saves as text lines by default. binary saves a versioned snapshot
+    # that is written and read a chunk at a time, and compressed with codec
+    def save(self, fileName, binary = False, codec = 'none'):
+        with self.mutex:
+            sqes = self.__internalList.snapshot()
+
+        if binary:
+            self.__save_snapshot(fileName, sqes, codec)
+            return
 
-    def save(self, fileName):
         with open(fileName, 'w') as f:
             sqHdr = '{0}'.format(self.name)
             f.write('{0}\n'.format(sqHdr))
 
-            # serialize relevant attributes as name-value pairs
-            sqAttrs = ''
-            sqAttrs += 'host|{0},'.format(self.host)
-            sqAttrs += 'keyCol|{0},'.format(self.keyCol)
-            sqAttrs += 'maxlen|{0},'.format(self.maxlen)
-            sqAttrs += 'autoKey|{0}'.format(self.autoKey)
+            f.write('{0}\n'.format(self.__attrs_str()))
 
-            f.write('{0}\n'.format(sqAttrs))
-
-            for sqe in self.__internalList:
+            for sqe in sqes:
                 f.write('{0}\n'.format(str(sqe)))
 
+    def __save_snapshot(self, fileName, sqes, codec):
+        check_codec(codec)
+
+        with open(fileName, 'wb') as f:
+            header = bytearray()
+            snapshot_header_pack(header, codec, self.name, self.__attrs_str())
+            f.write(header)
+
+            chunk = bytearray()
+            numSqes = 0
+            for sqe in sqes:
+                sqe_pack(chunk, sqe)
+                numSqes += 1
+
+                if len(chunk) >= SNAPSHOT_CHUNK_SIZE:
+                    snapshot_chunk_write(f, chunk, numSqes, codec)
+                    chunk = bytearray()
+                    numSqes = 0
+
+            if numSqes:
+                snapshot_chunk_write(f, chunk, numSqes, codec)
+
     # returns superqelems without any attempt at demarshalling
     def n(self, key):
         if key in self.__internalDict:
@@ -1823,6 +3333,9 @@ class superq():
         if self.attached:
             raise Exception('Already attached!')
 
+        if not self.threadsafe:
+            raise ValueError('attached superqs must be threadsafe')
+
         if self.dataStore.superq_exists(self.name, self.host, self.secure):
             raise NotImplemented('Not yet allowed to attach existing superqs.')
 
@@ -1830,11 +3343,9 @@ class superq():
 
         self.dataStore.superq_create(self, self.secure)
 
-        # if attaching a locally-backed superq, back each elem
+        # if attaching a locally-backed superq, back all elems in one batch
         if self.host is None or self.dataStore.public:
-            # create each elem. The 1st one triggers backing table creation
-            for sqe in self.__internalList:
-                self.create_elem_datastore_only(sqe)
+            self.create_elems_datastore_only(list(self.__internalList))
 
     def detach(self):
         if not self.attached:
@@ -1888,6 +3399,8 @@ class superq():
 
             self.colNames = ['_name_', '_val_', '_links_']
             self.colTypes = ['str', sqe.valueType, 'str']
+
+            self.__add_slot_column()
             
             return
 
@@ -1933,6 +3446,19 @@ class superq():
         self.colNames = colNames
         self.colTypes = colTypes
 
+        self.__add_slot_column()
+
+    # ring superqs key rows by slot. As the INTEGER PRIMARY KEY, _slot_ is the
+    # sqlite rowid, so overwriting a slot needs no separate index
+    def __add_slot_column(self):
+        if not self.ring:
+            return
+
+        self.nameStr += ',_slot_'
+        self.nameTypeStr += ',_slot_ INTEGER PRIMARY KEY'
+        self.colNames.append('_slot_')
+        self.colTypes.append('int')
+
     def create_elem_datastore_only(self, sqe, idx = None):
         # enable sqe to trigger datastore updates through parent sq
         sqe.parentSq = self
@@ -1956,6 +3482,33 @@ class superq():
             if self.createTable:
                 self.createTable = False
 
+    # backs many sqes in the datastore with a single transaction or request
+    def create_elems_datastore_only(self, sqes):
+        if not sqes:
+            return
+
+        # enable sqes to trigger datastore updates through parent sq
+        for sqe in sqes:
+            sqe.parentSq = self
+
+        # build understanding of backing table the 1st time through
+        if not self.colNames:
+            # build understanding of object structure
+            self.__initialize_on_first_elem(sqes[0])
+
+            # set flag to create table if non-hosted or dataStore is public
+            if self.host is None or self.dataStore.public:
+                self.createTable = True
+
+        if self.attached:
+            self.dataStore.superqelem_create_many(self,
+                                                  sqes,
+                                                  self.createTable,
+                                                  self.secure)
+
+            if self.createTable:
+                self.createTable = False
+
     def create_elem(self, value, name = None, idx = None):
         return self.push(self.__wrap_elem(value, name), idx)
 
@@ -1965,12 +3518,15 @@ class superq():
         elif idx is not None:
             return self.__internalList[idx]
         else:
-            # efficiently return random element without list traversal
-            keys = self.__internalDict.keys()
-            return self.__internalDict[keys[random.randrange(0, len(keys))]]
+            return self.random_elem()
 
     # exists for sqe.__setProperty() to update datastore without recursing
     def update_elem_datastore_only(self, sqe):
+        # changed fields may move sqe within in-memory indexes. Field setters
+        # call this without holding mutex
+        with self.mutex:
+            self.__reindex_elem(sqe)
+
         if self.attached:
             self.dataStore.superqelem_update(self, sqe, self.secure)
 
@@ -1984,11 +3540,11 @@ class superq():
                 attachedSqe = self.__internalDict[sqe.name]
 
                 # handle scalars
-                attachedSqe.set_scalar(sqe.value)
+                attachedSqe.set_scalar(sqe.scalar())
 
                 # demarshal from detached sqe to attached
-                for atom in attachedSqe:
-                    atom.value = sqe[atom.name]
+                for name in attachedSqe.schema.names:
+                    attachedSqe.set_field(name, sqe[name])
 
                 # rebuild links
                 attachedSqe.resetLinks()
@@ -2000,8 +3556,8 @@ class superq():
             sqe = self.__lookup_elem(value)
             
             # marshal from user object to sqe
-            for atom in sqe:
-                atom.value = getattr(value, atom.name)
+            for name in sqe.schema.names:
+                sqe.set_field(name, getattr(value, name))
 
         # update attached sqe
         self.update_elem_datastore_only(sqe)
@@ -2010,144 +3566,1064 @@ class superq():
         if self.attached:
             self.dataStore.superqelem_delete(self, sqe.name, self.secure)
 
-    def delete_elem(self, value):
+    def delete_elems_datastore_only(self, sqes):
+        if self.attached:
+            self.dataStore.superqelem_delete_many(self,
+                                                  [sqe.name for sqe in sqes],
+                                                  self.secure)
+
+    # resolves a sqe, key, index or user object to the sqe it refers to
+    def __resolve_elem(self, value):
         if isinstance(value, superqelem):
-            sqe = value
+            return value
         elif isinstance(value, (str, int, float)) and \
              value in self.__internalDict:
-            sqe = self.__internalDict[value]
+            return self.__internalDict[value]
         elif isinstance(value, int) and value < len(self.__internalDict):
-            sqe = self.__internalList[value]
-        else:
-            # lookup sqe from user object
-            sqe = self.__lookup_elem(value)
+            return self.__internalList[value]
+
+        # lookup sqe from user object
+        return self.__lookup_elem(value)
+
+    def delete_elem(self, value):
+        sqe = self.__resolve_elem(value)
 
         with self.not_empty:
             # remove element from internal collections
             self.__internalDict.pop(sqe.name)
             self.__internalList.pop_node(sqe)
+            self.__unindex_elem(sqe)
 
             self.delete_elem_datastore_only(sqe)
 
             self.not_full.notify()
 
+    # deletes many elements with a single datastore delete or node request
+    def delete_elems(self, values):
+        with self.not_empty:
+            sqes = [self.__resolve_elem(value) for value in values]
+
+            # remove elements from internal collections
+            for sqe in sqes:
+                self.__internalDict.pop(sqe.name)
+                self.__internalList.pop_node(sqe)
+                self.__unindex_elem(sqe)
+
+            self.delete_elems_datastore_only(sqes)
+
+            self.not_full.notify(len(sqes))
+
     # these thread-safe methods can be used for synchronized superq access
 
-# TODO: does it make sense to add more aliases to match for instance standard
-#  list functions. Or to change the existing names?
+# TODO: does it make sense to add more aliases to match for instance standard
+#  list functions. Or to change the existing names?
+
+    def push(self, value, idx = None, block = True, timeout = None):
+        # single-threaded superqs skip locking and never wait for room
+        if not self.threadsafe:
+            return self.__push_elem(value, idx)
+
+        with self.not_full:
+            # handle dropping an element if needed
+            if self.maxlen is not None and len(self) > self.maxlen:
+                if block:
+                    if timeout is None:
+                        while len(self) >= self.maxlen:
+                            self.not_full.wait()
+                    elif timeout < 0:
+                        raise ValueError('timeout must be non-negative')
+                    else:
+                        endtime = time() + timeout
+                        while len(self) >= self.maxlen:
+                            remaining = endtime - time()
+                            if remaining <= 0.0:
+                                raise SuperQFull('superq is full')
+                            self.not_full.wait(remaining)
+                else:
+                    if self.maxlen < 0:
+                        raise ValueError('maxlen is negative')
+                    return
+
+            sqe = self.__push_elem(value, idx)
+
+            self.not_empty.notify()
+            self.__notify_waiters()
+
+            # return the object for elegant create_elem()
+            return sqe
+
+    # adds value to internal collections and datastore. Caller holds mutex
+    def __push_elem(self, value, idx):
+        if self.maxlen is not None and len(self) == self.maxlen:
+            if idx is None or idx >= len(self) - 1:
+                if self.ring:
+                    return self.__overwrite_elem(value, True)
+                self.pop_head()
+            elif idx <= 0:
+                if self.ring:
+                    return self.__overwrite_elem(value, False)
+                self.pop_tail()
+            else:
+                raise ValueError('Cannot insert into full set')
+
+            # dropped element will never be consumed
+            self.unfinished_tasks -= 1
+
+        # convert value to sqe if necessary
+        sqe = self.__wrap_elem(value)
+
+        # add sqe to internal dictionary
+        self.__internalDict[sqe.name] = sqe
+
+        # add sqe to internal list
+        if idx is None or idx >= len(self) - 1:
+            # default to stack/LIFO behavior
+            self.__internalList.push_tail(sqe)
+        elif idx == 0:
+            self.__internalList.push_head(sqe)
+        else:
+            self.__internalList.push(idx, sqe)
+
+        self.__index_elem(sqe)
+
+        # for now pushes on hosted superqs are slow due to blocking here
+        if self.attached:
+            self.create_elem_datastore_only(sqe, idx)
+
+        self.unfinished_tasks += 1
+
+        return sqe
+
+    # writes value over the element a full ring superq would drop, reusing
+    # its sqe and slot. Appending overwrites the head and moves it to the
+    # tail, prepending overwrites the tail and moves it to the head. Caller
+    # holds mutex
+    def __overwrite_elem(self, value, append):
+        if append:
+            sqe = self.__internalList.head
+        else:
+            sqe = self.__internalList.tail
+
+        # the slot freed here is the one __index_elem hands back out below
+        self.__internalDict.pop(sqe.name)
+        self.__unindex_elem(sqe)
+
+        setField = object.__setattr__
+        if self.autoKey and type(value) in (str, int, float):
+            # plain scalars are written straight into the old sqe
+            setField(sqe, 'name', new_key('sqe'))
+            setField(sqe, 'value', value)
+            setField(sqe, 'valueType', type(value).__name__)
+            setField(sqe, 'obj', None)
+            setField(sqe, 'values', [])
+            sqe.set_schema(_emptySchema)
+            sqe.resetLinks()
+        else:
+            # anything else is wrapped and its fields moved over
+            newSqe = self.__wrap_elem(value)
+            for field in ('name',
+                          'value',
+                          'valueType',
+                          'obj',
+                          'links',
+                          'linksDict',
+                          'values'):
+                setField(sqe, field, getattr(newSqe, field))
+            sqe.set_schema(newSqe.schema)
+
+        self.__internalList.rotate(-1 if append else 1)
+
+        self.__internalDict[sqe.name] = sqe
+        self.__index_elem(sqe)
+
+        if self.attached:
+            self.dataStore.superqelem_overwrite(self, sqe, self.secure)
+
+        return sqe
+
+    # appends all values to the tail under one lock acquisition and backs
+    # them in the datastore as a single batch
+    def push_many(self, values, block = True, timeout = None):
+        # convert values to sqes if necessary
+        sqes = [self.__wrap_elem(value) for value in values]
+        if not sqes:
+            return sqes
+
+        with self.not_full:
+            if self.maxlen is not None:
+                if self.maxlen < 0:
+                    raise ValueError('maxlen is negative')
+
+                # pushing past maxlen drops from the head, so only the last
+                # maxlen values could survive the batch
+                if len(sqes) > self.maxlen:
+                    sqes = sqes[len(sqes) - self.maxlen : ]
+
+                while (not self.ring and
+                       sqes and
+                       len(self) + len(sqes) > self.maxlen):
+                    self.pop_head(block, timeout)
+
+                    # dropped element will never be consumed
+                    self.unfinished_tasks -= 1
+
+            # ring superqs add what fits as a batch and write the rest over
+            # their oldest elements, as push() does
+            overwrites = []
+            if self.ring:
+                room = self.maxlen - len(self)
+                overwrites = sqes[room : ]
+                sqes = sqes[ : room]
+
+            for sqe in sqes:
+                # add sqe to internal dictionary and tail of internal list
+                self.__internalDict[sqe.name] = sqe
+                self.__internalList.push_tail(sqe)
+                self.__index_elem(sqe)
+
+            if self.attached and sqes:
+                self.create_elems_datastore_only(sqes)
+
+            self.unfinished_tasks += len(sqes)
+
+            sqes += [self.__overwrite_elem(sqe, True) for sqe in overwrites]
+
+            self.not_empty.notify(len(sqes))
+            self.__notify_waiters()
+
+            return sqes
+
+    def extend(self, values, block = True, timeout = None):
+        return self.push_many(values, block, timeout)
+
+    def push_head(self, value, block = True, timeout = None):
+        return self.push(value, 0, block, timeout)
+
+    def push_tail(self, value, block = True, timeout = None):
+        return self.push(value, len(self), block, timeout)
+
+    # wakes wait_any() callers. Caller holds mutex
+    def __notify_waiters(self):
+        for waiter in self.__waiters:
+            waiter.set()
+
+    # waits until superq has elements. Caller holds not_empty
+    def __wait_not_empty(self, block, timeout):
+        if not block:
+            if len(self) == 0:
+                raise SuperQEmpty('no elements in superq')
+        elif timeout is None:
+            while len(self) == 0:
+                self.not_empty.wait()
+        elif timeout < 0:
+            raise ValueError('timeout must be non-negative')
+        else:
+            endtime = time() + timeout
+            while len(self) == 0:
+                remaining = endtime - time()
+                if remaining <= 0.0:
+                    raise SuperQEmpty('no elements in superq')
+                self.not_empty.wait(remaining)
+
+    def pop(self, idx = None, block = True, timeout = None):
+        # single-threaded superqs skip locking and never wait for elements
+        if not self.threadsafe:
+            if len(self) == 0:
+                raise SuperQEmpty('no elements in superq')
+
+            return self.__pop_elem(idx)
+
+        with self.not_empty:
+            self.__wait_not_empty(block, timeout)
+
+            value = self.__pop_elem(idx)
+
+            self.not_full.notify()
+
+            return value
+
+    # removes element from internal collections and datastore. Caller holds
+    # mutex
+    def __pop_elem(self, idx):
+        # default to stack/LIFO behavior
+        if idx is None:
+            idx = len(self) - 1
+
+        # remove element from internal collections
+        sqe = self.__internalList.pop(idx)
+        self.__internalDict.pop(sqe.name)
+        self.__unindex_elem(sqe)
+
+        # for now pops on hosted superqs are slow due to blocking here
+        if self.attached:
+            self.delete_elem_datastore_only(sqe)
+
+        return self.__unwrap_elem(sqe)
+
+    # pops up to maxItems elements, in the order repeated pop() calls would
+    # return them, with a single datastore delete or node request
+    def pop_many(self, maxItems, block = True, timeout = None):
+        with self.not_empty:
+            self.__wait_not_empty(block, timeout)
+
+            # remove elements from tail of internal collections
+            sqes = []
+            for i in range(0, min(maxItems, len(self))):
+                sqe = self.__internalList.pop_tail()
+                self.__internalDict.pop(sqe.name)
+                self.__unindex_elem(sqe)
+                sqes.append(sqe)
+
+            if self.attached:
+                self.delete_elems_datastore_only(sqes)
+
+            self.not_full.notify(len(sqes))
+
+            return [self.__unwrap_elem(sqe) for sqe in sqes]
+
+    def pop_head(self, block = True, timeout = None):
+        return self.pop(0, block, timeout)
+
+    # pops the element with the lowest priority field value
+    def pop_min(self, block = True, timeout = None):
+        return self.__pop_priority(self.__minHeap, block, timeout)
+
+    # pops the element with the highest priority field value
+    def pop_max(self, block = True, timeout = None):
+        return self.__pop_priority(self.__maxHeap, block, timeout)
+
+    def __pop_priority(self, heap, block, timeout):
+        if self.priority is None:
+            raise ValueError('superq has no priority field')
+
+        # single-threaded superqs skip locking and never wait for elements
+        if not self.threadsafe:
+            if len(self) == 0:
+                raise SuperQEmpty('no elements in superq')
+
+            return self.__pop_priority_elem(heap)
+
+        with self.not_empty:
+            self.__wait_not_empty(block, timeout)
+
+            value = self.__pop_priority_elem(heap)
+
+            self.not_full.notify()
+
+            return value
+
+    # removes the top live element of heap. Caller holds mutex
+    def __pop_priority_elem(self, heap):
+        # discard stale entries until the top one is live
+        while True:
+            key, seq, sqe = heappop(heap)
+            if self.__priority_entry_live(key, seq, sqe):
+                break
+
+        # remove element from internal collections
+        self.__internalList.pop_node(sqe)
+        self.__internalDict.pop(sqe.name)
+        self.__unindex_elem(sqe)
+
+        if self.attached:
+            self.delete_elem_datastore_only(sqe)
+
+        return self.__unwrap_elem(sqe)
+
+    def __priority_entry_live(self, key, seq, sqe):
+        if isinstance(key, _MaxKey):
+            key = key.key
+
+        # matching seq as well as key keeps an entry from coming back to
+        # life when its sqe returns to an old key or is reused by a ring
+        return self.__internalDict.get(sqe.name) is sqe and \
+               self.__priorityKeys.get(sqe.name) == (key, seq)
+
+    def __field_value(self, sqe, field):
+        # scalars only have their value to index or prioritize by
+        if sqe.value is not None:
+            return sqe.value
+
+        return sqe.values[sqe.schema.idx[field]]
+
+    def __push_priority(self, sqe):
+        key = self.__field_value(sqe, self.priority)
+        seq = next(self.__prioritySeq)
+
+        self.__priorityKeys[sqe.name] = (key, seq)
+        heappush(self.__minHeap, (key, seq, sqe))
+        heappush(self.__maxHeap, (_MaxKey(key), seq, sqe))
+
+        # rebuild heaps once stale entries outnumber live ones
+        if len(self.__minHeap) > 2 * len(self) + 64:
+            self.__minHeap[:] = [entry for entry in self.__minHeap
+                                 if self.__priority_entry_live(*entry)]
+            self.__maxHeap[:] = [entry for entry in self.__maxHeap
+                                 if self.__priority_entry_live(*entry)]
+            heapify(self.__minHeap)
+            heapify(self.__maxHeap)
+
+    # these maintain in-memory indexes as sqes are added, removed and changed.
+    # Caller holds mutex
+    def __index_elem(self, sqe):
+        # like __internalDict, the sample array holds each name once
+        if (self.__sampleNames is not None and
+            sqe.name not in self.__samplePos):
+            self.__samplePos[sqe.name] = len(self.__sampleNames)
+            self.__sampleNames.append(sqe.name)
+
+        if self.ring:
+            # reuse the most recently freed slot. With none free, slots
+            # 0 .. len(ringSlots) - 1 are all taken
+            if self.__freeSlots:
+                self.ringSlots[sqe.name] = self.__freeSlots.pop()
+            else:
+                self.ringSlots[sqe.name] = len(self.ringSlots)
+
+        if self.priority is not None:
+            self.__push_priority(sqe)
+
+        for field, index in self.__fieldIndexes:
+            index.add(sqe, self.__field_value(sqe, field))
+
+    def __unindex_elem(self, sqe):
+        if (self.__sampleNames is not None and
+            sqe.name in self.__samplePos):
+            # fill the hole with the last name so the array stays dense
+            pos = self.__samplePos.pop(sqe.name)
+            lastName = self.__sampleNames.pop()
+            if lastName != sqe.name:
+                self.__sampleNames[pos] = lastName
+                self.__samplePos[lastName] = pos
+
+        if self.ring:
+            self.__freeSlots.append(self.ringSlots.pop(sqe.name))
+
+        if self.priority is not None:
+            self.__priorityKeys.pop(sqe.name, None)
+
+        for field, index in self.__fieldIndexes:
+            index.remove(sqe)
+
+    def __reindex_elem(self, sqe):
+        # sqes already removed from the superq aren't indexed
+        if self.__internalDict.get(sqe.name) is not sqe:
+            return
+
+        if self.priority is not None:
+            # superseded heap entries go stale with the old key
+            key = self.__field_value(sqe, self.priority)
+            entry = self.__priorityKeys.get(sqe.name)
+            if entry is None or entry[0] != key:
+                self.__push_priority(sqe)
+
+        for field, index in self.__fieldIndexes:
+            index.update(sqe, self.__field_value(sqe, field))
+
+    # empties in-memory indexes, keeping the fields they index
+    def __clear_indexes(self):
+        self.__sampleNames = None
+        self.__samplePos = None
+
+        self.ringSlots = {}
+        self.__freeSlots = []
+
+        self.__minHeap = []
+        self.__maxHeap = []
+        self.__priorityKeys = {}
+
+        self.__fieldIndexes = []
+        for indexes in (self.__hashIndexes, self.__sortedIndexes):
+            for field, index in indexes.items():
+                indexes[field] = type(index)()
+                self.__fieldIndexes.append((field, indexes[field]))
+
+    # maintains an in-memory index on field. Hash indexes serve find().
+    # Ordered indexes serve range(), ordered(), min(), max() and top()
+    def create_index(self, field, ordered = False):
+        indexes = self.__sortedIndexes if ordered else self.__hashIndexes
+
+        with self.mutex:
+            if field in indexes:
+                return
+
+            index = SuperQSortedIndex() if ordered else SuperQHashIndex()
+            for sqe in self.__internalList:
+                index.add(sqe, self.__field_value(sqe, field))
+
+            indexes[field] = index
+            self.__fieldIndexes.append((field, index))
+
+    def drop_index(self, field, ordered = False):
+        indexes = self.__sortedIndexes if ordered else self.__hashIndexes
+
+        with self.mutex:
+            index = indexes.pop(field)
+            self.__fieldIndexes.remove((field, index))
+
+    # like iteration, returns user-facing value without detaching sqe
+    def __elem_value(self, sqe):
+        if sqe.value is not None:
+            return sqe.scalar()
+
+        return sqe.demarshal(self.objSample, self.demarshalPlans)
+
+    def __sorted_index(self, field):
+        if field not in self.__sortedIndexes:
+            raise ValueError('no ordered index on field {0}'.format(field))
+
+        return self.__sortedIndexes[field]
+
+    # returns elements with lo <= field <= hi ordered by field. None bounds
+    # are open
+    def range(self, field, lo = None, hi = None):
+        with self.mutex:
+            return [self.__elem_value(sqe)
+                    for sqe in self.__sorted_index(field).range(lo, hi)]
+
+    # returns all elements ordered by field
+    def ordered(self, field, reverse = False):
+        with self.mutex:
+            index = self.__sorted_index(field)
+            sqes = index.reversed() if reverse else index.range()
+
+            return [self.__elem_value(sqe) for sqe in sqes]
+
+    # returns the k elements with the highest field values, highest first
+    def top(self, field, k):
+        with self.mutex:
+            sqes = self.__sorted_index(field).reversed()
+
+            return [self.__elem_value(sqe) for sqe in islice(sqes, k)]
+
+    def min(self, field):
+        with self.mutex:
+            for sqe in self.__sorted_index(field).range():
+                return self.__elem_value(sqe)
+
+        raise SuperQEmpty('no elements in superq')
+
+    def max(self, field):
+        with self.mutex:
+            for sqe in self.__sorted_index(field).reversed():
+                return self.__elem_value(sqe)
+
+        raise SuperQEmpty('no elements in superq')
+
+    # returns elements whose indexed fields match all given values, e.g.
+    # sq.find(b = 5). The 1st field's index yields the candidates
+    def find(self, **fields):
+        if not fields:
+            raise ValueError('no fields to find by')
+
+        with self.mutex:
+            for field in fields:
+                if field not in self.__hashIndexes:
+                    raise ValueError('no index on field {0}'.format(field))
+
+            items = iter(fields.items())
+            field, value = next(items)
+            sqes = self.__hashIndexes[field].find(value)
+            for field, value in items:
+                sqes = [sqe for sqe in sqes
+                        if self.__field_value(sqe, field) == value]
+
+            return [self.__elem_value(sqe) for sqe in sqes]
+
+    def pop_tail(self, block = True, timeout = None):
+        return self.pop(len(self) - 1, block, timeout)
+
+    # returns k distinct sqes chosen uniformly at random. Hosted superqs are
+    # sampled by the node, which holds the authoritative copy
+    def sample_elems(self, k):
+        if k < 0 or k > len(self):
+            raise ValueError('sample of {0} from superq of {1}'.format(
+                k, len(self)))
+
+        if self.__hosted_remotely():
+            return self.dataStore.superq_sample(self, k, self.secure)
+
+        with self.mutex:
+            if self.__sampleNames is None:
+                self.__sampleNames = list(self.__internalDict)
+                self.__samplePos = {name: pos for pos, name in
+                                    enumerate(self.__sampleNames)}
+
+            # partial Fisher-Yates shuffle. The array's order is arbitrary,
+            # so the picks are swapped into its first k positions in place
+            names = self.__sampleNames
+            samplePos = self.__samplePos
+
+            # elements sharing a name are sampled as one
+            if k > len(names):
+                raise ValueError('sample of {0} from {1} distinct names'.format(
+                    k, len(names)))
+            for i in range(0, k):
+                j = randrange(i, len(names))
+                names[i], names[j] = names[j], names[i]
+                samplePos[names[i]] = i
+                samplePos[names[j]] = j
+
+            return [self.__internalDict[name] for name in names[ : k]]
+
+    def sample(self, k):
+        return [self.__elem_value(sqe) for sqe in self.sample_elems(k)]
+
+    def random_elem(self):
+        if len(self) == 0:
+            raise SuperQEmpty('no elements in superq')
+
+        return self.sample(1)[0]
+
+    # rotate superqelems n steps to the right. If n is negative, rotates left.
+    # Element order isn't kept in the backing table, so only hosted superqs
+    # have anything to persist: the node's copy is rotated with one request
+    def rotate(self, n):
+        with self.mutex:
+            self.__internalList.rotate(n)
+
+            if self.__hosted_remotely():
+                self.dataStore.superq_rotate(self, n, self.secure)
+
+    # indicates superq is a client-side copy of one owned by a network node
+    def __hosted_remotely(self):
+        return self.attached and \
+               self.host is not None and \
+               not self.dataStore.public
+
+    # indicates that a formerly popped element has been fully processed.
+    # Hosted superqs keep the unfinished task count on the node, so producers
+    # and consumers in different processes share it
+    def task_done(self):
+        if self.__hosted_remotely():
+            self.dataStore.superq_task_done(self, self.secure)
+            return
+
+        with self.all_tasks_done:
+            unfinished = self.unfinished_tasks - 1
+            if unfinished <= 0:
+                if unfinished < 0:
+                    raise ValueError('task_done() called too many times')
+                self.all_tasks_done.notify_all()
+            self.unfinished_tasks = unfinished
+
+    # blocks until every pushed element has been popped and task_done()'d
+    def join(self):
+        if self.__hosted_remotely():
+            self.dataStore.superq_join(self, self.secure)
+            return
+
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    # blocks until any of sqs has elements and returns the 1st such superq,
+    # or None if timeout expires. One event is registered with every superq
+    # and set by the next push to any of them, so a single thread can serve
+    # many superqs without polling. Hosted superqs are waited on by their
+    # node, so they can't be mixed with local superqs or other hosts
+    @staticmethod
+    def wait_any(sqs, timeout = None):
+        if timeout is not None and timeout < 0:
+            raise ValueError('timeout must be non-negative')
+
+        for sq in sqs:
+            if len(sq) > 0:
+                return sq
+
+        hostedSqs = [sq for sq in sqs if sq.__hosted_remotely()]
+        if hostedSqs:
+            if len(hostedSqs) < len(sqs) or \
+               len(set(sq.host for sq in sqs)) > 1:
+                raise NotImplemented('wait_any() needs superqs of one host')
+
+            sq = sqs[0].dataStore.superq_wait_any(sqs,
+                                                  timeout,
+                                                  sqs[0].secure)
+
+            # pick up elements pushed by other clients of the node
+            if sq is not None and len(sq) == 0:
+                sq.dataStore.superq_read(sq.name, sq.host, sq.secure)
+
+            return sq
+
+        waiter = Event()
+        for sq in sqs:
+            with sq.mutex:
+                sq.__waiters.append(waiter)
+
+        try:
+            if timeout is not None:
+                endtime = time() + timeout
+
+            while True:
+                # checking after registering means no push can be missed
+                for sq in sqs:
+                    if len(sq) > 0:
+                        return sq
+
+                if timeout is None:
+                    waiter.wait()
+                else:
+                    remaining = endtime - time()
+                    if remaining <= 0.0 or not waiter.wait(remaining):
+                        return None
+
+                waiter.clear()
+        finally:
+            for sq in sqs:
+                with sq.mutex:
+                    sq.__waiters.remove(waiter)
+
+# read-only view of some of a superq's sqes, returned by slicing. Views hold
+# references to the parent's sqes rather than copies, so reading elements
+# through a view reads the parent's elements. The first mutation, or any use
+# of superq functionality a view doesn't provide, turns the view into a
+# detached copy first
+class superqview():
+    def __init__(self, parentSq, sqes):
+        self.__parentSq = parentSq
+        self.__sqes = sqes
+
+        # built on first lookup by key
+        self.__sqeDict = None
+
+        # detached superq the view became once mutated
+        self.__sq = None
+
+        self.objSample = parentSq.objSample
+
+    def __materialize(self):
+        if self.__sq is None:
+            self.__sq = self.copy()
+
+            # drop references to the parent's sqes
+            self.__sqes = None
+            self.__sqeDict = None
+
+        return self.__sq
+
+    # everything a view doesn't implement is served by the materialized copy
+    def __getattr__(self, attr):
+        # view state itself is missing only on partially built objects
+        if attr.startswith('_superqview__'):
+            raise AttributeError(attr)
+
+        return getattr(self.__materialize(), attr)
+
+    def __len__(self):
+        if self.__sq is not None:
+            return len(self.__sq)
+
+        return len(self.__sqes)
+
+    def __contains__(self, key):
+        if self.__sq is not None:
+            return key in self.__sq
+
+        return key in self.__get_sqeDict()
+
+    def __iter__(self):
+        if self.__sq is not None:
+            return iter(self.__sq)
+
+        return (self.__elem_value(sqe) for sqe in self.__sqes)
+
+    def __getitem__(self, val):
+        if self.__sq is not None:
+            return self.__sq[val]
+
+        if isinstance(val, slice):
+            return superqview(self.__parentSq, self.__sqes[val])
+
+        return self.__elem_value(self.n(val))
+
+    def __setitem__(self, key, value):
+        self.__materialize()[key] = value
+
+    def __str__(self):
+        return str(self.__materialize())
+
+    def __get_sqeDict(self):
+        if self.__sqeDict is None:
+            self.__sqeDict = {sqe.name: sqe for sqe in self.__sqes}
+
+        return self.__sqeDict
+
+    # like iteration, returns user-facing value without detaching sqe
+    def __elem_value(self, sqe):
+        if sqe.value is not None:
+            return sqe.scalar()
+
+        return sqe.demarshal(self.objSample,
+                             self.__parentSq.demarshalPlans)
+
+    # returns superqelems without any attempt at demarshalling
+    def n(self, key):
+        if self.__sq is not None:
+            return self.__sq.n(key)
+
+        sqeDict = self.__get_sqeDict()
+        if key in sqeDict:
+            return sqeDict[key]
+        elif isinstance(key, int) and key < len(self.__sqes):
+            # if element isn't keyed on the int, try the int as an index
+            return self.__sqes[key]
+        else:
+            raise KeyError(key)
+
+    def list(self):
+        return [val for val in self]
+
+    # returns a detached superq holding copies of the viewed elements
+    def copy(self):
+        if self.__sq is not None:
+            return copy(self.__sq)
+
+        sq = superq([])
+        sq.objSample = self.objSample
+        for sqe in self.__sqes:
+            sq.create_elem(copy(sqe))
+
+        return sq
+
+# array typecodes backing columnar superqs of ints and floats
+COLUMNAR_INT_TYPECODE = 'q'
+COLUMNAR_FLOAT_TYPECODE = 'd'
+
+# homogeneous int or float superq stored in a single array.array, returned by
+# superq(..., columnar = True). Values are kept unboxed rather than as keyed
+# superqelems, so columnar superqs have no keys, links or datastore backing.
+# Aggregates run over the whole array, through NumPy when it is installed
+class superqarray():
+    def __init__(self,
+                 initObj = None,
+                 name = None,
+                 maxlen = None,
+                 threadsafe = True,
+                 typecode = None):
+        self.name = name
+
+        # if no name provided, one will be assigned
+        if self.name is None:
+            self.name = new_key('sq')
+
+        # if maxlen is None, superq may grow unbounded
+        self.maxlen = maxlen
+
+        # same locking scheme as superq
+        self.mutex = RLock()
+        self.not_empty = Condition(self.mutex)
+        self.not_full = Condition(self.mutex)
+        self.threadsafe = threadsafe
+
+        values = [] if initObj is None else list(initObj)
+
+        # unless given, typecode is established by the 1st values added
+        self.__typed = typecode is not None
+        if typecode is None:
+            typecode = self.__infer_typecode(values)
+        self.__array = array(typecode)
+
+        self.push_many(values)
+
+    def __infer_typecode(self, values):
+        typecode = COLUMNAR_INT_TYPECODE
+        for value in values:
+            if type(value) is float:
+                typecode = COLUMNAR_FLOAT_TYPECODE
+            elif type(value) is not int:
+                raise TypeError('columnar superqs only hold ints and floats')
+
+        if values:
+            self.__typed = True
+
+        return typecode
+
+    def __len__(self):
+        return len(self.__array)
+
+    def __contains__(self, value):
+        return value in self.__array
+
+    def __iter__(self):
+        return iter(self.__array)
+
+    def __getitem__(self, val):
+        if isinstance(val, slice):
+            return superqarray(self.__array[val],
+                               threadsafe = self.threadsafe,
+                               typecode = self.typecode)
+
+        return self.__array[val]
+
+    def __setitem__(self, idx, value):
+        self.__array[idx] = value
+
+    def __str__(self):
+        return '{0}({1})'.format(self.name, self.__array.tolist())
+
+    def __get_typecode(self):
+        return self.__array.typecode
+
+    typecode = property(__get_typecode)
+
+    def list(self):
+        return self.__array.tolist()
+
+    # returns a NumPy array sharing memory with the superq. The superq cannot
+    # grow or shrink while any such array is alive
+    def ndarray(self):
+        if numpy is None:
+            raise NotImplemented('superqarray.ndarray() requires numpy')
+
+        return numpy.frombuffer(self.__array, dtype = self.typecode)
+
+    def push(self, value, idx = None):
+        # single-threaded superqs skip locking
+        if not self.threadsafe:
+            return self.__push_value(value, idx)
+
+        with self.not_full:
+            self.__push_value(value, idx)
+
+            self.not_empty.notify()
+
+    # adds value to the array, dropping from the other end when full.
+    # Caller holds mutex
+    def __push_value(self, value, idx):
+        if not self.__typed:
+            self.__array = array(self.__infer_typecode([value]))
+
+        if self.maxlen is not None and len(self) >= self.maxlen:
+            if idx is None or idx >= len(self) - 1:
+                del self.__array[0]
+            elif idx <= 0:
+                self.__array.pop()
+            else:
+                raise ValueError('Cannot insert into full set')
+
+        if idx is None or idx >= len(self):
+            self.__array.append(value)
+        else:
+            self.__array.insert(idx, value)
 
-    def push(self, value, idx = None, block = True, timeout = None):
+    def push_many(self, values):
         with self.not_full:
-            # handle dropping an element if needed
+            if not self.__typed:
+                values = list(values)
+                self.__array = array(self.__infer_typecode(values))
+
+            numValues = len(self)
+            self.__array.extend(values)
+            numValues = len(self) - numValues
+
+            # pushing past maxlen drops from the head
             if self.maxlen is not None and len(self) > self.maxlen:
-                if block:
-                    if timeout is None:
-                        while len(self) >= self.maxlen:
-                            self.not_full.wait()
-                    elif timeout < 0:
-                        raise ValueError('timeout must be non-negative')
-                    else:
-                        endtime = time() + timeout
-                        while len(self) >= self.maxlen:
-                            remaining = endtime - time()
-                            if remaining <= 0.0:
-                                raise SuperQFull('superq is full')
-                            self.not_full.wait(remaining)
-                else:
-                    if self.maxlen < 0:
-                        raise ValueError('maxlen is negative')
-                    return
-            elif self.maxlen is not None and len(self) == self.maxlen:
-                if idx is None or idx >= len(self) - 1:
-                    self.pop_head()
-                elif idx <= 0:
-                    self.pop_tail()
-                else:
-                    raise ValueError('Cannot insert into full set')
+                del self.__array[ : len(self) - self.maxlen]
 
-            # convert value to sqe if necessary
-            sqe = self.__wrap_elem(value)
+            self.not_empty.notify(numValues)
 
-            # add sqe to internal dictionary
-            self.__internalDict[sqe.name] = sqe
+    def extend(self, values):
+        return self.push_many(values)
 
-            # add sqe to internal list
-            if idx is None or idx >= len(self) - 1:
-                # default to stack/LIFO behavior
-                self.__internalList.push_tail(sqe)
-            elif idx == 0:
-                self.__internalList.push_head(sqe)
-            else:
-                self.__internalList.push(idx, sqe)
+    def push_head(self, value):
+        return self.push(value, 0)
 
-            # for now pushes on hosted superqs are slow due to blocking here
-            if self.attached:
-                self.create_elem_datastore_only(sqe, idx)
+    def push_tail(self, value):
+        return self.push(value, len(self))
 
-            self.not_empty.notify()
+    # waits until superq has values. Caller holds not_empty
+    def __wait_not_empty(self, block, timeout):
+        if not block:
+            if len(self) == 0:
+                raise SuperQEmpty('no elements in superq')
+        elif timeout is None:
+            while len(self) == 0:
+                self.not_empty.wait()
+        elif timeout < 0:
+            raise ValueError('timeout must be non-negative')
+        else:
+            endtime = time() + timeout
+            while len(self) == 0:
+                remaining = endtime - time()
+                if remaining <= 0.0:
+                    raise SuperQEmpty('no elements in superq')
+                self.not_empty.wait(remaining)
 
-            # return the object for elegant create_elem()
-            return sqe
+    def pop(self, idx = None, block = True, timeout = None):
+        # default to stack/LIFO behavior
+        if idx is None:
+            idx = -1
 
-    def push_head(self, value, block = True, timeout = None):
-        return self.push(value, 0, block, timeout)
+        # single-threaded superqs skip locking and never wait for elements
+        if not self.threadsafe:
+            if len(self) == 0:
+                raise SuperQEmpty('no elements in superq')
 
-    def push_tail(self, value, block = True, timeout = None):
-        return self.push(value, len(self), block, timeout)
+            return self.__array.pop(idx)
 
-    def pop(self, idx = None, block = True, timeout = None):
         with self.not_empty:
-            if not block:
-                if len(self) == 0:
-                    raise SuperQEmpty('no elements in superq')
-            elif timeout is None:
-                while len(self) == 0:
-                    self.not_empty.wait()
-            elif timeout < 0:
-                raise ValueError('timeout must be non-negative')
-            else:
-                endtime = time() + timeout
-                while len(self) == 0:
-                    remaining = endtime - time()
-                    if remaining <= 0.0:
-                        raise SuperQEmpty
-                    self.not_empty.wait(remaining)
+            self.__wait_not_empty(block, timeout)
 
-            # default to stack/LIFO behavior
-            if idx is None:
-                idx = len(self) - 1
+            value = self.__array.pop(idx)
 
-            # remove element from internal collections
-            sqe = self.__internalList.pop(idx)
-            self.__internalDict.pop(sqe.name)
+            self.not_full.notify()
 
-            # for now pops on hosted superqs are slow due to blocking here
-            if self.attached:
-                self.delete_elem_datastore_only(sqe)
+            return value
 
-            self.not_full.notify()
+    # pops up to maxItems values, in the order repeated pop() calls would
+    # return them
+    def pop_many(self, maxItems, block = True, timeout = None):
+        with self.not_empty:
+            self.__wait_not_empty(block, timeout)
 
-            return self.__unwrap_elem(sqe)
+            start = len(self) - min(maxItems, len(self))
+            values = self.__array[start : ]
+            del self.__array[start : ]
+
+            self.not_full.notify(len(values))
+
+            values.reverse()
+            return values.tolist()
 
     def pop_head(self, block = True, timeout = None):
         return self.pop(0, block, timeout)
 
     def pop_tail(self, block = True, timeout = None):
-        return self.pop(len(self) - 1, block, timeout)
+        return self.pop(-1, block, timeout)
 
-    # rotate superqelems n steps to the right. If n is negative, rotates left
-    def rotate(self, n):
-        # iterate to the indicated index
-        if n >= 0:
-            for i in range(0, n):
-                self.push_head(self.pop_tail())
-        else:
-            for i in range(1, abs(n)):
-                self.push_tail(self.pop_head())
+    # aggregates with func, or the ndarray method of the same name when
+    # NumPy is installed. NumPy results are converted back to Python scalars.
+    # NumPy int64 sums wrap past 2 ** 63, so exact aggregates of ints always
+    # use func
+    def __aggregate(self, func, methodName, exact = False):
+        with self.mutex:
+            if len(self) == 0:
+                raise SuperQEmpty('no elements in superq')
 
-    # waits for superq to be empty
-    def join(self):
-        raise NotImplemented('superq.join()')
+            if numpy is None or (exact and self.typecode == 'q'):
+                return func(self.__array)
+
+            return getattr(self.ndarray(), methodName)().item()
+
+    def sum(self):
+        # like the builtin, the sum of no values is 0
+        if len(self) == 0:
+            return 0
+
+        return self.__aggregate(sum, 'sum', exact = True)
+
+    def min(self):
+        return self.__aggregate(min, 'min')
+
+    def max(self):
+        return self.__aggregate(max, 'max')
+
+    def mean(self):
+        return self.__aggregate(lambda values: sum(values) / len(values),
+                                'mean',
+                                exact = True)
 
 # create public network node instance or private instance for program
 _dataStore = SuperQDataStore()
@@ -2161,6 +4637,9 @@ class SuperQNodeRequest():
         self.args = args_
         self.body = body_
 
+        # out of band buffers referenced by a binary body
+        self.buffers = []
+
         if self.msg_id == '':
             self.__set_msg_id()
 
@@ -2206,6 +4685,9 @@ class SuperQNodeResponse():
         self.result = result_
         self.body = body_
 
+        # out of band buffers referenced by a binary body
+        self.buffers = []
+
     def __str__(self):
         return '{0}|{1}%{2}'.format(self.msg_id,
                                     self.result,
@@ -2231,6 +4713,264 @@ class SuperQNodeResponse():
             exceptStr = 'Response: {0}\nException: {1}'.format(responseStr, e)
             raise MalformedNetworkResponse(exceptStr)
 
+# protocol clients ask nodes to switch new connections to. Every connection
+# starts out using the text protocol, which remains available for nodes that
+# don't know the binary one
+NODE_PROTOCOL = 'binary'
+
+# encodes and decodes node messages as delimited text. Message bodies may be
+# given as superqs, sqes, lists of sqes or lists of keys and are serialized
+# on the way out. Receivers decode bodies with the decode_*() matching what
+# they expect. Decoding superqs and sqes also takes the buffers the message
+# arrived with
+class SuperQTextCodec():
+    name = 'text'
+
+    # text messages never have out of band buffers
+    outOfBand = False
+
+    @classmethod
+    def encode_request(cls, request):
+        request.body = cls.encode_body(request.body)
+        return str(request).encode('utf-8')
+
+    @staticmethod
+    def decode_request(data):
+        request = SuperQNodeRequest()
+        request.from_str(data.decode('utf-8'))
+        return request
+
+    @classmethod
+    def encode_response(cls, response):
+        response.body = cls.encode_body(response.body)
+        response.result = str(response.result)
+        return str(response).encode('utf-8')
+
+    @staticmethod
+    def decode_response(data):
+        response = SuperQNodeResponse()
+        response.from_str(data.decode('utf-8'))
+        response.result = response.result == 'True'
+        return response
+
+    @staticmethod
+    def encode_body(body):
+        if isinstance(body, list):
+            if body and isinstance(body[0], superqelem):
+                return sqes_to_str(body)
+            return keys_to_str(body)
+
+        return str(body)
+
+    @staticmethod
+    def decode_str(body):
+        return body
+
+    @staticmethod
+    def decode_keys(body):
+        return keys_from_str(body)
+
+    @staticmethod
+    def decode_sqe(body, buffers = ()):
+        return superqelem(body, buildFromStr = True)
+
+    @staticmethod
+    def decode_sqes(body, buffers = ()):
+        return sqes_from_str(body)
+
+    @staticmethod
+    def decode_superq(body, buffers = ()):
+        return superq(body, attach = False, buildFromStr = True)
+
+# encodes and decodes node messages in binary. Requests are the msg_id and
+# cmd as varints and args as a length-prefixed string, responses are the
+# msg_id and a result byte. The body fills the rest of the message. Fields
+# are typed, so values need no quoting or escaping and bytes go out raw
+# rather than hexlified. Large bytes values aren't copied into the message
+# at all: encoding collects them in the message's buffers, which are framed
+# and sent after it as they are
+class SuperQBinaryCodec():
+    name = 'binary'
+
+    outOfBand = True
+
+    @classmethod
+    def encode_request(cls, request):
+        buf = bytearray()
+        varint_pack(buf, int(request.msg_id))
+        varint_pack(buf, request.cmd)
+        str_pack(buf, request.args)
+        request.buffers = []
+        cls.pack_body(buf, request.body, request.buffers)
+        return buf
+
+    @staticmethod
+    def decode_request(data):
+        data = memoryview(data)
+
+        try:
+            msg_id, offset = varint_unpack(data, 0)
+            cmd, offset = varint_unpack(data, offset)
+            args, offset = str_unpack(data, offset)
+
+            return SuperQNodeRequest(str(msg_id),
+                                     SQNodeCmd(cmd),
+                                     args,
+                                     data[offset : ])
+        except Exception as e:
+            raise MalformedNetworkRequest('Exception: {0}'.format(e))
+
+    @classmethod
+    def encode_response(cls, response):
+        buf = bytearray()
+        varint_pack(buf, int(response.msg_id))
+        buf.append(1 if response.result else 0)
+        response.buffers = []
+        cls.pack_body(buf, response.body, response.buffers)
+        return buf
+
+    @staticmethod
+    def decode_response(data):
+        data = memoryview(data)
+
+        try:
+            msg_id, offset = varint_unpack(data, 0)
+
+            return SuperQNodeResponse(str(msg_id),
+                                      data[offset] == 1,
+                                      data[offset + 1 : ])
+        except Exception as e:
+            raise MalformedNetworkResponse('Exception: {0}'.format(e))
+
+    @classmethod
+    def encode_body(cls, body, buffers = None):
+        buf = bytearray()
+        cls.pack_body(buf, body, buffers)
+        return buf
+
+    # appends body to buf, collecting large bytes values in buffers
+    @staticmethod
+    def pack_body(buf, body, buffers = None):
+        if isinstance(body, superq):
+            buf += body.to_bytes(buffers)
+        elif isinstance(body, superqelem):
+            sqe_pack(buf, body, buffers)
+        elif isinstance(body, list):
+            if body and isinstance(body[0], superqelem):
+                sqes_pack(buf, body, buffers)
+            else:
+                keys_pack(buf, body)
+        else:
+            buf += str(body).encode('utf-8')
+
+    @staticmethod
+    def decode_str(body):
+        return str(body, 'utf-8')
+
+    @staticmethod
+    def decode_keys(body):
+        return keys_unpack(body, 0)[0]
+
+    @staticmethod
+    def decode_sqe(body, buffers = ()):
+        return sqe_unpack(body, 0, buffers = buffers)[0]
+
+    @staticmethod
+    def decode_sqes(body, buffers = ()):
+        return sqes_unpack(body, 0, buffers = buffers)[0]
+
+    @staticmethod
+    def decode_superq(body, buffers = ()):
+        sq = superq([])
+        sq.buildFromBytes(body, buffers = buffers)
+        return sq
+
+# codecs by the protocol names used to negotiate them
+_nodeCodecs = {codec.name: codec for codec in (SuperQTextCodec,
+                                                SuperQBinaryCodec)}
+
+# most parts a single sendmsg() call is given, within the usual IOV_MAX
+SENDMSG_MAX_PARTS = 1024
+
+# sends parts in order without joining them. Where the socket supports it
+# parts are gathered by sendmsg(), so large buffers are never copied
+def send_parts(s, parts):
+    parts = [memoryview(part).cast('B') for part in parts if len(part)]
+
+    try:
+        while parts:
+            bytesSent = s.sendmsg(parts[ : SENDMSG_MAX_PARTS])
+            if bytesSent == 0:
+                raise RuntimeError('Connection closed.')
+
+            # drop the parts sent and trim a partially sent one
+            sentParts = 0
+            while sentParts < len(parts) and bytesSent >= len(parts[sentParts]):
+                bytesSent -= len(parts[sentParts])
+                sentParts += 1
+            del parts[ : sentParts]
+
+            if bytesSent:
+                parts[0] = parts[0][bytesSent : ]
+    except (AttributeError, NotImplementedError):
+        # ssl sockets and platforms without sendmsg() send part by part
+        for part in parts:
+            s.sendall(part)
+
+# receives exactly size bytes straight into a new bytearray
+def recv_buffer(s, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+
+    offset = 0
+    while offset < size:
+        bytesRead = s.recv_into(view[offset : ])
+        if bytesRead == 0:
+            raise RuntimeError('Connection closed.')
+        offset += bytesRead
+
+    return buf
+
+# frames are the message length followed by the message. Frames of codecs
+# with out of band buffers also give the number of buffers and their lengths
+# up front, so each buffer can be received into one preallocated bytearray
+def send_frame(s, data, buffers = (), outOfBand = False):
+    if outOfBand:
+        header = pack('II{0}Q'.format(len(buffers)),
+                      len(data),
+                      len(buffers),
+                      *[len(buffer) for buffer in buffers])
+    else:
+        header = pack('I', len(data))
+
+    send_parts(s, [header, data] + list(buffers))
+
+# receives a frame sent by send_frame(). Returns the message and its buffers.
+# Headers are checked against MAX_FRAME_BUFFERS and MAX_FRAME_SIZE before
+# anything is allocated for them, raising malformedEx if they are exceeded
+def recv_frame(s, outOfBand = False, malformedEx = MalformedNetworkRequest):
+    if not outOfBand:
+        messageLength = unpack('I', recv_buffer(s, 4))[0]
+        if messageLength > MAX_FRAME_SIZE:
+            raise malformedEx('frame of {0} bytes'.format(messageLength))
+
+        return recv_buffer(s, messageLength), []
+
+    messageLength, numBuffers = unpack('II', recv_buffer(s, 8))
+    if numBuffers > MAX_FRAME_BUFFERS:
+        raise malformedEx('frame with {0} buffers'.format(numBuffers))
+
+    lengths = unpack('{0}Q'.format(numBuffers),
+                     recv_buffer(s, 8 * numBuffers))
+
+    frameSize = messageLength + sum(lengths)
+    if frameSize > MAX_FRAME_SIZE:
+        raise malformedEx('frame of {0} bytes'.format(frameSize))
+
+    data = recv_buffer(s, messageLength)
+
+    return data, [recv_buffer(s, length) for length in lengths]
+
 # vigenere
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 class NetworkPrep():
@@ -2264,6 +5004,9 @@ class SuperQNetworkClientMgr():
         # dictionary of superq-based socket pools keyed by (host, port)
         self.__socketPoolDict = {}
 
+        # codec negotiated for each open socket
+        self.__socketCodecs = {}
+
     def __start_networked_datastore(self):
         # start superq local network node
         with self.__nodeProcessLock:
@@ -2299,6 +5042,7 @@ class SuperQNetworkClientMgr():
                     break
                 else:
                     s.close()
+                    self.__socketCodecs.pop(s, None)
 
     def __new_socket(self,
                      host = 'localhost',
@@ -2347,10 +5091,39 @@ class SuperQNetworkClientMgr():
         try:
             s = socketPool.pop(block = False)
         except SuperQEmpty:
-            return self.__new_socket(host, port, ssl)
+            s = self.__new_socket(host, port, ssl)
+
+            try:
+                self.__socketCodecs[s] = self.__negotiate(s)
+            except RuntimeError:
+                # nodes predating negotiation drop the connection instead
+                self.__socketCodecs.pop(s, None)
+                s.close()
+
+                s = self.__new_socket(host, port, ssl)
+                self.__socketCodecs[s] = SuperQTextCodec
 
         return s
 
+    # asks the node to switch socket to NODE_PROTOCOL. Returns the codec
+    # the connection uses from now on
+    def __negotiate(self, s):
+        if NODE_PROTOCOL == SuperQTextCodec.name:
+            return SuperQTextCodec
+
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.node_protocol.value
+        request.args = NODE_PROTOCOL
+
+        send_frame(s, SuperQTextCodec.encode_request(request))
+        data = recv_frame(s, malformedEx = MalformedNetworkResponse)[0]
+        response = SuperQTextCodec.decode_response(data)
+
+        if not response.result:
+            return SuperQTextCodec
+
+        return _nodeCodecs[NODE_PROTOCOL]
+
     def __return_socket(self,
                         s,
                         host = 'localhost',
@@ -2358,61 +5131,22 @@ class SuperQNetworkClientMgr():
         # return socket to appropriate socket pool
         self.__socketPoolDict[(host, port)].push(s)
 
-    def __send(self, s, msg):
-        buffer = msg
-        
-        totalSent = 0
-        while totalSent < len(buffer):
-            bytesSent = s.send(buffer[totalSent:])
-            if bytesSent == 0:
-                raise RuntimeError('Connection closed.')
-            totalSent = totalSent + bytesSent
-
-    def __recv(self, s, bytesToRecv):
-        buffer = bytearray()
-
-        while len(buffer) < bytesToRecv:
-            tempBuf = s.recv(bytesToRecv - len(buffer))
-            if len(tempBuf) == 0:
-                raise RuntimeError('Connection closed.')
-            buffer += tempBuf
-            
-        return buffer
-
     def __get_msg(self, s):
-        # first 4 bytes contain message body length
-        data = bytearray()
-        while len(data) < 4:
-            currentData = self.__recv(s, 4 - len(data))
-
-            if len(currentData) == 0:
-                raise Exception('0 bytes read. Connection probably closed.')
-
-            data += currentData
-
-        # convert length
-        messageLength = unpack('I', data)[0]
+        codec = self.__socketCodecs[s]
 
-        # now read the rest of the message
-        data = bytearray()
-        while len(data) < messageLength:
-            currentData = self.__recv(s, messageLength - len(data))
+        data, buffers = recv_frame(s,
+                                   codec.outOfBand,
+                                   MalformedNetworkResponse)
 
-            if len(currentData) == 0:
-                raise RuntimeError('Connection closed.')
-
-            data += currentData
+        response = codec.decode_response(data)
+        response.buffers = buffers
 
-        # decode character data
-        msg = data.decode('utf-8')
-
-        # build response object from string
-        response = SuperQNodeResponse()
-        response.from_str(msg)
+        # callers decode the response body with the connection's codec
+        response.codec = codec
 
         return response
 
-    def __send_msg(self, host, strMsg, secure = False):
+    def __send_msg(self, host, request, secure = False):
         ssl = False
 
         # 'local' is shorthand for localhost:DEFAULT_PORT
@@ -2431,15 +5165,15 @@ class SuperQNetworkClientMgr():
                 except ValueError:
                     port = DEFAULT_TCP_PORT
 
-        msg = bytearray()
-        msg.extend(pack('I', len(strMsg)))
-        msg.extend(strMsg.encode('utf-8'))
-
         # get existing socket from socket pool or initialize new one
         s = self.__get_socket(host, port, ssl)
 
         # send message
-        self.__send(s, msg)
+        codec = self.__socketCodecs[s]
+        send_frame(s,
+                   codec.encode_request(request),
+                   request.buffers,
+                   codec.outOfBand)
 
         # get response
         response = self.__get_msg(s)
@@ -2452,8 +5186,8 @@ class SuperQNetworkClientMgr():
     # this might be used in the case of create_elem for instance, to provide
     #  a non-blocking operation. But it requires some kind of transactional
     #  implementation or solution to prevent synchronization errors
-    def __send_msg_async(self, host, strMsg, secure = False):
-        t = Thread(target = self.__send_msg, args = (host, strMsg))
+    def __send_msg_async(self, host, request, secure = False):
+        t = Thread(target = self.__send_msg, args = (host, request))
         t.start()
 
     def superq_exists(self, name, host, secure = False):
@@ -2462,20 +5196,20 @@ class SuperQNetworkClientMgr():
         request.cmd = SQNodeCmd.superq_exists.value
         request.args = name
 
-        response = self.__send_msg(host, str(request), secure)
+        response = self.__send_msg(host, request, secure)
 
-        return eval(response.result)
+        return response.result
 
     def superq_create(self, sq, secure = False):
         # build request object from string
         request = SuperQNodeRequest()
         request.cmd = SQNodeCmd.superq_create.value
         request.args = sq.publicName
-        request.body = str(sq)
+        request.body = sq
 
-        response = self.__send_msg(sq.host, str(request), secure)
+        response = self.__send_msg(sq.host, request, secure)
 
-        if not eval(response.result):
+        if not response.result:
             raise SuperQEx('superq_create(): {0}'.format(response))
 
     def superq_read(self, name, host, secure = False):
@@ -2484,13 +5218,13 @@ class SuperQNetworkClientMgr():
         request.cmd = SQNodeCmd.superq_read.value
         request.args = name
 
-        response = self.__send_msg(host, str(request), secure)
+        response = self.__send_msg(host, request, secure)
 
-        if not eval(response.result):
+        if not response.result:
             raise SuperQEx('superq_read(): {0}'.format(response))
 
         # deserialize response body into a detached superq
-        sq = superq(response.body, attach = False, buildFromStr = True)
+        sq = response.codec.decode_superq(response.body, response.buffers)
 
         return sq
 
@@ -2500,11 +5234,80 @@ class SuperQNetworkClientMgr():
         request.cmd = SQNodeCmd.superq_delete.value
         request.args = sq.publicName
 
-        response = self.__send_msg(sq.host, str(request), secure)
+        response = self.__send_msg(sq.host, request, secure)
 
-        if not eval(response.result):
+        if not response.result:
             raise SuperQEx('superq_delete(): {0}'.format(response))
 
+    def superq_task_done(self, sq, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superq_task_done.value
+        request.args = sq.publicName
+
+        response = self.__send_msg(sq.host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superq_task_done(): {0}'.format(response))
+
+    # blocks until the node reports all tasks on the superq are done
+    def superq_join(self, sq, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superq_join.value
+        request.args = sq.publicName
+
+        response = self.__send_msg(sq.host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superq_join(): {0}'.format(response))
+
+    def superq_rotate(self, sq, n, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superq_rotate.value
+        request.args = '{0},{1}'.format(sq.publicName, n)
+
+        response = self.__send_msg(sq.host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superq_rotate(): {0}'.format(response))
+
+    def superq_sample(self, sq, k, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superq_sample.value
+        request.args = '{0},{1}'.format(sq.publicName, k)
+
+        response = self.__send_msg(sq.host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superq_sample(): {0}'.format(response))
+
+        # sampled sqes arrive as detached copies
+        return response.codec.decode_sqes(response.body, response.buffers)
+
+    # returns the 1st of sqs to have elements on their node, or None if
+    # timeout expires first
+    def superq_wait_any(self, sqs, timeout = None, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superq_wait_any.value
+        request.args = str(timeout)
+        request.body = [sq.publicName for sq in sqs]
+
+        response = self.__send_msg(sqs[0].host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superq_wait_any(): {0}'.format(response))
+
+        readyName = response.codec.decode_str(response.body)
+        for sq in sqs:
+            if sq.publicName == readyName:
+                return sq
+
+        return None
+
     def superq_query(self, sq, queryStr, secure = False):
         # build request object from string
         request = SuperQNodeRequest()
@@ -2512,10 +5315,11 @@ class SuperQNetworkClientMgr():
         request.args = sq.publicName
         request.body = queryStr
 
-        response = self.__send_msg(sq.host, str(request), secure)
+        response = self.__send_msg(sq.host, request, secure)
 
-        if eval(response.result):
-            return superq(response.body, attach = False, buildFromStr = True)
+        if response.result:
+            return response.codec.decode_superq(response.body,
+                                                response.buffers)
         else:
             raise SuperQEx('superq_query(): {0}'.format(response))
 
@@ -2524,23 +5328,36 @@ class SuperQNetworkClientMgr():
         request = SuperQNodeRequest()
         request.cmd = SQNodeCmd.superqelem_create.value
         request.args = '{0},{1}'.format(sq.publicName, idx)
-        request.body = str(sqe)
+        request.body = sqe
 
-        response = self.__send_msg(sq.host, str(request), secure)
+        response = self.__send_msg(sq.host, request, secure)
 
-        if not eval(response.result):
+        if not response.result:
             raise SuperQEx('superqelem_create(): {0}'.format(str(response)))
 
+    def superqelem_create_many(self, sq, sqes, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superqelem_create_many.value
+        request.args = '{0}'.format(sq.publicName)
+        request.body = sqes
+
+        response = self.__send_msg(sq.host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superqelem_create_many(): {0}'.format(
+                str(response)))
+
     def superqelem_update(self, sq, sqe, secure = False):
         # build request object
         request = SuperQNodeRequest()
         request.cmd = SQNodeCmd.superqelem_update.value
         request.args = '{0}'.format(sq.publicName)
-        request.body = str(sqe)
+        request.body = sqe
 
-        response = self.__send_msg(sq.host, str(request), secure)
+        response = self.__send_msg(sq.host, request, secure)
 
-        if not eval(response.result):
+        if not response.result:
             raise SuperQEx('superqelem_update(): {0}'.format(str(response)))
 
     def superqelem_delete(self, sq, sqeName, secure = False):
@@ -2550,14 +5367,30 @@ class SuperQNetworkClientMgr():
         request.args = '{0}'.format(sq.publicName)
         request.body = '{0}'.format(sqeName)
 
-        response = self.__send_msg(sq.host, str(request), secure)
+        response = self.__send_msg(sq.host, request, secure)
 
-        if not eval(response.result):
+        if not response.result:
             raise SuperQEx('superqelem_delete(): {0}'.format(str(response)))
 
+    def superqelem_delete_many(self, sq, sqeNames, secure = False):
+        # build request object
+        request = SuperQNodeRequest()
+        request.cmd = SQNodeCmd.superqelem_delete_many.value
+        request.args = '{0}'.format(sq.publicName)
+        request.body = sqeNames
+
+        response = self.__send_msg(sq.host, request, secure)
+
+        if not response.result:
+            raise SuperQEx('superqelem_delete_many(): {0}'.format(
+                str(response)))
+
 # deserializes requests, processes them, and serializes responses
 class SuperQStreamHandler(StreamRequestHandler):
     def handle(self):             
+        # connections use the text protocol until the client negotiates
+        self.codec = SuperQTextCodec
+
         # client can stay connected for multiple Request-Response transactions
         while True:
             try:
@@ -2574,78 +5407,53 @@ class SuperQStreamHandler(StreamRequestHandler):
         raise RuntimeError(msg)
 
     def return_response(self, response):
-        strResponse = str(response)
-        msg = bytearray()
-        
-        msg.extend(pack('I', len(strResponse)))
-        msg.extend(strResponse.encode('utf-8'))
+        data = self.codec.encode_response(response)
 
-        self.wfile.write(msg)
+        send_frame(self.connection,
+                   data,
+                   response.buffers,
+                   self.codec.outOfBand)
 
     def handle_connection(self):
-        # first 4 bytes contain message body length
-        data = bytearray()
         try:
-            while len(data) < 4:
-                currentData = self.connection.recv(4 - len(data))
-
-                if len(currentData) == 0:
-                    self.raise_error('connection closed while reading length')
-
-                data += currentData
+            data, buffers = recv_frame(self.connection, self.codec.outOfBand)
         except Exception as e:
             self.raise_error(str(e))
             raise
 
-        # convert length
-        messageLength = unpack('I', data)[0]
-
-        # now read the rest of the message
-        data = bytearray()
-        while len(data) < messageLength:
-            currentData = self.connection.recv(messageLength - len(data))
-
-            if len(currentData) == 0:
-                self.raise_error('connection closed during read')
-
-            data += currentData
-
-        # decode character data
-        msg = data.decode('utf-8')
-
-        # build request object from string
-        request = SuperQNodeRequest()
-        request.from_str(msg)
+        # build request object from message
+        request = self.codec.decode_request(data)
+        request.buffers = buffers
 
         # start building response
         response = SuperQNodeResponse()
         response.msg_id = request.msg_id
-        response.result = str(False)
+        response.result = False
 
         cmd = request.cmd
         args = request.args
         body = request.body
 
         if cmd == SQNodeCmd.superq_exists:
-            response.result = str(_dataStore.superq_exists(args))
+            response.result = _dataStore.superq_exists(args)
             response.body = ''
         elif cmd == SQNodeCmd.superq_create:
             if _dataStore.superq_exists(args):
-                response.result = str(False)
+                response.result = False
             else:
                 # deserialize request body into a detached superq
-                sq = superq(body, attach = False, buildFromStr = True)
+                sq = self.codec.decode_superq(body, request.buffers)
 
                 # assign superq to the node datastore
                 sq.attach()
 
-                response.result = str(True)
+                response.result = True
         elif cmd == SQNodeCmd.superq_read:
             sq = _dataStore.superq_read(args)
 
-            response.body = str(sq)
+            response.body = sq
 
-            response.result = str(True)
+            response.result = True
         elif cmd == SQNodeCmd.superq_delete:
             try:
                 sq = _dataStore.superq_read(args)
@@ -2654,7 +5462,69 @@ class SuperQStreamHandler(StreamRequestHandler):
 
             _dataStore.superq_delete(sq)
 
-            response.result = str(True)
+            response.result = True
+        elif cmd == SQNodeCmd.superq_task_done:
+            try:
+                sq = _dataStore.superq_read(args)
+            except:
+                raise KeyError('superq {0} does not exist'.format(args))
+
+            sq.task_done()
+
+            response.result = True
+        elif cmd == SQNodeCmd.superq_join:
+            try:
+                sq = _dataStore.superq_read(args)
+            except:
+                raise KeyError('superq {0} does not exist'.format(args))
+
+            # this handler thread blocks until the last task_done() arrives
+            sq.join()
+
+            response.result = True
+        elif cmd == SQNodeCmd.superq_rotate:
+            sqName, n = args.rsplit(',', 1)
+
+            try:
+                sq = _dataStore.superq_read(sqName)
+            except:
+                raise KeyError('superq {0} does not exist'.format(sqName))
+
+            sq.rotate(int(n))
+
+            response.result = True
+        elif cmd == SQNodeCmd.superq_sample:
+            sqName, k = args.rsplit(',', 1)
+
+            try:
+                sq = _dataStore.superq_read(sqName)
+            except:
+                raise KeyError('superq {0} does not exist'.format(sqName))
+
+            # k was checked against the client's copy, which may be longer
+            # than the node's by now
+            with sq.mutex:
+                sqes = sq.sample_elems(min(int(k), len(sq)))
+
+            response.body = sqes
+
+            response.result = True
+        elif cmd == SQNodeCmd.superq_wait_any:
+            timeout = None if args == 'None' else float(args)
+
+            sqs = []
+            for sqName in self.codec.decode_keys(body):
+                try:
+                    sqs.append(_dataStore.superq_read(sqName))
+                except:
+                    raise KeyError('superq {0} does not exist'.format(sqName))
+
+            # this handler thread blocks until one of the superqs has elements
+            sq = superq.wait_any(sqs, timeout)
+
+            response.body = '' if sq is None else sq.publicName
+
+            response.result = True
         elif cmd == SQNodeCmd.superq_query:
             try:
                 sq = _dataStore.superq_read(args)
@@ -2662,9 +5532,10 @@ class SuperQStreamHandler(StreamRequestHandler):
                 raise KeyError('superq {0} does not exist'.format(args))
 
             # store resulting superq in response body
-            response.body = str(_dataStore.superq_query_local(body))
+            queryStr = self.codec.decode_str(body)
+            response.body = _dataStore.superq_query_local(queryStr)
 
-            response.result = str(True)
+            response.result = True
         elif cmd == SQNodeCmd.superqelem_exists:
             pass
         elif cmd == SQNodeCmd.superqelem_create:
@@ -2681,11 +5552,23 @@ class SuperQStreamHandler(StreamRequestHandler):
                 raise KeyError('superq {0} does not exist'.format(sqName))
 
             # build sqe from request
-            sqe = superqelem(body, buildFromStr = True)
+            sqe = self.codec.decode_sqe(body, request.buffers)
 
             sq.create_elem(sqe, idx = sqeIdx)
 
-            response.result = str(True)
+            response.result = True
+        elif cmd == SQNodeCmd.superqelem_create_many:
+            sqName = args
+
+            try:
+                sq = _dataStore.superq_read(sqName)
+            except KeyError:
+                raise KeyError('superq {0} does not exist'.format(sqName))
+
+            # build sqes from request and add them in one batch
+            sq.push_many(self.codec.decode_sqes(body, request.buffers))
+
+            response.result = True
         elif cmd == SQNodeCmd.superqelem_read:
             pass
         elif cmd == SQNodeCmd.superqelem_update:
@@ -2697,14 +5580,14 @@ class SuperQStreamHandler(StreamRequestHandler):
                 raise KeyError('superq {0} does not exist'.format(sqName))
 
             # build sqe from request
-            sqe = superqelem(body, buildFromStr = True)
+            sqe = self.codec.decode_sqe(body, request.buffers)
 
             sq.update_elem(sqe)
 
-            response.result = str(True)
+            response.result = True
         elif cmd == SQNodeCmd.superqelem_delete:
             sqName = args
-            sqeName = body
+            sqeName = self.codec.decode_str(body)
 
             try:
                 sq = _dataStore.superq_read(sqName)
@@ -2713,11 +5596,30 @@ class SuperQStreamHandler(StreamRequestHandler):
 
             sq.delete_elem(sqeName)
 
-            response.result = str(True)
+            response.result = True
+        elif cmd == SQNodeCmd.superqelem_delete_many:
+            sqName = args
+
+            try:
+                sq = _dataStore.superq_read(sqName)
+            except KeyError:
+                raise KeyError('superq {0} does not exist'.format(sqName))
+
+            sq.delete_elems(self.codec.decode_keys(body))
+
+            response.result = True
+        elif cmd == SQNodeCmd.node_protocol:
+            # unknown protocols leave the connection on the current one
+            response.result = args in _nodeCodecs
         else:
-            raise MalformedNetworkRequest(msg)
+            raise MalformedNetworkRequest(str(request))
 
         self.return_response(response)
+
+        # the response went out using the old protocol, the switch applies
+        # to later messages
+        if cmd == SQNodeCmd.node_protocol and response.result:
+            self.codec = _nodeCodecs[args]
           
 class SuperQTCPServer(TCPServer):
     def __init__(self,
@@ -3,8 +3,13 @@ import datetime
 import random
 import time
 
+from dataclasses import dataclass
 from os import remove
-from superq import LinkedList, LinkedListNode, shutdown, superq, superqelem
+from socket import socketpair
+from struct import pack
+from superq import LinkedList, LinkedListNode, SuperQEmpty, shutdown, superq
+from superq import MalformedNetworkRequest, MAX_FRAME_BUFFERS, MAX_FRAME_SIZE
+from superq import OUT_OF_BAND_THRESHOLD, recv_frame, send_frame, superqelem
 from threading import Lock, Thread
 
 class FooNode(LinkedListNode):
@@ -45,6 +50,19 @@ class Foo4():
             raise AttributeError
         self.a = a
 
+@dataclass
+class Foo5():
+    a: str
+    b: int
+    _c: int = 0
+
+class Foo6():
+    __slots__ = ('a', 'b')
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
 try:
     print('\nLINKEDLIST tests:\n')
 
@@ -105,6 +123,37 @@ try:
     print('\tExpected list length = {0}, actual = {1}'.format(10, len(ll)))
     assert(len(ll) == 10)
 
+    print('Testing indexed access on large list ...')
+    print('\tCreating list ...')
+    ll = LinkedList()
+    pyLst = []
+    for i in range(0, 5000):
+        node = FooNode(i)
+        ll.push_tail(node)
+        pyLst.append(node)
+    print('\tInserting and removing elements by index ...')
+    for i in range(0, 2000):
+        idx = random.randrange(1, len(pyLst) - 1)
+        if i % 2 == 0:
+            node = FooNode(-i)
+            ll.push_middle(idx, node)
+            pyLst.insert(idx, node)
+        else:
+            node = ll.pop_middle(idx)
+            assert(node is pyLst.pop(idx))
+    print('\tRemoving elements by node ...')
+    for i in range(0, 500):
+        ll.pop_node(pyLst.pop(random.randrange(0, len(pyLst))))
+    print('\tExpected list length = {0}, actual = {1}'.format(len(pyLst),
+                                                              len(ll)))
+    assert(len(ll) == len(pyLst))
+    print('\tChecking values ...')
+    for i in range(0, len(pyLst), 7):
+        assert(ll[i] is pyLst[i])
+        assert(ll[-i - 1] is pyLst[-i - 1])
+    assert([node for node in ll] == pyLst)
+    print('\tPassed value check.')
+
     print('\nDETACHED superq tests:\n')
 
     print('Testing empty superq creation ...')
@@ -165,6 +214,16 @@ try:
     print('\tDeleting superq ...')
     sq.delete()
 
+    print('Testing generated superqelem keys are unique ...')
+    sq = superq(list(range(0, 1000)))
+    sqeNames = set([sq.n(i).name for i in range(0, len(sq))])
+    print('\tExpected unique keys = {0}, actual = {1}'.format(1000,
+                                                             len(sqeNames)))
+    assert(len(sqeNames) == 1000)
+    assert(all(isinstance(sqeName, str) for sqeName in sqeNames))
+    print('\tDeleting superq ...')
+    sq.delete()
+
     print('Testing superq basic slicing ...')
     print('\tCreating superq ...')
     sq = superq([10, 11, 12, 13, 14, 15])
@@ -193,6 +252,59 @@ try:
     print('\tDeleting superq ...')
     sq.delete()
 
+    print('Testing superq slices are views ...')
+    print('\tCreating superq ...')
+    sq = superq([Foo(str(i), i) for i in range(100)], keyCol = 'a')
+    sqSlice = sq[10:20]
+    print('\tExpected superq length = {0}, actual = {1}'.format(10,
+                                                               len(sqSlice)))
+    assert(len(sqSlice) == 10)
+    print('\tChecking slice shares elements with superq ...')
+    assert(sqSlice.n(0) is sq.n('10'))
+    assert(sqSlice[2:4].n(1) is sq.n('13'))
+    print('\tCopying slice ...')
+    sqCopy = sqSlice.copy()
+    assert(sqCopy.n(0) is not sq.n('10') and sqCopy.n(0).b == 10)
+    print('\tModifying slice ...')
+    sqSlice.push(Foo('x', 1000))
+    print('\tExpected superq lengths = {0}, {1}, actual = {2}, {3}'.format(
+        11, 100, len(sqSlice), len(sq)))
+    assert(len(sqSlice) == 11 and len(sq) == 100)
+    assert('x' not in sq)
+
+    print('Testing columnar superq ...')
+    sq = superq([3, 1, 4, 1, 5], columnar = True)
+    print('\tExpected typecode = {0}, actual = {1}'.format('q', sq.typecode))
+    assert(sq.typecode == 'q')
+    sq.push(9)
+    sq.push_head(2)
+    print('\tExpected values = {0}, actual = {1}'.format([2, 3, 1, 4, 1, 5, 9],
+                                                        sq.list()))
+    assert(sq.list() == [2, 3, 1, 4, 1, 5, 9])
+    print('\tExpected sum, min, max = {0}, {1}, {2}, actual = {3}, {4}, {5}'
+          .format(25, 1, 9, sq.sum(), sq.min(), sq.max()))
+    assert(sq.sum() == 25 and sq.min() == 1 and sq.max() == 9)
+    vals = [sq.pop(), sq.pop_head()] + sq.pop_many(2)
+    print('\tExpected values = {0}, actual = {1}'.format([9, 2, 5, 1], vals))
+    assert(vals == [9, 2, 5, 1])
+    print('\tTesting columnar sum past 2 ** 63 ...')
+    sq = superq([2 ** 63 - 1, 1], columnar = True)
+    print('\tExpected sum = {0}, actual = {1}'.format(2 ** 63, sq.sum()))
+    assert(sq.sum() == 2 ** 63 and sq.mean() == 2 ** 62)
+    print('\tTesting bounded float columnar superq ...')
+    sq = superq([], columnar = True, maxlen = 3)
+    sq.extend([1.0, 2, 3, 4])
+    print('\tExpected values = {0}, actual = {1}'.format([2.0, 3.0, 4.0],
+                                                        sq.list()))
+    assert(sq.list() == [2.0, 3.0, 4.0] and sq.typecode == 'd')
+    print('\tExpected mean = {0}, actual = {1}'.format(3.0, sq.mean()))
+    assert(sq.mean() == 3.0)
+    try:
+        superq(['a'], columnar = True)
+        raise Exception('\tExpected failure did not occur.')
+    except TypeError:
+        print('\tCreating str columnar superq correctly failed.')
+
     print('Additional superq slicing ...')
     print('\tCreating superq ...')
     sq = superq([1, 2, 3, 4, 5, 6, 7, 8])
@@ -272,6 +384,19 @@ try:
     print('\tExpected value = {0}, actual = {1}'.format(5, atomVal))
     assert(atomVal == 5)
 
+    print('Testing superqelems with the same fields share a schema ...')
+    assert(sq.n(0).schema is sq.n(1).schema)
+    print('\tExpected fields = {0}, actual = {1}'.format(('a', 'b'),
+                                                         sq.n(1).schema.names))
+    assert(sq.n(1).schema.names == ('a', 'b'))
+
+    print('Testing superqelem fields do not modify the superqelem class ...')
+    assert(type(sq.n(0)) is type(sq.n(1)))
+    assert(isinstance(sq.n(0), superqelem))
+    assert(not hasattr(superqelem, 'a') and not hasattr(superqelem, 'b'))
+    print('\tExpected value = {0}, actual = {1}'.format(2, sq.n(1).b))
+    assert(sq.n(1).b == 2)
+
     print('Testing attaching superq to datastore ...')
     sqName = sq.name
     sq.attach()
@@ -610,6 +735,351 @@ try:
     sqA.delete()
     sqB.delete()
 
+    print('Testing demarshal plans ...')
+    sq = superq([Foo(str(i), i) for i in range(10)],
+                keyCol = 'a',
+                name = 'sqPlans',
+                attach = True)
+    for sample in [Foo('a', 1), Foo3('a', 1)]:
+        sqResult = sq.query(['a', 'b'], ['<self>'], 'b >= 5', sample)
+        sqResult.objSample = sample
+        vals = sorted(foo.b for foo in sqResult)
+        print('\tExpected values = {0}, actual = {1}'.format([5, 6, 7, 8, 9],
+                                                            vals))
+        assert(vals == [5, 6, 7, 8, 9])
+        assert(all(type(foo) is type(sample) for foo in sqResult))
+    print('\tExpected cached plans = {0}, actual = {1}'.format(
+        2, len(sq.demarshalPlans)))
+    assert(len(sq.demarshalPlans) == 2)
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing extending superq in a single batch ...')
+    print('\tCreating superq ...')
+    sq = superq([Foo('a', 1)], keyCol = 'a', name = 'sqExt', attach = True)
+    print('\tExtending superq ...')
+    sq.extend([Foo(str(i), i) for i in range(1000)])
+    print('\tRe-loading superq ...')
+    sqLen = len(superq('sqExt'))
+    print('\tExpected superq length = {0}, actual = {1}'.format(1001, sqLen))
+    assert(sqLen == 1001)
+    print('\tQuerying batched rows ...')
+    sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(990))
+    print('\tExpected result length = {0}, actual = {1}'.format(10,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 10)
+    print('\tExtending bounded superq ...')
+    sqBounded = superq([1, 2, 3], maxlen = 5)
+    sqBounded.extend([4, 5, 6, 7])
+    print('\tExpected values = {0}, actual = {1}'.format([3, 4, 5, 6, 7],
+                                                        sqBounded.list()))
+    assert(sqBounded.list() == [3, 4, 5, 6, 7])
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing popping many elements in a single batch ...')
+    print('\tCreating superq ...')
+    sq = superq([Foo(str(i), i) for i in range(10)],
+                keyCol = 'a',
+                name = 'sqPop',
+                attach = True)
+    print('\tPopping elements ...')
+    vals = [foo.b for foo in sq.pop_many(4)]
+    print('\tExpected values = {0}, actual = {1}'.format([9, 8, 7, 6], vals))
+    assert(vals == [9, 8, 7, 6])
+    sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(0))
+    print('\tExpected result length = {0}, actual = {1}'.format(6,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 6)
+    print('\tPopping more elements than remain ...')
+    vals = sq.pop_many(10)
+    print('\tExpected popped = {0}, actual = {1}'.format(6, len(vals)))
+    assert(len(vals) == 6 and len(sq) == 0)
+    print('\tPopping from empty superq with timeout ...')
+    try:
+        sq.pop_many(10, timeout = .1)
+        assert(False)
+    except SuperQEmpty:
+        print('\tPop correctly timed out.')
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing joining superq after all tasks are done ...')
+    sq = superq([])
+    sq.extend(range(100))
+    def worker_thread(sq):
+        while True:
+            sq.pop()
+            sq.task_done()
+    thread = Thread(target = worker_thread, args = (sq,))
+    thread.daemon = True
+    thread.start()
+    sq.join()
+    print('\tExpected superq length = {0}, actual = {1}'.format(0, len(sq)))
+    assert(len(sq) == 0)
+    print('\tCalling task_done too many times ...')
+    try:
+        sq.task_done()
+        assert(False)
+    except ValueError:
+        print('\ttask_done correctly failed.')
+
+    print('Testing rotating superq ...')
+    sq = superq([1, 2, 3, 4, 5])
+    sq.rotate(2)
+    print('\tExpected values = {0}, actual = {1}'.format([4, 5, 1, 2, 3],
+                                                        sq.list()))
+    assert(sq.list() == [4, 5, 1, 2, 3])
+    sq.rotate(-3)
+    print('\tExpected values = {0}, actual = {1}'.format([2, 3, 4, 5, 1],
+                                                        sq.list()))
+    assert(sq.list() == [2, 3, 4, 5, 1])
+
+    print('Testing declared superqelem fields ...')
+    for sq, expected in [(superq([Foo5('a', 1, 2)]), ('a', 'b')),
+                         (superq([Foo6('a', 1)]), ('a', 'b')),
+                         (superq([Foo2('a', 1, 1.5)], schema = ['c', 'a']),
+                          ('c', 'a'))]:
+        names = sq.n(0).schema.names
+        print('\tExpected fields = {0}, actual = {1}'.format(expected, names))
+        assert(names == expected)
+    sq = superq(str(sq), buildFromStr = True)
+    print('\tExpected schema = {0}, actual = {1}'.format(('c', 'a'),
+                                                         sq.schema))
+    assert(sq.schema == ('c', 'a'))
+
+    print('Testing independent iterators ...')
+    sq = superq([1, 2, 3])
+    iterA = iter(sq)
+    iterB = iter(sq)
+    vals = [next(iterA), next(iterB), next(iterA), next(iterB)]
+    print('\tExpected values = {0}, actual = {1}'.format([1, 1, 2, 2], vals))
+    assert(vals == [1, 1, 2, 2])
+    print('\tModifying superq during iteration ...')
+    sq.pop_head()
+    sq.push(4)
+    vals = list(iterA)
+    print('\tExpected values = {0}, actual = {1}'.format([3], vals))
+    assert(vals == [3])
+    print('\tIterating while another thread pushes and pops ...')
+    sq = superq(list(range(1000)), name = 'sqIter', attach = True)
+    def writer():
+        for i in range(0, 200):
+            sq.pop_head()
+            sq.push(1000 + i)
+    writerThread = Thread(target = writer)
+    writerThread.start()
+    for i in range(0, 20):
+        vals = list(sq)
+        assert(len(vals) == len(set(vals)) and 999 <= len(vals) <= 1000)
+    writerThread.join()
+    print('\tExpected length = {0}, actual = {1}'.format(1000, len(list(sq))))
+    assert(list(sq) == list(range(200, 1200)))
+    sq.delete()
+
+    print('Testing ring buffer superq ...')
+    sq = superq([], name = 'sqRing', maxlen = 3, ring = True, attach = True)
+    firstSqe = sq.push(0)
+    for i in range(1, 10):
+        sq.push(i)
+    print('\tExpected values = {0}, actual = {1}'.format([7, 8, 9], sq.list()))
+    assert(sq.list() == [7, 8, 9])
+    print('\tChecking oldest sqe was reused ...')
+    assert(sq.n(2) is firstSqe)
+    sqResult = sq.query(['_val_'], ['<self>'], '_slot_ < 3')
+    print('\tExpected result length = {0}, actual = {1}'.format(3,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 3)
+    sqResult = sq.query(['_val_'], ['<self>'], '_val_ = 9')
+    print('\tExpected result length = {0}, actual = {1}'.format(1,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 1)
+    print('\tPushing onto head ...')
+    sq.push_head(6)
+    print('\tExpected values = {0}, actual = {1}'.format([6, 7, 8], sq.list()))
+    assert(sq.list() == [6, 7, 8])
+    sq.delete()
+    print('\tExtending full ring superq ...')
+    sq = superq([], name = 'sqRing', maxlen = 3, ring = True, attach = True)
+    firstSqe = sq.push(0)
+    sq.extend([1, 2, 3, 4])
+    print('\tExpected values = {0}, actual = {1}'.format([2, 3, 4], sq.list()))
+    assert(sq.list() == [2, 3, 4])
+    assert(sq.n(2) is firstSqe)
+    sqResult = sq.query(['_val_'], ['<self>'], '_slot_ < 3')
+    assert(len(sqResult) == 3)
+    sqResult = sq.query(['_val_'], ['<self>'], '_val_ < 2')
+    print('\tExpected result length = {0}, actual = {1}'.format(0,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 0)
+    sq.delete()
+    print('\tOverwriting object elements with scalars ...')
+    sq = superq([], maxlen = 2, ring = True)
+    sq.push(Foo('x', 1))
+    sq.push(Foo('y', 2))
+    sqe = sq.push(5)
+    sqeCopy = superqelem(str(sqe), buildFromStr = True)
+    print('\tExpected value = {0}, actual = {1}'.format(5, sqeCopy.value))
+    assert(sqe.values == [] and not hasattr(sqe, 'a'))
+    assert(sqeCopy.value == 5 and sqeCopy.values == [])
+    print('\tChecking ring superqs need maxlen ...')
+    try:
+        superq([], ring = True)
+        raise Exception('\tExpected failure did not occur.')
+    except ValueError:
+        print('\tCreating ring superq correctly failed.')
+
+    print('Testing random sampling ...')
+    sq = superq(list(range(100)))
+    vals = sq.sample(10)
+    print('\tExpected {0} distinct values, actual = {1}'.format(10,
+                                                               len(set(vals))))
+    assert(len(set(vals)) == 10 and set(vals) <= set(range(100)))
+    print('\tSampling after removals ...')
+    sq.pop_many(50)
+    for i in range(0, 10):
+        sq.pop_head()
+    vals = sq.sample(40)
+    print('\tExpected values = {0}, actual = {1}'.format(list(range(10, 50)),
+                                                        sorted(vals)))
+    assert(sorted(vals) == list(range(10, 50)))
+    assert(10 <= sq.read_elem() < 50)
+    try:
+        sq.sample(41)
+        raise Exception('\tExpected failure did not occur.')
+    except ValueError:
+        print('\tOversized sample correctly failed.')
+    print('\tSampling after pushing an existing key ...')
+    sq = superq([Foo('a', 1), Foo('b', 2), Foo('c', 3)], keyCol = 'a')
+    sq.sample(1)
+    sq.push(Foo('d', 4))
+    sq.push(Foo('d', 4))
+    vals = [foo.a for foo in sq.sample(4)]
+    print('\tExpected values = {0}, actual = {1}'.format(['a', 'b', 'c', 'd'],
+                                                        sorted(vals)))
+    assert(sorted(vals) == ['a', 'b', 'c', 'd'])
+    try:
+        sq.sample(5)
+        raise Exception('\tExpected failure did not occur.')
+    except ValueError:
+        print('\tSample of duplicate keys correctly failed.')
+
+    print('Testing popping by priority ...')
+    sq = superq([5, 1, 4, 2, 3], priority = '_val_')
+    vals = [sq.pop_min(), sq.pop_max(), sq.pop_min()]
+    print('\tExpected values = {0}, actual = {1}'.format([1, 5, 2], vals))
+    assert(vals == [1, 5, 2])
+    print('\tExpected superq values = {0}, actual = {1}'.format([4, 3],
+                                                               sq.list()))
+    assert(sq.list() == [4, 3])
+    print('\tPopping by priority field after update ...')
+    sq = superq([Foo(str(i), i) for i in range(100)],
+                keyCol = 'a',
+                priority = 'b',
+                name = 'sqPriority',
+                attach = True)
+    sq.n('50').b = -1
+    sq.n('10').b = 1000
+    foo = sq.pop_min()
+    print('\tExpected value = {0}, actual = {1}'.format('50', foo.a))
+    assert(foo.a == '50')
+    foo = sq.pop_max()
+    print('\tExpected value = {0}, actual = {1}'.format('10', foo.a))
+    assert(foo.a == '10')
+    sq.pop()
+    foo = sq.pop_max()
+    print('\tExpected value = {0}, actual = {1}'.format('98', foo.a))
+    assert(foo.a == '98')
+    sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(0))
+    print('\tExpected result length = {0}, actual = {1}'.format(96,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 96)
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing finding elements through a hash index ...')
+    sq = superq([Foo(str(i), i % 10) for i in range(100)], keyCol = 'a')
+    sq.create_index('b')
+    vals = sorted(foo.a for foo in sq.find(b = 3))
+    print('\tExpected matches = {0}, actual = {1}'.format(10, len(vals)))
+    assert(len(vals) == 10 and vals[0] == '13')
+    print('\tUpdating, popping and adding elements ...')
+    sq.n('3').b = 42
+    sq.delete_elem('13')
+    sq.pop()
+    sq.push(Foo('x', 3))
+    vals = sorted(foo.a for foo in sq.find(b = 3))
+    print('\tExpected matches = {0}, actual = {1}'.format(9, len(vals)))
+    assert(len(vals) == 9 and '3' not in vals and 'x' in vals)
+    vals = [foo.a for foo in sq.find(b = 42)]
+    print('\tExpected values = {0}, actual = {1}'.format(['3'], vals))
+    assert(vals == ['3'])
+    print('\tFinding by unindexed field ...')
+    try:
+        sq.find(a = '3')
+        assert(False)
+    except ValueError:
+        print('\tFind correctly failed.')
+
+    print('Testing range scans through an ordered index ...')
+    sq = superq([Foo(str(i), (i * 37) % 100) for i in range(100)],
+                keyCol = 'a')
+    sq.create_index('b', ordered = True)
+    vals = [foo.b for foo in sq.range('b', 10, 14)]
+    print('\tExpected values = {0}, actual = {1}'.format([10, 11, 12, 13, 14],
+                                                        vals))
+    assert(vals == [10, 11, 12, 13, 14])
+    print('\tUpdating and removing elements ...')
+    sq.n(sq.min('b').a).b = 1000
+    sq.delete_elem(sq.max('b').a)
+    vals = [foo.b for foo in sq.top('b', 3)]
+    print('\tExpected values = {0}, actual = {1}'.format([99, 98, 97], vals))
+    assert(vals == [99, 98, 97])
+    print('\tChecking ordered values ...')
+    vals = [foo.b for foo in sq.ordered('b')]
+    assert(vals == list(range(1, 100)))
+    print('\tPassed value check.')
+
+    print('Testing indexes after setting fields by key ...')
+    sq = superq([Foo2('x', 5, 5.0), Foo2('y', 7, 7.0)],
+                keyCol = 'a',
+                priority = 'b')
+    sq.create_index('b')
+    sq.create_index('c', ordered = True)
+    sq.n('x')['b'] = 9
+    sq.n('x')['c'] = 9.0
+    vals = [foo.a for foo in sq.find(b = 9)]
+    print('\tExpected values = {0}, actual = {1}'.format(['x'], vals))
+    assert(vals == ['x'] and sq.find(b = 5) == [])
+    vals = [foo.a for foo in sq.range('c', 8.0, 10.0)]
+    print('\tExpected values = {0}, actual = {1}'.format(['x'], vals))
+    assert(vals == ['x'])
+    foo = sq.pop_min()
+    print('\tExpected value = {0}, actual = {1}'.format('y', foo.a))
+    assert(foo.a == 'y')
+
+    print('Testing non-threadsafe superq ...')
+    sq = superq([1, 2, 3], threadsafe = False)
+    sq.push(4)
+    val = sq.pop()
+    print('\tExpected value = {0}, actual = {1}'.format(4, val))
+    assert(val == 4)
+    print('\tExpected superq length = {0}, actual = {1}'.format(3, len(sq)))
+    assert(len(sq) == 3)
+    sq.pop_many(3)
+    print('\tPopping from empty superq ...')
+    try:
+        sq.pop()
+        assert(False)
+    except SuperQEmpty:
+        print('\tPop correctly failed.')
+    print('\tAttempting to attach superq ...')
+    try:
+        sq.attach()
+        assert(False)
+    except ValueError:
+        print('\tAttach correctly failed.')
+
     print('\nHOSTED superq tests:\n')
 
     print('Testing empty public superq creation ...')
@@ -765,6 +1235,168 @@ try:
     print('\tDeleting superq ...')
     sq.delete()
 
+    print('Testing compressed bytearray superq ...')
+    fooA = Foo4(bytearray(b'superq' * 1000))
+    fooB = Foo4(bytearray(b'sq'))
+    sq = superq([fooA, fooB],
+                name = 'sqCodec',
+                codec = {'a': 'zlib'},
+                host = 'local',
+                attach = True)
+    sq = superq('sqCodec', host = 'local', attach = True)
+    print('\tExpected codec = {0}, actual = {1}'.format({'a': 'zlib'},
+                                                       sq.codec))
+    assert(sq.codec == {'a': 'zlib'})
+    sqeA = sq.n(0)
+    print('\tExpected compressed size < {0}, actual = {1}'.format(
+        1000, len(sqeA.values[0])))
+    assert(len(sqeA.values[0]) < 1000)
+    assert(sqeA.a == fooA.a and sq.n(1).a == fooB.a)
+    sqeA.a = bytearray(b'qs' * 2000)
+    sq = superq('sqCodec', host = 'local', attach = True)
+    assert(sq.n(0).a == bytearray(b'qs' * 2000))
+    print('\tComparisons successful.')
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing extending hosted superq in a single request ...')
+    print('\tCreating superq ...')
+    sq = superq([], keyCol = 'a', name = 'sqExt', attach = True, host = 'local')
+    print('\tExtending superq ...')
+    sq.extend([Foo(str(i), i) for i in range(100)])
+    print('\tRe-loading superq ...')
+    sq = superq('sqExt', host = 'local', attach = True)
+    print('\tExpected superq length = {0}, actual = {1}'.format(100, len(sq)))
+    assert(len(sq) == 100)
+    print('\tExpected value = {0}, actual = {1}'.format(42, sq['42'].b))
+    assert(sq['42'].b == 42)
+    print('\tPopping many elements in a single request ...')
+    vals = [foo.b for foo in sq.pop_many(10)]
+    print('\tExpected values = {0}, actual = {1}'.format(list(range(99, 89, -1)),
+                                                        vals))
+    assert(vals == list(range(99, 89, -1)))
+    sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(0))
+    print('\tExpected result length = {0}, actual = {1}'.format(90,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 90)
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing rotating hosted superq ...')
+    sq = superq(list(range(10)), name = 'sqRotate', attach = True, host = 'local')
+    sq.rotate(-4)
+    sq.pop_many(3)
+    sq = superq('sqRotate', host = 'local', attach = True)
+    print('\tExpected values = {0}, actual = {1}'.format([4, 5, 6, 7, 8, 9, 0],
+                                                        sq.list()))
+    assert(sq.list() == [4, 5, 6, 7, 8, 9, 0])
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing hosted ring buffer superq ...')
+    sq = superq([Foo(str(i), i) for i in range(3)],
+                keyCol = 'a',
+                name = 'sqRing',
+                maxlen = 3,
+                ring = True,
+                attach = True,
+                host = 'local')
+    for i in range(3, 8):
+        sq.create_elem(Foo(str(i), i))
+    sq = superq('sqRing', host = 'local', attach = True)
+    vals = [foo.b for foo in sq]
+    print('\tExpected values = {0}, actual = {1}'.format([5, 6, 7], vals))
+    assert(vals == [5, 6, 7])
+    sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(0))
+    print('\tExpected result length = {0}, actual = {1}'.format(3,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 3)
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing sampling hosted superq ...')
+    sq = superq([Foo(str(i), i) for i in range(20)],
+                keyCol = 'a',
+                name = 'sqSample',
+                attach = True,
+                host = 'local')
+    sq.objSample = Foo('a', 1)
+    vals = [foo.b for foo in sq.sample(5)]
+    print('\tExpected {0} distinct values, actual = {1}'.format(5,
+                                                               len(set(vals))))
+    assert(len(set(vals)) == 5 and set(vals) <= set(range(20)))
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing hosted superq field types over the wire ...')
+    sq = superq([Foo2('ключ\n', -7, 2.5), Foo2('b', 2 ** 40, -0.125)],
+                keyCol = 'a',
+                name = 'sqWire',
+                attach = True,
+                host = 'local')
+    sq = superq('sqWire', host = 'local', attach = True)
+    sq.objSample = Foo2('a', 1, 1.0)
+    vals = [(foo.a, foo.b, foo.c) for foo in sq]
+    expected = [('ключ\n', -7, 2.5), ('b', 2 ** 40, -0.125)]
+    print('\tExpected values = {0}, actual = {1}'.format(expected, vals))
+    assert(vals == expected)
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing large hosted bytearrays sent out of band ...')
+    blob = bytearray(range(256)) * (4 * OUT_OF_BAND_THRESHOLD // 256)
+    sq = superq([Foo4(blob), Foo4(bytearray(b'sq'))],
+                name = 'sqBlob',
+                host = 'local',
+                attach = True)
+    sq.push(Foo4(blob[ : : -1]))
+    sq = superq('sqBlob', host = 'local', attach = True)
+    print('\tExpected length = {0}, actual = {1}'.format(len(blob),
+                                                        len(sq.n(0).a)))
+    assert(sq.n(0).a == blob)
+    assert(sq.n(1).a == bytearray(b'sq'))
+    assert(sq.n(2).a == blob[ : : -1])
+    sq.n(1).a = blob
+    sq = superq('sqBlob', host = 'local', attach = True)
+    assert(sq.n(1).a == blob)
+    assert(sq.pop().a == blob[ : : -1])
+    print('\tComparisons successful.')
+    print('\tDeleting superq ...')
+    sq.delete()
+
+    print('Testing out of band frame headers ...')
+    sender, receiver = socketpair()
+    send_frame(sender, b'msg', [b'ab', b'cde'], outOfBand = True)
+    data, buffers = recv_frame(receiver, outOfBand = True)
+    assert(data == b'msg' and buffers == [b'ab', b'cde'])
+    for header in [pack('II', 0, MAX_FRAME_BUFFERS + 1),
+                   pack('IIQ', 0, 1, MAX_FRAME_SIZE + 1)]:
+        sender.sendall(header)
+        try:
+            recv_frame(receiver, outOfBand = True)
+            raise Exception('\tExpected failure did not occur.')
+        except MalformedNetworkRequest:
+            print('\tOversized frame header correctly failed.')
+    sender.close()
+    receiver.close()
+
+    print('Testing popping hosted superq by priority ...')
+    sq = superq([Foo(str(i), i % 7) for i in range(20)],
+                keyCol = 'a',
+                priority = 'b',
+                name = 'sqPriority',
+                attach = True,
+                host = 'local')
+    vals = [sq.pop_min().b for i in range(4)]
+    print('\tExpected values = {0}, actual = {1}'.format([0, 0, 0, 1], vals))
+    assert(vals == [0, 0, 0, 1])
+    sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(0))
+    print('\tExpected result length = {0}, actual = {1}'.format(16,
+                                                                len(sqResult)))
+    assert(len(sqResult) == 16)
+    print('\tDeleting superq ...')
+    sq.delete()
+
     print('Testing superq query returning single result ...')
     print('\tCreating new multi-element superq ...')
     myFoos = [Foo2('a', 1, .01),
@@ -1151,6 +1783,30 @@ try:
     print('\tDeleting save file ...')
     remove('superq_test.sq')
 
+    print('Testing binary snapshot save\\restore ...')
+    for codec in ['none', 'zlib']:
+        print('\tCreating superq ...')
+        sq = superq([Foo2(str(i), i, i / 2) for i in range(1000)],
+                    keyCol = 'a',
+                    name = 'sqSnap',
+                    attach = True)
+        print('\tSaving {0} snapshot ...'.format(codec))
+        sq.save('superq_test.sq', binary = True, codec = codec)
+        sq.delete()
+        print('\tRestoring superq ...')
+        sq = superq('superq_test.sq', attach = True, buildFromFile = True)
+        sqResult = sq.query(['a'], ['<self>'], 'b >= {0}'.format(990))
+        print('\tExpected result length = {0}, actual = {1}'.format(
+            10, len(sqResult)))
+        assert(len(sqResult) == 10)
+        print('\tExpected value = {0}, actual = {1}'.format(499.5,
+                                                           sq.n('999').c))
+        assert(len(sq) == 1000 and sq.n('999').c == 499.5)
+        print('\tDeleting superq ...')
+        sq.delete()
+        print('\tDeleting save file ...')
+        remove('superq_test.sq')
+
     print('\nSTRESS tests:\n')
 
     print('Creating hosted superq for maxlen tests ...')
@@ -1221,6 +1877,7 @@ try:
             sqCompleted.push(val)
             with lockObj:
                 items_consumed += 1
+            sqPending.task_done()
     
     print('Testing multi-Producer, multi-Consumer hosted superq ...')
     print('\tCreating pending jobs superq ...')
@@ -1253,10 +1910,9 @@ try:
     print('\t\tElapsed time: {0}'.format(round(time.time() - producersStart,
                                                3)))
     print('\tWaiting for consumers to consume all items ...')
-    while items_consumed < total_items:
-        print('\t\tConsumed: {0}'.format(items_consumed))
-        time.sleep(.5)
-    print('\t\tConsumed {0}'.format(total_items))
+    sqPending.join()
+    print('\t\tConsumed {0}'.format(items_consumed))
+    assert(items_consumed == total_items)
     print('\t\tElapsed time: {0}'.format(round(time.time() - consumersStart),
                                                3))
     len1 = len(superq('sqPending', attach = True, host = 'local'))
@@ -1271,6 +1927,37 @@ try:
     sqPending.delete()
     sqCompleted.delete()
 
+    print('Testing waiting on multiple superqs ...')
+    sqs = [superq([], name = 'sqWait{0}'.format(i)) for i in range(0, 3)]
+    print('\tExpected timeout result = {0}, actual = {1}'.format(
+        None, superq.wait_any(sqs, .1)))
+    assert(superq.wait_any(sqs, .1) is None)
+    def delayed_push(sq):
+        time.sleep(.2)
+        sq.push(1)
+    thread = Thread(target = delayed_push, args = (sqs[2],))
+    thread.start()
+    sq = superq.wait_any(sqs)
+    thread.join()
+    print('\tExpected ready superq = {0}, actual = {1}'.format('sqWait2',
+                                                              sq.name))
+    assert(sq is sqs[2] and sq.pop() == 1)
+    print('\tWaiting on hosted superqs ...')
+    sqs = [superq([],
+                  name = 'sqWait{0}'.format(i),
+                  attach = True,
+                  host = 'local') for i in range(0, 3)]
+    thread = Thread(target = delayed_push, args = (sqs[1],))
+    thread.start()
+    sq = superq.wait_any(sqs, 10)
+    thread.join()
+    print('\tExpected ready superq = {0}, actual = {1}'.format('sqWait1',
+                                                              sq.name))
+    assert(sq is sqs[1] and sq.pop() == 1)
+    print('\tDeleting superqs ...')
+    for sq in sqs:
+        sq.delete()
+
 ##    # When uncommented, the following test loops until interrupted
 ##    print('\nCIRCULAR superq test:\n')
 ##    sq = superq([1,2,3,2])